@@ -1,15 +1,30 @@
 import connexion
 import errno
+import functools
+import inspect
+import logging
+import starlette.middleware.cors
 import sys
+import time
 
 from flask_cors import CORS
 
 import app
+import app.events
+import app.hostRouting
+import app.jsonCodec
+import app.log
+import app.profiling
+import app.rateLimit
 import app.templateFilters
 
 from app.config import config
 from app.data import data
+from app.metrics import metrics
 from app.pluginCollection import pluginCollection
+from app.staticAssets import staticAssets
+
+logger = logging.getLogger('app')
 
 
 def error404(
@@ -23,6 +38,105 @@ def error404(
         )
 
 
+def asyncFunctionResolver(operationId: str):
+    """
+    Resolve operation to coroutine for async mode
+
+    The async variant of a function (suffix Async) is used if available,
+    otherwise the function is wrapped as coroutine running on the event loop.
+
+    Parameters
+    ----------
+    operationId : str
+        Operation id of openapi definition
+
+    Returns
+    -------
+    coroutine function
+        Handler of the operation
+    """
+    try:
+        return connexion.utils.get_function_from_name(operationId + 'Async')
+    except (ImportError, AttributeError, ValueError):
+        pass
+
+    function = connexion.utils.get_function_from_name(operationId)
+
+    @functools.wraps(function)
+    async def coroutine(*args, **kwargs):
+        return function(*args, **kwargs)
+
+    return coroutine
+
+
+def instrumentedFunctionResolver(functionResolver):
+    """
+    Wrap function resolver to record metrics of the app.status handlers
+
+    Duration (with count) and exceptions are recorded by endpoint and host.
+
+    Parameters
+    ----------
+    functionResolver : callable
+        Function resolver returning the handler of an operation id
+
+    Returns
+    -------
+    callable
+        Function resolver returning instrumented handlers
+    """
+    requestSeconds = metrics().histogram(
+        'spacestatus_request_duration_seconds',
+        'Duration of request handlers',
+        ('endpoint', 'host')
+    )
+    requestExceptions = metrics().counter(
+        'spacestatus_request_exceptions_total',
+        'Exceptions raised by request handlers',
+        ('endpoint', 'host')
+    )
+
+    def resolve(operationId: str):
+        function = functionResolver(operationId)
+        if not operationId.startswith('app.status.'):
+            return function
+
+        endpoint = operationId.rsplit('.', 1)[-1]
+
+        def record(started: float, failed: bool):
+            labels = (endpoint, connexion.request.headers.get('Host', ''))
+            requestSeconds.observe(labels, time.perf_counter() - started)
+            if failed:
+                requestExceptions.inc(labels)
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def instrumented(*args, **kwargs):
+                started = time.perf_counter()
+                failed = True
+                try:
+                    result = await function(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    record(started, failed)
+        else:
+            @functools.wraps(function)
+            def instrumented(*args, **kwargs):
+                started = time.perf_counter()
+                failed = True
+                try:
+                    result = function(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    record(started, failed)
+
+        return instrumented
+
+    return resolve
+
+
 def initApp() -> connexion:
     """
     Initialize Connexion/Flask Application
@@ -33,31 +147,113 @@ def initApp() -> connexion:
         Connexion app instance
     """
 
-    print('%s v%s starting...' % (app.__name__, app.__version__))
+    # Write log records in a background thread
+    app.log.logQueue().start()
+    app.log.logQueue().configure(config().getSection('logging'))
+    config().addReloadListener(
+        lambda oldSnapshot, snapshot:
+            app.log.logQueue().configure(snapshot.config.get('logging') or {})
+    )
+    logger.info('%s v%s starting...', app.__name__, app.__version__)
 
     # Create the application instance
-    flaskApp = connexion.FlaskApp(app.__name__, specification_dir='./')
+    if config().getSection('server').get('async', False):
+        logger.info('Use async mode')
+        connexionApp = connexion.AsyncApp(
+            app.__name__,
+            specification_dir='./',
+            jsonifier=app.jsonCodec.jsonifier()
+        )
+        functionResolver = instrumentedFunctionResolver(
+            asyncFunctionResolver
+        )
+    else:
+        connexionApp = connexion.FlaskApp(
+            app.__name__,
+            specification_dir='./',
+            jsonifier=app.jsonCodec.jsonifier()
+        )
+        connexionApp.app.json = \
+            app.jsonCodec.flaskJsonProvider(connexionApp.app)
+        functionResolver = instrumentedFunctionResolver(
+            connexion.utils.get_function_from_name
+        )
+
+    # Profile handlers running in worker threads (only if enabled on startup
+    # to add no overhead otherwise)
+    profiling = config().getSection('profiling').get('enabled', False)
+    if profiling:
+        functionResolver = \
+            app.profiling.profiledFunctionResolver(functionResolver)
 
     # Read the openapi yaml file to configure the endpoints
-    flaskApp.add_api(
+    connexionApp.add_api(
         'api/openapi3.yaml',
+        resolver=connexion.resolver.Resolver(
+            function_resolver=functionResolver
+        ),
+        validator_map=app.jsonCodec.validatorMap,
         swagger_ui_options=connexion.options.SwaggerUIOptions(swagger_ui=False)
     )
 
     # Add error handler for HTTP 404
-    flaskApp.add_error_handler(404, error404)
+    connexionApp.add_error_handler(404, error404)
 
     # Add ContextMiddleware (required to get hostname on api auth)
-    flaskApp.add_middleware(
+    connexionApp.add_middleware(
         connexion.middleware.context.ContextMiddleware,
         position=connexion.middleware.MiddlewarePosition.BEFORE_SECURITY
     )
 
+    # Resolve host and reject unknown hosts before everything else
+    connexionApp.add_middleware(
+        app.hostRouting.hostRoutingMiddleware,
+        position=connexion.middleware.MiddlewarePosition.BEFORE_EXCEPTION
+    )
+
+    # Set host and request id of log records
+    connexionApp.add_middleware(
+        app.log.requestContextMiddleware,
+        position=connexion.middleware.MiddlewarePosition.BEFORE_EXCEPTION
+    )
+
+    # Profile requests on demand or by sampling
+    if profiling:
+        connexionApp.add_middleware(
+            app.profiling.profilingMiddleware,
+            position=connexion.middleware.MiddlewarePosition.BEFORE_EXCEPTION
+        )
+
+    # Limit requests by client before authentication and routing
+    connexionApp.add_middleware(
+        app.rateLimit.rateLimitMiddleware,
+        position=connexion.middleware.MiddlewarePosition.BEFORE_ROUTING
+    )
+
+    # Serve status events directly on the event loop
+    app.events.eventBroker()
+    connexionApp.add_middleware(
+        app.events.eventMiddleware,
+        position=connexion.middleware.MiddlewarePosition.BEFORE_ROUTING
+    )
+
     # Add CORS support
-    CORS(flaskApp.app)
+    if isinstance(connexionApp, connexion.FlaskApp):
+        CORS(connexionApp.app)
+    else:
+        connexionApp.add_middleware(
+            starlette.middleware.cors.CORSMiddleware,
+            position=connexion.middleware.MiddlewarePosition.BEFORE_EXCEPTION,
+            allow_origins=['*'],
+            allow_methods=['*'],
+            allow_headers=['*']
+        )
 
     # Initialize own jinja2 filters
-    app.templateFilters.initialize(flaskApp)
+    app.templateFilters.initialize(connexionApp)
+
+    # Load static files into memory
+    staticAssets()
 
     # Initialize plugins
     try:
@@ -65,8 +261,11 @@ def initApp() -> connexion:
     except LookupError:
         sys.exit(errno.EINTR)
 
-    print('%s v%s started successfully' % (app.__name__, app.__version__))
-    return flaskApp
+    # Reload configuration on change
+    config().watch()
+
+    logger.info('%s v%s started successfully', app.__name__, app.__version__)
+    return connexionApp
 
 
 if __name__ == '__main__':
@@ -1,11 +1,24 @@
 import connexion
+import hmac
 
-from app.config import config
+from app.config import config, keyDigest
+from app.metrics import metrics
 
+# Failed authentications by host
+__authFailures = metrics().counter(
+    'spacestatus_auth_failures_total',
+    'Failed api key authentications',
+    ('host',)
+)
 
-def auth(token: str, required_scopes=None) -> dict:
+
+async def auth(token: str, required_scopes=None) -> dict:
     """Check api key authentication
 
+    Runs on the event loop as part of the security middleware. The token is
+    compared as digest in constant time against all valid keys of the host
+    and url rule, so rotated keys could be valid at the same time.
+
     Parameters
     ----------
     token : string
@@ -18,18 +31,22 @@ def auth(token: str, required_scopes=None) -> dict:
     dict
         Informations about user (empty, not used)
     """
-    authKey = config().getKey(connexion.request.headers['Host'])
-    if (isinstance(authKey, str)):
-        # Validate against single auth key
-        if token == authKey:
+    # Configured hostname (resolved by hostRoutingMiddleware)
+    host = connexion.request.headers.get('Host', '')
+    authDigests = config().getKeyDigests(
+        host, str(connexion.request.url.path)
+    )
+    if authDigests:
+        tokenDigest = keyDigest(token)
+
+        # Compare against all keys without stopping on first match
+        valid = False
+        for authDigest in authDigests:
+            valid |= hmac.compare_digest(tokenDigest, authDigest)
+
+        if valid:
             return {}
-    elif (isinstance(authKey, dict)):
-        # Validate against url rule name auth key
-        try:
-            if token == authKey[str(connexion.request.url.path)]:
-                return {}
-        except KeyError:
-            pass
-
-    # No valid key found
+
+    # Unknown host or no valid key found
+    __authFailures.inc((host,))
     raise connexion.exceptions.OAuthProblem('Authentication error')
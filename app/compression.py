@@ -0,0 +1,110 @@
+import brotli
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression functions with level by content encoding in order of
+# preference
+encoders = {
+    'br': lambda content, level: brotli.compress(content, quality=level),
+}
+if zstandard is not None:
+    encoders['zstd'] = lambda content, level: \
+        zstandard.ZstdCompressor(level=level).compress(content)
+encoders['gzip'] = \
+    lambda content, level: gzip.compress(content, level, mtime=0)
+
+# Levels by content encoding for responses compressed on demand, moderate
+# to keep the latency of the first request after a change low
+levels = {'br': 5, 'zstd': 3, 'gzip': 6}
+
+# Levels by content encoding for files compressed once on startup
+staticLevels = {'br': 11, 'zstd': 19, 'gzip': 9}
+
+
+def parseAcceptEncoding(acceptEncoding: str) -> dict:
+    """Parse Accept-Encoding header
+
+    Parameters
+    ----------
+    acceptEncoding : str
+        Value of the Accept-Encoding header
+
+    Returns
+    -------
+    dict
+        Quality value by content encoding (lowercase)
+    """
+    qualities = {}
+    for part in acceptEncoding.split(','):
+        encoding, _, parameters = part.strip().partition(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        try:
+            qualities[encoding] = float(
+                parameters.strip().removeprefix('q=') or 1
+            )
+        except ValueError:
+            continue
+    return qualities
+
+
+def negotiate(acceptEncoding: str, available=None) -> str:
+    """Select content encoding accepted by the client
+
+    The encoding with the highest quality value is selected, on equal
+    values the order of encoders decides.
+
+    Parameters
+    ----------
+    acceptEncoding : str
+        Value of the Accept-Encoding header
+    available : iterable
+        Available content encodings (all encoders if not set)
+
+    Returns
+    -------
+    str
+        Content encoding (None for identity)
+    """
+    qualities = parseAcceptEncoding(acceptEncoding)
+    if not qualities:
+        return None
+
+    if available is None:
+        available = encoders
+    encoding = max(
+        (e for e in encoders if e in available),
+        key=lambda e: qualities.get(e, qualities.get('*', 0)),
+        default=None
+    )
+    if encoding is None or \
+            qualities.get(encoding, qualities.get('*', 0)) <= 0:
+        return None
+    return encoding
+
+
+def compress(content: bytes, encoding: str, static: bool = False) -> bytes:
+    """Compress content
+
+    Parameters
+    ----------
+    content : bytes
+        Uncompressed content
+    encoding : str
+        Content encoding (see encoders)
+    static : bool
+        Use maximum levels for content compressed once (see staticLevels)
+
+    Returns
+    -------
+    bytes
+        Compressed content
+    """
+    return encoders[encoding](
+        content, (staticLevels if static else levels)[encoding]
+    )
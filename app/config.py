@@ -1,8 +1,164 @@
+import copy
+import fnmatch
+import hashlib
+import logging
 import os
+import re
 import pydeepmerge
 import sys
+import threading
+import time
+import types
 import yaml
 
+logger = logging.getLogger(__name__)
+
+
+def keyDigest(key: str) -> bytes:
+    """Get digest of an api key
+
+    Parameters
+    ----------
+    key : str
+        Api key
+
+    Returns
+    -------
+    bytes
+        SHA-256 digest
+    """
+    return hashlib.sha256(key.encode('utf-8')).digest()
+
+
+def normalizeHost(host: str) -> str:
+    """Normalize value of a host header
+
+    Parameters
+    ----------
+    host : str
+        Host header (e.g. Status.Example.org:443)
+
+    Returns
+    -------
+    str
+        Lowercase hostname without port and trailing dot
+    """
+    host = host.strip().lower()
+
+    # Strip port (also of IPv6 addresses in brackets)
+    if host.rfind(':') > host.rfind(']'):
+        host = host[:host.rfind(':')]
+
+    return host.rstrip('.')
+
+
+class configSnapshot:
+    """
+    Immutable state of a loaded configuration with derived lookup tables
+
+    A reload builds a new snapshot and swaps it in as a whole, so readers
+    always see a consistent configuration.
+    """
+
+    __slots__ = (
+        'config', 'modified', 'hostfiles', 'keys', 'keyIndex', 'plugins',
+        'routes', 'routePatterns'
+    )
+
+    def __init__(self, configuration: dict, modified: float):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        configuration : dict
+            Validated configuration
+        modified : float
+            Modification time of the configuration file
+        """
+        self.config = configuration
+        self.modified = modified
+
+        hosts = configuration['hosts']
+        self.hostfiles = types.MappingProxyType(
+            {k: v['file'] for k, v in hosts.items()}
+        )
+        self.keys = types.MappingProxyType(
+            {k: v['key'] for k, v in hosts.items()}
+        )
+
+        # Digests of valid api keys by normalized host and url rule (None for
+        # all url rules)
+        self.keyIndex = types.MappingProxyType({
+            normalizeHost(k): self.__buildKeyIndex(v['key'])
+            for k, v in hosts.items()
+        })
+
+        # Configured host by normalized hostname and alias, wildcard aliases
+        # as list of compiled pattern and configured host
+        routes = {}
+        self.routePatterns = []
+        for k, v in hosts.items():
+            for alias in [k] + list(v.get('aliases') or []):
+                alias = normalizeHost(alias)
+                if '*' in alias or '?' in alias:
+                    self.routePatterns.append(
+                        (re.compile(fnmatch.translate(alias)), k)
+                    )
+                else:
+                    routes.setdefault(alias, k)
+        self.routes = types.MappingProxyType(routes)
+
+        # Merged configuration of all plugins by host
+        pluginNames = set(configuration.get('plugins') or {})
+        for hostConfig in hosts.values():
+            pluginNames.update(hostConfig.get('plugins') or {})
+        self.plugins = types.MappingProxyType({
+            plugin: self.__mergePluginConfig(configuration, plugin)
+            for plugin in pluginNames
+        })
+
+    def __buildKeyIndex(self, key) -> dict:
+        """Get digests of api keys by url rule
+
+        Parameters
+        ----------
+        key : str, list or dict
+            Api key, list of api keys (rotation) or api keys by url rule
+
+        Returns
+        -------
+        dict
+            Sets of digests by url rule
+        """
+        def digests(keys) -> frozenset:
+            if isinstance(keys, str):
+                keys = [keys]
+            return frozenset(keyDigest(k) for k in keys)
+
+        if isinstance(key, dict):
+            return {rule: digests(keys) for rule, keys in key.items()}
+
+        return {None: digests(key)}
+
+    def __mergePluginConfig(self, configuration: dict, plugin: str) -> dict:
+        pluginHostConfig = {
+            k: (v.get('plugins') or {}).get(plugin) or {}
+            for k, v in configuration['hosts'].items()
+        }
+
+        try:
+            pluginConfig = configuration['plugins'][plugin] or {}
+        except (KeyError, TypeError):
+            pluginConfig = {}
+
+        for host, hostConfig in pluginHostConfig.items():
+            pluginHostConfig[host] = pydeepmerge.deep_merge(
+                pluginConfig, hostConfig
+            )
+
+        return pluginHostConfig
+
 
 class config:
     """Data ORM for config"""
@@ -10,18 +166,30 @@ class config:
     # Singleton instance
     __instance = None
 
-    # Data in memory
-    __config = {}
+    # Filename of the configuration
+    __filename = 'config/config.yaml'
+
+    # Current configuration snapshot
+    __snapshot = None
+
+    # Functions called with old and new snapshot after reload
+    __reloadListeners = []
+
+    # Thread watching the configuration file
+    __watcher = None
+
+    # Lock to serialize reloads
+    __reloadLock = threading.Lock()
 
     def __new__(singletonClass):
         """Instantiate singleton class"""
         if singletonClass.__instance is None:
-            print('Initialize config orm object...')
+            logger.info('Initialize config orm object...')
             singletonClass.__instance = \
                 super(config, singletonClass).__new__(singletonClass)
             singletonClass.__load(
                     singletonClass.__instance,
-                    'config/config.yaml'
+                    singletonClass.__filename
             )
         return singletonClass.__instance
 
@@ -33,68 +201,233 @@ class config:
         filename : str
             Filename of the yaml configuration file
         """
+        snapshot = self.__parse(filename)
+
+        # Stop if any error occured
+        if snapshot is None:
+            sys.exit(1)
+
+        self.__snapshot = snapshot
+
+    def __parse(self, filename: str) -> configSnapshot:
+        """Read and check configuration from yaml file
+
+        Parameters
+        ----------
+        filename : str
+            Filename of the yaml configuration file
+
+        Returns
+        -------
+        configSnapshot
+            Loaded configuration (None on configuration errors)
+        """
 
         configErrors = False
 
         # Read configuration from yaml file
-        with open(filename, 'r') as configfile:
-            self.__config = yaml.load(configfile, Loader=yaml.FullLoader)
+        modified = os.path.getmtime(filename)
+        try:
+            with open(filename, 'r') as configfile:
+                configuration = yaml.load(configfile, Loader=yaml.FullLoader)
+        except yaml.YAMLError as e:
+            logger.error("Configcheck: Invalid yaml: %s", e)
+            return None
 
         # Test if at least one host is defined
-        if 'hosts' not in self.__config or self.__config['hosts'] is None:
-            print("Configcheck: No hosts defined", file=sys.stderr)
-            configErrors = True
+        if (
+            not isinstance(configuration, dict) or
+            'hosts' not in configuration or
+            configuration['hosts'] is None
+           ):
+            logger.error("Configcheck: No hosts defined")
+            return None
 
         # Test host configuration
-        for host, hostdata in self.__config['hosts'].items():
+        for host, hostdata in configuration['hosts'].items():
 
             # file parameter is mandatory
             if 'file' not in hostdata:
-                print(
-                    "Configcheck: API json file for %s not defined" % host,
-                    file=sys.stderr
+                logger.error(
+                    "Configcheck: API json file for %s not defined",
+                    host
                 )
                 configErrors = True
             # file must exist
             elif not os.path.isfile("config/apidata/%s" % hostdata['file']):
-                print(
-                    "Configcheck: API file for %s did not exist" % host,
-                    file=sys.stderr
+                logger.error(
+                    "Configcheck: API file for %s did not exist",
+                    host
                 )
                 configErrors = True
 
             # key parameter is mandatory
             if 'key' not in hostdata:
-                print(
-                    "Configcheck: API key for %s not defined" % host,
-                    file=sys.stderr
+                logger.error("Configcheck: API key for %s not defined", host)
+                configErrors = True
+            # key must be a string, a list or url rules with string or list
+            elif not self.__isValidKey(hostdata['key']):
+                logger.error("Configcheck: API key for %s not valid", host)
+                configErrors = True
+
+            # aliases must be a list of hostnames or patterns
+            if not isinstance(hostdata.get('aliases', []), list):
+                logger.error(
+                    "Configcheck: Aliases for %s are not a list",
+                    host
                 )
                 configErrors = True
 
-        # Stop if any error occured
         if configErrors:
-            sys.exit(1)
+            return None
+
+        return configSnapshot(configuration, modified)
+
+    def __isValidKey(self, key, rules: bool = True) -> bool:
+        if isinstance(key, str):
+            return len(key) > 0
+        if isinstance(key, list):
+            return len(key) > 0 and all(
+                isinstance(k, str) and len(k) > 0 for k in key
+            )
+        if isinstance(key, dict) and rules:
+            return all(
+                isinstance(rule, str) and self.__isValidKey(k, False)
+                for rule, k in key.items()
+            )
+        return False
+
+    def addReloadListener(self, listener):
+        """Add function called after the configuration was reloaded
+
+        The listener gets the old and the new configSnapshot. Listeners
+        run in the watcher thread in the order they were added.
+
+        Parameters
+        ----------
+        listener : callable
+            Function with parameters old and new snapshot
+        """
+        self.__reloadListeners.append(listener)
+
+    def watch(self):
+        """Reload configuration on change (server.configreload seconds)"""
+        interval = self.getSection('server').get('configreload', 5)
+        if interval <= 0 or self.__watcher is not None:
+            return
+
+        self.__watcher = threading.Thread(
+            target=self.__watch,
+            args=[interval],
+            name='config-watcher',
+            daemon=True
+        )
+        self.__watcher.start()
+
+    def __watch(self, interval: float):
+        """Poll modification time of the configuration file"""
+        while True:
+            time.sleep(interval)
+            try:
+                if os.path.getmtime(self.__filename) != \
+                        self.__snapshot.modified:
+                    self.reload()
+            except OSError as e:
+                logger.error('Configuration reload failed: %s', e)
+
+    def reload(self) -> bool:
+        """Reload configuration if it is valid
+
+        Returns
+        -------
+        bool
+            New configuration was loaded
+        """
+        with self.__reloadLock:
+            logger.info('Reload configuration...')
+            snapshot = self.__parse(self.__filename)
+
+            if snapshot is None:
+                # Keep current configuration, but do not try again until
+                # the file changes
+                logger.error('Configuration not valid, keep current one.')
+                self.__snapshot = configSnapshot(
+                    self.__snapshot.config, os.path.getmtime(self.__filename)
+                )
+                return False
+
+            oldSnapshot = self.__snapshot
+            self.__snapshot = snapshot
+
+            for listener in self.__reloadListeners:
+                try:
+                    listener(oldSnapshot, snapshot)
+                except Exception as e:
+                    logger.error(
+                        'Configuration reload listener failed: %s',
+                        repr(e)
+                    )
+
+            logger.info('Configuration reloaded.')
+            return True
 
     def getConfig(self) -> dict:
-        return self.__config
+        return self.__snapshot.config
+
+    def getSection(self, section: str) -> dict:
+        """Get optional top level configuration section
+
+        Parameters
+        ----------
+        section : str
+            Name of the section
+
+        Returns
+        -------
+        dict
+            Configuration of section (empty if not defined)
+        """
+        try:
+            return self.__snapshot.config[section] or {}
+        except KeyError:
+            return {}
 
     def getPluginConfig(self, plugin: str) -> dict:
-        pluginHostConfig = {
-            k: (v['plugins'][plugin] if plugin in v['plugins'] else {})
-            for k, v in self.__config['hosts'].items()
-        }
+        """Get configuration of a plugin by host
 
+        Parameters
+        ----------
+        plugin : str
+            Name of the plugin
+
+        Returns
+        -------
+        dict
+            Configuration merged with plugin defaults by host (copy)
+        """
+        snapshot = self.__snapshot
         try:
-            pluginConfig = self.__config['plugins'][plugin]
+            return copy.deepcopy(snapshot.plugins[plugin])
         except KeyError:
-            pluginConfig = {}
+            return {host: {} for host in snapshot.hostfiles}
 
-        for host, hostConfig in pluginHostConfig.items():
-            pluginHostConfig[host] = pydeepmerge.deep_merge(
-                pluginConfig, hostConfig
-            )
+    def isPluginEnabled(self, plugin: str) -> bool:
+        """Check if a plugin is enabled for any host
 
-        return pluginHostConfig
+        Parameters
+        ----------
+        plugin : str
+            Name of the plugin
+
+        Returns
+        -------
+        bool
+        """
+        return any(
+            hostConfig.get('enabled', False)
+            for hostConfig in
+            self.__snapshot.plugins.get(plugin, {}).values()
+        )
 
     def getHostfiles(self) -> dict:
         """Get dict of hosts (key) with hostfile (value)
@@ -102,9 +435,9 @@ class config:
         Returns
         -------
         dict
-            Hosts with hostfile
+            Hosts with hostfile (read-only)
         """
-        return {k: v['file'] for k, v in self.__config['hosts'].items()}
+        return self.__snapshot.hostfiles
 
     def getHostfile(self, hostname: str) -> str:
         """Get hostfile for hostname
@@ -114,7 +447,58 @@ class config:
         str
             Filename for hostname
         """
-        return self.__config['hosts'][hostname]['file']
+        return self.__snapshot.hostfiles[hostname]
+
+    def resolveHost(self, host: str) -> str:
+        """Get configured host for the value of a host header
+
+        Parameters
+        ----------
+        host : str
+            Host header
+
+        Returns
+        -------
+        str
+            Configured hostname (None if unknown)
+        """
+        snapshot = self.__snapshot
+        host = normalizeHost(host)
+        try:
+            return snapshot.routes[host]
+        except KeyError:
+            pass
+
+        for pattern, configuredHost in snapshot.routePatterns:
+            if pattern.match(host):
+                return configuredHost
+
+        return None
+
+    def getKeyDigests(self, host: str, rule: str) -> frozenset:
+        """Get digests of valid api keys for a host and url rule
+
+        Parameters
+        ----------
+        host : str
+            Configured hostname (see resolveHost), compared case-insensitive
+        rule : str
+            Url rule (path)
+
+        Returns
+        -------
+        frozenset
+            Digests of valid api keys (None if the host is unknown)
+        """
+        try:
+            hostIndex = self.__snapshot.keyIndex[normalizeHost(host)]
+        except KeyError:
+            return None
+
+        try:
+            return hostIndex[rule]
+        except KeyError:
+            return hostIndex.get(None, frozenset())
 
     def getKey(self, host: str) -> str:
         """Get api key for a host
@@ -129,4 +513,4 @@ class config:
         dict
             Hosts with hostfile
         """
-        return self.__config['hosts'][host]['key']
+        return self.__snapshot.keys[host]
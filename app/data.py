@@ -1,30 +1,112 @@
+import atexit
+import contextlib
+import copy
 import datetime
 import glob
-import json
+import logging
 import os
 import safer
+import threading
 import time
 
+import app.jsonCodec
 from app.config import config
+from app.history import sensorHistory
+from app.metrics import metrics
+from app.sharedState import sharedState
+
+logger = logging.getLogger(__name__)
 
 
 class data:
-    """Data ORM for api files"""
+    """
+    Data ORM for api files
+
+    The data of every host is published as snapshot which is never modified
+    afterwards. Changes are applied to a copy within a transaction and
+    published by replacing the snapshot, so readers never need a lock.
+    """
 
     # Singleton instance
     __instance = None
 
-    # Data in memory
+    # Data in memory (published snapshots by host)
     __data = {}
 
+    # Lock for changes of host data (readers do not lock)
+    __mutationLock = threading.RLock()
+
+    # Working copies of open transactions by host
+    __working = {}
+
+    # Paths of containers copied in open transactions by host
+    __copied = {}
+
+    # Change records of open transactions by host
+    __changes = {}
+
+    # Functions to call after open transactions succeeded by host
+    __onSuccess = {}
+
+    # Functions called with hostname after every change
+    __changeListeners = []
+
+    # Data version by host, increased on every change (sequence of the
+    # shared state in multiprocess mode, so all processes agree on it)
+    __version = {}
+
+    # Shared state by host (multiprocess mode)
+    __sharedState = {}
+
+    # Last synchronized sequence of shared state by host
+    __sharedSequence = {}
+
+    # Number of committed updates not written to file by host
+    __pending = {}
+
+    # Filename of the loaded API file by host
+    __filename = {}
+
+    # Timer for delayed write by host
+    __writeTimer = {}
+
+    # Lock for delayed writes
+    __writeLock = threading.RLock()
+
+    # Change records not appended to journal by host
+    __journal = {}
+
+    # Time of last journal compaction by host
+    __lastCompaction = {}
+
+    # Duration of commits by host
+    __commitSeconds = metrics().histogram(
+        'spacestatus_data_commit_seconds',
+        'Duration of data commits (including immediate writes)',
+        ('host',)
+    )
+
+    # Bytes written to api files and journals by host
+    __writtenBytes = metrics().counter(
+        'spacestatus_data_written_bytes_total',
+        'Bytes written to api files (snapshot) and journals (journal)',
+        ('host', 'kind')
+    )
+
     def __new__(singletonClass):
         """Instantiate singleton class"""
         if singletonClass.__instance is None:
-            print('Initialize data orm object...')
+            logger.info('Initialize data orm object...')
             singletonClass.__instance = \
                 super(data, singletonClass).__new__(singletonClass)
             # Autoload data files
             singletonClass.__instance.__loadFiles(config().getHostfiles())
+            # Write pending updates on shutdown
+            atexit.register(singletonClass.__instance.flush)
+            # Load API files of new hosts on configuration reload
+            config().addReloadListener(
+                singletonClass.__instance.__onConfigReload
+            )
         return singletonClass.__instance
 
     def __loadFiles(self, hostfiles: dict):
@@ -36,12 +118,184 @@ class data:
             Configuration dictionary
         """
         for host, hostfile in hostfiles.items():
-            print('Load saved data for %s ...' % host)
+            logger.info('Load saved data for %s ...', host)
             filename = 'config/apidata/%s' % hostfile
-            with open(filename, 'r') as f:
-                self.__data[host] = json.load(f)
+            with open(filename, 'rb') as f:
+                self.__data[host] = app.jsonCodec.loads(f.read())
+            self.__filename[host] = filename
+            self.__version[host] = 0
+            self.__replayJournal(host, filename)
             self.__updateStructure(host)
 
+            if config().getSection('sharedstate').get('enabled', False):
+                self.__attachSharedState(host, filename)
+
+    def __onConfigReload(self, oldConfig, newConfig):
+        """Load API files of added hosts and hosts with changed file
+
+        Parameters
+        ----------
+        oldConfig : configSnapshot
+            Previous configuration
+        newConfig : configSnapshot
+            Reloaded configuration
+        """
+        hostfiles = {
+            host: hostfile
+            for host, hostfile in newConfig.hostfiles.items()
+            if oldConfig.hostfiles.get(host) != hostfile
+        }
+        if not hostfiles:
+            return
+
+        with self.__mutationLock:
+            for host in hostfiles:
+                if host in self.__filename:
+                    # Write pending updates to the previous file
+                    self.__writeDelayed(host)
+
+            versions = {
+                host: self.__version.get(host, -1) for host in hostfiles
+            }
+            self.__loadFiles(hostfiles)
+
+            # Versions continue, so cached responses are never reused
+            # (shared states keep their sequence)
+            for host, version in versions.items():
+                if host not in self.__sharedState:
+                    self.__version[host] = version + 1
+                self.__notifyChangeListeners(host)
+
+    def __replayJournal(self, host: str, filename: str):
+        """Apply change records of journal to loaded snapshot
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        filename : str
+            Filename of the API file (snapshot)
+        """
+        self.__journal[host] = []
+        self.__lastCompaction[host] = time.monotonic()
+
+        if not os.path.isfile('%s.journal' % filename):
+            return
+
+        records = 0
+        with open('%s.journal' % filename, 'r') as f:
+            for line in f:
+                try:
+                    self.__applyRecord(host, app.jsonCodec.loads(line))
+                    records += 1
+                except ValueError:
+                    # Ignore incomplete record of interrupted write
+                    pass
+        logger.info('Replayed %d journal records for %s ...', records, host)
+
+    def __applyRecord(self, host: str, record: dict):
+        """Apply a change record to host data
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        record : dict
+            Change record with path (p), value (v) or deletion flag (d)
+        """
+        node = self.__data[host]
+        for key in record['p'][:-1]:
+            node = node.setdefault(key, {})
+
+        if 'd' in record:
+            node.pop(record['p'][-1], None)
+        else:
+            node[record['p'][-1]] = record['v']
+
+    def __record(self, host: str, path: list, value=None, remove=False):
+        """Record a change of the open transaction
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        path : list
+            Keys of the changed field
+        value
+            New value of the field
+        remove : bool
+            Field was removed
+        """
+        record = {'p': path, 't': int(time.time())}
+        if remove:
+            record['d'] = 1
+        else:
+            record['v'] = value
+
+        self.__changes[host].append(record)
+
+    def __attachSharedState(self, host: str, filename: str):
+        """Attach host data to state shared with other worker processes
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        filename : str
+            Filename of the loaded API file
+        """
+        directory = \
+            config().getSection('sharedstate').get('directory', 'config/cache')
+        state = sharedState('%s/state-%s' % (directory, host))
+        self.__sharedState[host] = state
+
+        fileModified = os.path.getmtime(filename)
+        if os.path.isfile('%s.journal' % filename):
+            fileModified = max(
+                fileModified,
+                os.path.getmtime('%s.journal' % filename)
+            )
+
+        if (
+            state.getSequence() == 0 or
+            fileModified > os.path.getmtime(state.getFilename())
+           ):
+            # No state shared yet or API file changed since last run
+            logger.info('Publish shared state for %s ...', host)
+            self.__sharedSequence[host] = self.__version[host] = \
+                state.write(app.jsonCodec.dumps(self.__data[host]))
+        else:
+            # Use state shared by another worker process
+            logger.info('Use shared state for %s ...', host)
+            self.__sharedSequence[host] = None
+            self.__sync(host)
+
+    def __sync(self, host: str):
+        """Synchronize host data with state changed by another process
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        """
+        if host not in self.__sharedState:
+            return
+
+        state = self.__sharedState[host]
+        if state.getSequence() == self.__sharedSequence[host]:
+            return
+
+        with self.__mutationLock:
+            if host in self.__working:
+                return
+
+            sequence, payload = state.read()
+            self.__sharedSequence[host] = sequence
+            if payload is not None:
+                self.__data[host] = app.jsonCodec.loads(payload)
+                self.__version[host] = sequence
+                self.__notifyChangeListeners(host)
+
     def __updateStructure(self, host: str):
         """Update data structure for new version
 
@@ -56,7 +310,10 @@ class data:
             test = (self.__data[host]
                     ['additional_data']['lastchange']['temperature'])
         except KeyError:
-            print('Update: Add last change of temperature for %s ...' % host)
+            logger.info(
+                'Update: Add last change of temperature for %s ...',
+                host
+            )
             self.__data[host].update({
                 'additional_data':  {
                     'lastchange': {
@@ -65,26 +322,356 @@ class data:
                  }
             })
 
-    def commit(self, host: str) -> bool:
-        """Persist current API information to file
+    def __changed(self, host: str):
+        """Increase data version after the snapshot was replaced
+
+        In multiprocess mode the snapshot is published to the shared state
+        and its new sequence is used as version.
 
         Parameters
         ----------
         host : str
-            Host to persist
+            Hostname
+        """
+        if host in self.__sharedState:
+            self.__sharedSequence[host] = self.__version[host] = \
+                self.__sharedState[host].write(
+                    app.jsonCodec.dumps(self.__data[host])
+                )
+        else:
+            self.__version[host] += 1
+        self.__notifyChangeListeners(host)
+
+    def __notifyChangeListeners(self, host: str):
+        """Call all change listeners
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        """
+        for listener in self.__changeListeners:
+            listener(host)
+
+    def addChangeListener(self, listener):
+        """Add function to call after every change of host data
+
+        The function is called with the hostname while the change lock is
+        held, so it must return quickly.
+
+        Parameters
+        ----------
+        listener : callable
+            Function with parameter hostname
+        """
+        self.__changeListeners.append(listener)
+
+    @contextlib.contextmanager
+    def transaction(self, host: str):
+        """Change multiple fields of host data atomically
+
+        All changes within the transaction are applied to a working copy,
+        published with a single replacement of the snapshot and increase the
+        data version once. Nested transactions join the open transaction.
+        Reads within the transaction return the last published snapshot.
+        If an exception is raised, all changes are discarded. Side effects
+        (e.g. sensor history) are registered with __afterTransaction and
+        only run if the transaction succeeded.
+
+        In multiprocess mode the shared state stays locked from
+        synchronizing before the changes until publishing them, so changes
+        of other processes are never overwritten.
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        """
+        onSuccess = []
+        with self.__mutationLock:
+            if host in self.__working:
+                # Join open transaction
+                yield
+                return
+
+            sharedLock = self.__sharedState[host].lock() \
+                if host in self.__sharedState else contextlib.nullcontext()
+            with sharedLock:
+                self.__sync(host)
+                self.__working[host] = self.__data[host]
+                self.__copied[host] = set()
+                self.__changes[host] = []
+                self.__onSuccess[host] = []
+                try:
+                    yield
+
+                    if self.__changes[host]:
+                        # Publish new snapshot
+                        self.__data[host] = self.__working[host]
+                        self.__changed(host)
+
+                        if config().getSection('persistence').get(
+                                'journal', False
+                                ):
+                            with self.__writeLock:
+                                self.__journal[host].extend(
+                                    self.__changes[host]
+                                )
+                    onSuccess = self.__onSuccess[host]
+                finally:
+                    self.__working.pop(host)
+                    self.__copied.pop(host)
+                    self.__changes.pop(host)
+                    self.__onSuccess.pop(host)
+
+        for function in onSuccess:
+            function()
+
+    def __afterTransaction(self, host: str, function):
+        """Call function after the open transaction of a host succeeded
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        function : callable
+            Function without parameters
+        """
+        self.__onSuccess[host].append(function)
+
+    def __mutable(self, host: str, path: list) -> dict:
+        """Get container of the working copy to change it
+
+        Every container on the path is copied once per transaction, all
+        other containers are shared with the published snapshot.
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        path : list
+            Keys of the container
+
+        Returns
+        -------
+        dict
+            Container of the working copy
+        """
+        copied = self.__copied[host]
+        if () not in copied:
+            self.__working[host] = copy.copy(self.__working[host])
+            copied.add(())
+
+        node = self.__working[host]
+        for index, key in enumerate(path):
+            if tuple(path[:index + 1]) not in copied:
+                node[key] = copy.copy(node.get(key, {}))
+                copied.add(tuple(path[:index + 1]))
+            node = node[key]
+
+        return node
+
+    def __set(self, host: str, path: list, value):
+        """Set field of host data
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        path : list
+            Keys of the field
+        value
+            New value of the field
+        """
+        with self.transaction(host):
+            self.__mutable(host, path[:-1])[path[-1]] = value
+            self.__record(host, path, value)
+
+    def __remove(self, host: str, path: list) -> bool:
+        """Remove field of host data
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        path : list
+            Keys of the field
 
         Returns
         -------
         bool
+            Field was present and removed
         """
-        filename = 'config/apidata/%s' % config().getHostfile(host)
+        with self.transaction(host):
+            node = self.__working[host]
+            try:
+                for key in path:
+                    node = node[key]
+            except (KeyError, TypeError):
+                return False
+
+            self.__mutable(host, path[:-1]).pop(path[-1])
+            self.__record(host, path, remove=True)
+
+        return True
+
+    def getVersion(self, host: str) -> int:
+        """Get data version for host
+
+        The version is increased on every change of the host data and could
+        be used to invalidate caches derived from it. In multiprocess mode
+        it is the sequence of the shared state, the same in all processes.
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+
+        Returns
+        -------
+        int
+            Current data version
+        """
+        self.__sync(host)
+        return self.__version[host]
+
+    def commit(self, host: str, critical: bool = False) -> bool:
+        """Commit current API information and persist it to file
+
+        The changes were already published by their transaction. The file
+        is written immediately or, if persistence.delay is set,
+        after the delay or persistence.maxpending commits. Critical commits
+        are written immediately if persistence.flushcritical is set.
 
-        with safer.open(filename, 'w') as f:
-            f.write(json.dumps(self.__data[host], indent=2))
-        print('Saved data for %s ...' % host)
+        Parameters
+        ----------
+        host : str
+            Host to persist
+        critical : bool
+            Commit contains a critical change (e.g. open state)
 
+        Returns
+        -------
+        bool
+        """
+        started = time.perf_counter()
+
+        persistenceConfig = config().getSection('persistence')
+        delay = persistenceConfig.get('delay', 0)
+
+        with self.__writeLock:
+            self.__pending[host] = self.__pending.get(host, 0) + 1
+
+            if (
+                delay <= 0 or
+                self.__pending[host] >= persistenceConfig.get('maxpending', 20)
+                or (critical and persistenceConfig.get('flushcritical', True))
+               ):
+                self.__write(host)
+            elif host not in self.__writeTimer:
+                self.__writeTimer[host] = \
+                    threading.Timer(delay, self.__writeDelayed, [host])
+                self.__writeTimer[host].daemon = True
+                self.__writeTimer[host].start()
+
+        self.__commitSeconds.observe((host,), time.perf_counter() - started)
         return True
 
+    def __write(self, host: str):
+        """Write current API information to file
+
+        Parameters
+        ----------
+        host : str
+            Host to persist
+        """
+        with self.__writeLock:
+            try:
+                self.__writeTimer.pop(host).cancel()
+            except KeyError:
+                pass
+
+            if self.__pending.get(host, 0) == 0:
+                return
+
+            snapshot = self.__data[host]
+            filename = self.__filename[host]
+            persistenceConfig = config().getSection('persistence')
+
+            if (
+                persistenceConfig.get('journal', False) and
+                os.path.isfile('%s.journal' % filename) and
+                os.path.getsize('%s.journal' % filename) <
+                persistenceConfig.get('journalsize', 1024 * 1024) and
+                time.monotonic() - self.__lastCompaction[host] <
+                persistenceConfig.get('compactinterval', 86400)
+               ):
+                # Append change records to journal
+                payload = b''.join(
+                    app.jsonCodec.dumps(record) + b'\n'
+                    for record in self.__journal[host]
+                )
+                with open('%s.journal' % filename, 'ab') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.__writtenBytes.inc((host, 'journal'), len(payload))
+                logger.info(
+                    'Journaled data for %s (%d updates) ...',
+                    host, self.__pending[host]
+                )
+            else:
+                # Write snapshot and start new journal
+                payload = app.jsonCodec.dumps(
+                    snapshot,
+                    indent=not persistenceConfig.get('compact', False)
+                )
+                with safer.open(filename, 'wb') as f:
+                    f.write(payload)
+                self.__writtenBytes.inc((host, 'snapshot'), len(payload))
+                if persistenceConfig.get('journal', False):
+                    open('%s.journal' % filename, 'w').close()
+                    self.__lastCompaction[host] = time.monotonic()
+                logger.info(
+                    'Saved data for %s (%d updates) ...',
+                    host, self.__pending[host]
+                )
+
+            self.__journal[host] = []
+            self.__pending[host] = 0
+
+    def __writeDelayed(self, host: str):
+        """Write current API information including changes of other processes
+
+        Parameters
+        ----------
+        host : str
+            Host to persist
+        """
+        # Synchronize before locking to keep lock order of transactions
+        self.__sync(host)
+        self.__write(host)
+
+    def flush(self):
+        """Write all pending updates to file"""
+        for host in list(self.__pending):
+            self.__writeDelayed(host)
+
+    def getPendingUpdates(self, host: str) -> int:
+        """Get number of committed updates not written to file
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+
+        Returns
+        -------
+        int
+            Number of pending updates
+        """
+        return self.__pending.get(host, 0)
+
     def get(self, host: str, includeAdditionalData: bool = False) -> dict:
         """Get full api data for host
 
@@ -96,16 +683,19 @@ class data:
         Returns
         -------
         dict
-            Dictionary with api data except additional data
+            Dictionary with api data except additional data (snapshot which
+            must not be modified)
         """
+        self.__sync(host)
         if host in self.__data:
+            snapshot = self.__data[host]
             if includeAdditionalData:
-                return self.__data[host]
+                return snapshot
             else:
                 # Return api data from dictionary except key additional_data
                 return {
-                    k: self.__data[host][k]
-                    for k in set(self.__data[host].keys()).difference(
+                    k: snapshot[k]
+                    for k in set(snapshot.keys()).difference(
                         {'additional_data'}
                     )
                 }
@@ -125,6 +715,7 @@ class data:
         datetime
             Datetime object with last modification time
         """
+        self.__sync(host)
         return \
             datetime.datetime.fromtimestamp(
                 self.__data[host]['state']['lastchange']
@@ -143,6 +734,7 @@ class data:
         str
             Name of space
         """
+        self.__sync(host)
         return self.__data[host]['space']
 
     def setSensorsPeople(self, host: str, people: list):
@@ -155,7 +747,12 @@ class data:
         people : list of dict
             List of dict with people information from hackspace api
         """
-        self.__data[host]['sensors']['people_now_present'] = people
+        with self.transaction(host):
+            self.__set(host, ['sensors', 'people_now_present'], people)
+            self.__afterTransaction(
+                host,
+                lambda: sensorHistory().add(host, 'people_now_present', people)
+            )
 
     def setSensorsTemperature(self, host: str, temperature: list):
         """Set sensor data for temperatur
@@ -167,14 +764,21 @@ class data:
         temperature : list of dict
             List of dict with temperature information from hackspace api
         """
-        self.__data[host]['sensors']['temperature'] = temperature
-        self.__data[host].update({
-            'additional_data':  {
-                'lastchange': {
-                    'temperature': int(time.time())
+        with self.transaction(host):
+            self.__set(host, ['sensors', 'temperature'], temperature)
+            self.__set(
+                host,
+                ['additional_data'],
+                {
+                    'lastchange': {
+                        'temperature': int(time.time())
+                    }
                 }
-            }
-        })
+            )
+            self.__afterTransaction(
+                host,
+                lambda: sensorHistory().add(host, 'temperature', temperature)
+            )
 
     def removeSensorsTemperature(self, host: str) -> bool:
         """Remove sensor data for temperatur
@@ -189,14 +793,12 @@ class data:
         bool
             Temperature data was present and removed
         """
-        try:
-            self.__data[host]['sensors'].pop('temperature')
-            self.__data[host]['additional_data']['lastchange'].pop(
-                'temperature'
+        with self.transaction(host):
+            if not self.__remove(host, ['sensors', 'temperature']):
+                return False
+            self.__remove(
+                host, ['additional_data', 'lastchange', 'temperature']
             )
-        except KeyError:
-            return False
-            pass
 
         return True
 
@@ -213,6 +815,7 @@ class data:
         bool
             Current open state
         """
+        self.__sync(host)
         return self.__data[host]['state']['open']
 
     def setStateOpen(self, host: str, state: bool):
@@ -225,7 +828,7 @@ class data:
         state : bool
             Currnt state of hackspace
         """
-        self.__data[host]['state']['open'] = state
+        self.__set(host, ['state', 'open'], state)
 
     def setStateLastchange(self, host: str, lastChange: int):
         """Set last change timestamp
@@ -237,7 +840,7 @@ class data:
         lastChange : int
             Timestamp of last state change
         """
-        self.__data[host]['state']['lastchange'] = lastChange
+        self.__set(host, ['state', 'lastchange'], lastChange)
 
     def setStateMessage(self, host: str, message: str):
         """Set state message
@@ -250,12 +853,8 @@ class data:
             State message
         """
         if (message is not None):
-            self.__data[host]['state']['message'] = message
+            self.__set(host, ['state', 'message'], message)
         else:
-            try:
-                self.__data[host]['state'].pop('message')
-            except KeyError:
-                return False
-                pass
+            return self.__remove(host, ['state', 'message'])
 
         return True
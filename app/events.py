@@ -0,0 +1,290 @@
+import asyncio
+import urllib.parse
+
+import app.jsonCodec
+from app.config import config
+from app.data import data
+from app.responseCache import responseCache
+
+
+class eventBroker:
+    """
+    Fan-out of data changes to subscribers waiting on the event loop
+
+    All subscribers of a host wait for the same future which is resolved and
+    replaced on every change, so idle subscribers do not need a thread and
+    a change costs one wakeup per subscriber.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Event loop of the subscribers
+    __loop = None
+
+    # Future resolved on next change by host
+    __changeFuture = {}
+
+    # Number of subscribers by host
+    __subscribers = {}
+
+    # Interval to poll data changes of other worker processes in seconds
+    __pollInterval = 1
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(eventBroker, singletonClass).__new__(singletonClass)
+            data().addChangeListener(singletonClass.__instance.publish)
+        return singletonClass.__instance
+
+    def publish(self, host: str):
+        """Notify subscribers of a host about a change (thread-safe)
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        """
+        if self.__loop is None or self.__subscribers.get(host, 0) == 0:
+            return
+
+        self.__loop.call_soon_threadsafe(self.__resolve, host)
+
+    def __resolve(self, host: str):
+        """Wake up all subscribers of a host (runs on event loop)"""
+        future = self.__changeFuture.pop(host, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def __getChangeFuture(self, host: str) -> asyncio.Future:
+        try:
+            return self.__changeFuture[host]
+        except KeyError:
+            self.__changeFuture[host] = self.__loop.create_future()
+            return self.__changeFuture[host]
+
+    async def __pollSharedState(self, host: str):
+        """Detect changes of other worker processes while subscribed"""
+        while self.__subscribers.get(host, 0) > 0:
+            # Synchronizes shared state and notifies listeners on change
+            data().getVersion(host)
+            await asyncio.sleep(self.__pollInterval)
+
+    def getEvent(self, host: str) -> tuple:
+        """Get current event of a host
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+
+        Returns
+        -------
+        tuple
+            Data version and json encoded event
+        """
+        version = data().getVersion(host)
+
+        def build() -> bytes:
+            snapshot = data().get(host, True)
+            return app.jsonCodec.dumps({
+                'version': version,
+                'state': {
+                    k: v for k, v in snapshot['state'].items()
+                    if k in ('open', 'lastchange', 'message')
+                },
+                'sensors': snapshot['sensors'],
+            })
+
+        return version, responseCache().get(host, 'event', build)
+
+    async def wait(self, host: str, version: int, timeout: float) -> tuple:
+        """Wait until data version of a host differs
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        version : int
+            Data version known by the subscriber
+        timeout : float
+            Maximum time to wait in seconds
+
+        Returns
+        -------
+        tuple
+            Data version and json encoded event (None on timeout)
+        """
+        if self.__loop is None:
+            self.__loop = asyncio.get_running_loop()
+
+        self.__subscribers[host] = self.__subscribers.get(host, 0) + 1
+        if (
+            self.__subscribers[host] == 1 and
+            config().getSection('sharedstate').get('enabled', False)
+           ):
+            self.__loop.create_task(self.__pollSharedState(host))
+
+        # With shared state the version is the sequence of the shared state,
+        # so it is the same in all worker processes
+        deadline = self.__loop.time() + timeout
+        try:
+            while data().getVersion(host) == version:
+                remaining = deadline - self.__loop.time()
+                if remaining <= 0:
+                    return version, None
+                await asyncio.wait_for(
+                    asyncio.shield(self.__getChangeFuture(host)),
+                    remaining
+                )
+        except asyncio.TimeoutError:
+            return version, None
+        finally:
+            self.__subscribers[host] -= 1
+
+        return self.getEvent(host)
+
+
+class eventMiddleware:
+    """
+    ASGI middleware to serve /status/events on the event loop
+
+    Without query parameter since, the events are streamed as server-sent
+    events. With since=<version>, the request waits until the version
+    differs (long-poll) and returns the event or 204 on timeout.
+    """
+
+    # Path of the event endpoint
+    __path = '/status/events'
+
+    # Interval of keep-alive comments for server-sent events in seconds
+    __keepAlive = 15
+
+    # Maximum wait time of long-poll requests in seconds
+    __longPollTimeout = 30
+
+    def __init__(self, app):
+        self.__app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope['type'] != 'http' or
+            scope['path'] != self.__path or
+            scope['method'] != 'GET'
+           ):
+            await self.__app(scope, receive, send)
+            return
+
+        headers = {
+            k.decode('latin-1').lower(): v.decode('latin-1')
+            for k, v in scope['headers']
+        }
+        host = headers.get('host', '')
+        if host not in config().getHostfiles():
+            await self.__respond(send, 404, b'Unknown host', 'text/plain')
+            return
+
+        query = urllib.parse.parse_qs(scope['query_string'].decode('latin-1'))
+        try:
+            since = int(query['since'][0]) if 'since' in query else None
+            timeout = min(
+                float(query.get('timeout', [self.__longPollTimeout])[0]),
+                self.__longPollTimeout
+            )
+        except ValueError:
+            await self.__respond(
+                send, 400, b'Invalid query parameter', 'text/plain'
+            )
+            return
+
+        if since is not None:
+            await self.__longPoll(send, host, since, timeout)
+        else:
+            await self.__stream(
+                receive, send, host, headers.get('last-event-id')
+            )
+
+    async def __respond(
+            self, send, status: int, body: bytes, contentType: str
+            ):
+        """Send complete response"""
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', contentType.encode('latin-1')),
+                (b'cache-control', b'no-store'),
+                (b'access-control-allow-origin', b'*'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def __longPoll(self, send, host: str, since: int, timeout: float):
+        """Respond with next event after version since"""
+        version, event = await eventBroker().wait(host, since, timeout)
+        if event is None:
+            await self.__respond(send, 204, b'', 'application/json')
+        else:
+            await self.__respond(send, 200, event, 'application/json')
+
+    async def __stream(self, receive, send, host: str, lastEventId: str):
+        """Stream events as server-sent events until client disconnects"""
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-store'),
+                (b'access-control-allow-origin', b'*'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+
+        disconnected = asyncio.ensure_future(self.__waitDisconnect(receive))
+        try:
+            # Send current state unless the client already knows it
+            version, event = eventBroker().getEvent(host)
+            if lastEventId is None or lastEventId != str(version):
+                await self.__sendEvent(send, version, event)
+
+            while not disconnected.done():
+                # Stop waiting as soon as the client disconnects, so the
+                # subscription is not held until the next keep-alive
+                waiting = asyncio.ensure_future(
+                    eventBroker().wait(host, version, self.__keepAlive)
+                )
+                await asyncio.wait(
+                    (waiting, disconnected),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnected.done():
+                    waiting.cancel()
+                    break
+                version, event = waiting.result()
+                if event is None:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': b': keep-alive\n\n',
+                        'more_body': True,
+                    })
+                else:
+                    await self.__sendEvent(send, version, event)
+        except OSError:
+            # Connection closed by client
+            pass
+        finally:
+            disconnected.cancel()
+
+    async def __waitDisconnect(self, receive):
+        """Wait until the client disconnects"""
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def __sendEvent(self, send, version: int, event: bytes):
+        await send({
+            'type': 'http.response.body',
+            'body': b'id: %d\nevent: status\ndata: %s\n\n' % (version, event),
+            'more_body': True,
+        })
@@ -0,0 +1,539 @@
+import array
+import atexit
+import logging
+import os
+import safer
+import struct
+import threading
+import time
+import urllib.parse
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+
+class ringBuffer:
+    """Fixed size ring buffer of timestamp, average, minimum and maximum"""
+
+    # Header with capacity, start index and number of entries
+    __header = struct.Struct('<QQQ')
+
+    def __init__(self, capacity: int):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        capacity : int
+            Maximum number of entries
+        """
+        self.__capacity = capacity
+        self.__start = 0
+        self.__count = 0
+        self.__timestamps = array.array('d', bytes(8 * capacity))
+        self.__average = array.array('f', bytes(4 * capacity))
+        self.__minimum = array.array('f', bytes(4 * capacity))
+        self.__maximum = array.array('f', bytes(4 * capacity))
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def append(
+            self,
+            timestamp: float,
+            average: float,
+            minimum: float,
+            maximum: float
+            ):
+        """Append entry and overwrite oldest entry if buffer is full"""
+        index = (self.__start + self.__count) % self.__capacity
+        self.__timestamps[index] = timestamp
+        self.__average[index] = average
+        self.__minimum[index] = minimum
+        self.__maximum[index] = maximum
+
+        if self.__count < self.__capacity:
+            self.__count += 1
+        else:
+            self.__start = (self.__start + 1) % self.__capacity
+
+    def getOldest(self) -> float:
+        """Get timestamp of oldest entry (None if empty)"""
+        if self.__count == 0:
+            return None
+        return self.__timestamps[self.__start]
+
+    def __bisect(self, timestamp: float, inclusive: bool = False) -> int:
+        """Get logical index of first entry not older than timestamp
+
+        If inclusive is set, entries with the same timestamp are skipped.
+        """
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            index = (self.__start + middle) % self.__capacity
+            if (
+                self.__timestamps[index] < timestamp or
+                (inclusive and self.__timestamps[index] == timestamp)
+               ):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, fromTimestamp: float, toTimestamp: float):
+        """Iterate entries in time range
+
+        Parameters
+        ----------
+        fromTimestamp : float
+            Start of range (inclusive)
+        toTimestamp : float
+            End of range (inclusive)
+
+        Yields
+        ------
+        tuple
+            Timestamp, average, minimum and maximum
+        """
+        for position in range(
+                self.__bisect(fromTimestamp),
+                self.__bisect(toTimestamp, True)
+                ):
+            index = (self.__start + position) % self.__capacity
+            yield (
+                self.__timestamps[index],
+                self.__average[index],
+                self.__minimum[index],
+                self.__maximum[index]
+            )
+
+    def toBytes(self) -> bytes:
+        """Serialize entries
+
+        Only the entries in the buffer are written, oldest first, as a
+        buffer with a capacity of the number of entries.
+        """
+        end = self.__start + self.__count
+        wrapped = max(0, end - self.__capacity)
+        return self.__header.pack(self.__count, 0, self.__count) + b''.join(
+            values[self.__start:min(end, self.__capacity)].tobytes() +
+            values[:wrapped].tobytes()
+            for values in (
+                self.__timestamps, self.__average, self.__minimum,
+                self.__maximum
+            )
+        )
+
+    def fromBytes(self, content: bytes, offset: int = 0) -> int:
+        """Restore serialized buffer
+
+        Entries are dropped if the stored buffer is larger than the capacity.
+
+        Parameters
+        ----------
+        content : bytes
+            Serialized buffer
+        offset : int
+            Start of serialized buffer in content
+
+        Returns
+        -------
+        int
+            Offset after serialized buffer
+        """
+        capacity, start, count = self.__header.unpack_from(content, offset)
+        offset += self.__header.size
+
+        timestamps = array.array('d')
+        timestamps.frombytes(content[offset:offset + 8 * capacity])
+        offset += 8 * capacity
+        values = []
+        for _ in range(3):
+            values.append(array.array('f'))
+            values[-1].frombytes(content[offset:offset + 4 * capacity])
+            offset += 4 * capacity
+
+        for position in range(count):
+            index = (start + position) % capacity
+            self.append(
+                timestamps[index],
+                values[0][index],
+                values[1][index],
+                values[2][index]
+            )
+
+        return offset
+
+
+class sensorSeries:
+    """History of one sensor with raw and downsampled tiers"""
+
+    # Accumulator of current bucket by tier (start, sum, count, min, max)
+    __accumulator = struct.Struct('<ddQdd')
+
+    def __init__(self, tiers: list):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        tiers : list of tuple
+            Resolution in seconds (0 = raw) and capacity of every tier
+        """
+        self.__tiers = [
+            (resolution, ringBuffer(capacity))
+            for resolution, capacity in sorted(tiers)
+        ]
+        self.__accumulators = [[0.0, 0.0, 0, 0.0, 0.0] for _ in tiers]
+        self.__changes = 0
+        self.__lock = threading.Lock()
+
+    def getChanges(self) -> int:
+        """Get number of values added since creation"""
+        return self.__changes
+
+    def add(self, timestamp: float, value: float):
+        """Add value to all tiers
+
+        Parameters
+        ----------
+        timestamp : float
+            Unix timestamp of value
+        value : float
+            Sensor value
+        """
+        with self.__lock:
+            self.__changes += 1
+            for (resolution, buffer), accumulator in \
+                    zip(self.__tiers, self.__accumulators):
+
+                if resolution == 0:
+                    buffer.append(timestamp, value, value, value)
+                    continue
+
+                bucket = timestamp - timestamp % resolution
+                if accumulator[2] > 0 and accumulator[0] != bucket:
+                    # Bucket completed, store aggregate
+                    buffer.append(
+                        accumulator[0],
+                        accumulator[1] / accumulator[2],
+                        accumulator[3],
+                        accumulator[4]
+                    )
+                    accumulator[2] = 0
+
+                if accumulator[2] == 0:
+                    accumulator[:] = [bucket, value, 1, value, value]
+                else:
+                    accumulator[1] += value
+                    accumulator[2] += 1
+                    accumulator[3] = min(accumulator[3], value)
+                    accumulator[4] = max(accumulator[4], value)
+
+    def query(
+            self,
+            fromTimestamp: float,
+            toTimestamp: float,
+            step: int
+            ) -> list:
+        """Get aggregated values in time range
+
+        The coarsest tier with a resolution not above the step is used.
+        Coarser tiers with older entries are used if it does not cover the
+        start of the range. The incomplete current bucket of aggregated
+        tiers is included.
+
+        Parameters
+        ----------
+        fromTimestamp : float
+            Start of range (inclusive)
+        toTimestamp : float
+            End of range (inclusive)
+        step : int
+            Resolution of the result in seconds (0 = finest available)
+
+        Returns
+        -------
+        list
+            Lists of timestamp, average, minimum and maximum
+        """
+        with self.__lock:
+            selected = 0
+            for index, (resolution, buffer) in enumerate(self.__tiers):
+                if resolution <= step:
+                    selected = index
+
+            # Use coarser tiers if selected tier does not cover the range
+            while selected < len(self.__tiers) - 1:
+                oldest = self.__tiers[selected][1].getOldest()
+                coarserOldest = self.__tiers[selected + 1][1].getOldest()
+                if (
+                    (oldest is not None and oldest <= fromTimestamp) or
+                    coarserOldest is None or
+                    (oldest is not None and coarserOldest >= oldest)
+                   ):
+                    break
+                selected += 1
+
+            resolution, buffer = self.__tiers[selected]
+            entries = list(buffer.query(fromTimestamp, toTimestamp))
+
+            # Add current bucket of aggregated tier
+            accumulator = self.__accumulators[selected]
+            if (
+                resolution > 0 and accumulator[2] > 0 and
+                fromTimestamp <= accumulator[0] <= toTimestamp
+               ):
+                entries.append((
+                    accumulator[0],
+                    accumulator[1] / accumulator[2],
+                    accumulator[3],
+                    accumulator[4]
+                ))
+
+        if step <= resolution:
+            return [list(entry) for entry in entries]
+
+        # Combine entries to buckets of requested step
+        result = []
+        for timestamp, average, minimum, maximum in entries:
+            bucket = timestamp - timestamp % step
+            if result and result[-1][0] == bucket:
+                result[-1][1] += average
+                result[-1][2] = min(result[-1][2], minimum)
+                result[-1][3] = max(result[-1][3], maximum)
+                result[-1][4] += 1
+            else:
+                result.append([bucket, average, minimum, maximum, 1])
+
+        return [
+            [bucket, total / count, minimum, maximum]
+            for bucket, total, minimum, maximum, count in result
+        ]
+
+    def toBytes(self) -> bytes:
+        """Serialize all tiers"""
+        with self.__lock:
+            return b''.join(
+                self.__accumulator.pack(*accumulator) + buffer.toBytes()
+                for (_, buffer), accumulator in
+                zip(self.__tiers, self.__accumulators)
+            )
+
+    def fromBytes(self, content: bytes):
+        """Restore serialized tiers"""
+        offset = 0
+        with self.__lock:
+            for (_, buffer), accumulator in \
+                    zip(self.__tiers, self.__accumulators):
+                accumulator[:] = \
+                    self.__accumulator.unpack_from(content, offset)
+                offset = buffer.fromBytes(
+                    content, offset + self.__accumulator.size
+                )
+
+
+class sensorHistory:
+    """History of sensor values by host, sensor and location"""
+
+    # Singleton instance
+    __instance = None
+
+    # Series by host, sensor and location
+    __series = {}
+
+    # Changes of series at last save by host, sensor and location
+    __savedChanges = {}
+
+    # Default tiers (resolution in seconds, duration in seconds)
+    __tiersDefault = [
+        (0, 86400),
+        (300, 30 * 86400),
+        (3600, 5 * 365 * 86400),
+    ]
+
+    # Default maximum number of series (history.maxseries)
+    __maxSeriesDefault = 100
+
+    # Reaching the maximum number of series was logged
+    __maxSeriesReported = False
+
+    # Lock for series creation
+    __lock = threading.Lock()
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(sensorHistory, singletonClass).__new__(singletonClass)
+            if singletonClass.__instance.isEnabled():
+                singletonClass.__instance.__scheduleSave()
+                atexit.register(singletonClass.__instance.save)
+        return singletonClass.__instance
+
+    def isEnabled(self) -> bool:
+        return config().getSection('history').get('enabled', False)
+
+    def __getDirectory(self) -> str:
+        return config().getSection('history').get(
+            'directory', 'config/cache/history'
+        )
+
+    def __getFilename(self, host: str, sensor: str, location: str) -> str:
+        # Percent-encoded, so different locations never share a file
+        return '%s/%s/%s-%s.bin' % (
+            self.__getDirectory(),
+            host,
+            sensor,
+            urllib.parse.quote(location, safe='')
+        )
+
+    def __getTiers(self) -> list:
+        """Get tiers as resolution and capacity
+
+        The raw tier capacity is calculated by the expected update
+        interval of the sensors (history.interval).
+        """
+        historyConfig = config().getSection('history')
+        tiers = historyConfig.get('tiers', self.__tiersDefault)
+        interval = historyConfig.get('interval', 5)
+        return [
+            (
+                resolution,
+                int(duration / (resolution if resolution > 0 else interval))
+            )
+            for resolution, duration in tiers
+        ]
+
+    def __getSeries(self, host: str, sensor: str, location: str):
+        """Get series and load it from file on first access
+
+        Returns
+        -------
+        sensorSeries
+            Series (None if the maximum number of series is reached)
+        """
+        try:
+            return self.__series[(host, sensor, location)]
+        except KeyError:
+            pass
+
+        with self.__lock:
+            if (host, sensor, location) not in self.__series:
+                maxSeries = config().getSection('history').get(
+                    'maxseries', self.__maxSeriesDefault
+                )
+                if len(self.__series) >= maxSeries:
+                    if not self.__maxSeriesReported:
+                        logger.warning(
+                            'History has reached %d series '
+                            '(history.maxseries), values of new sensors '
+                            'are not recorded',
+                            maxSeries
+                        )
+                        self.__maxSeriesReported = True
+                    return None
+
+                series = sensorSeries(self.__getTiers())
+                filename = self.__getFilename(host, sensor, location)
+                if os.path.isfile(filename):
+                    with open(filename, 'rb') as f:
+                        try:
+                            series.fromBytes(f.read())
+                        except struct.error:
+                            logger.error(
+                                'History file %s is corrupt',
+                                filename
+                            )
+                self.__series[(host, sensor, location)] = series
+                self.__savedChanges[(host, sensor, location)] = 0
+
+        return self.__series[(host, sensor, location)]
+
+    def add(self, host: str, sensor: str, values: list):
+        """Add sensor values
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        sensor : str
+            Sensor type (e.g. temperature)
+        values : list of dict
+            Sensor values from hackspace api
+        """
+        if not self.isEnabled():
+            return
+
+        timestamp = int(time.time())
+        for value in values:
+            series = self.__getSeries(host, sensor, value.get('location', ''))
+            if series is not None:
+                series.add(timestamp, value['value'])
+
+    def query(
+            self,
+            host: str,
+            sensor: str,
+            location: str,
+            fromTimestamp: float,
+            toTimestamp: float,
+            step: int
+            ) -> list:
+        """Get aggregated sensor values
+
+        Only series created by updates of the sensor are queried, unknown
+        locations do not allocate a series.
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        sensor : str
+            Sensor type (e.g. temperature)
+        location : str
+            Location of the sensor
+        fromTimestamp : float
+            Start of range
+        toTimestamp : float
+            End of range
+        step : int
+            Resolution of the result in seconds
+
+        Returns
+        -------
+        list
+            Lists of timestamp, average, minimum and maximum
+        """
+        series = self.__series.get((host, sensor, location))
+        if series is None:
+            return []
+        return series.query(fromTimestamp, toTimestamp, step)
+
+    def __scheduleSave(self):
+        """Save history periodically (history.saveinterval)"""
+        timer = threading.Timer(
+            config().getSection('history').get('saveinterval', 300),
+            self.__saveScheduled
+        )
+        timer.daemon = True
+        timer.start()
+
+    def __saveScheduled(self):
+        self.save()
+        self.__scheduleSave()
+
+    def save(self):
+        """Persist history of series changed since last save to files"""
+        for key, series in list(self.__series.items()):
+            changes = series.getChanges()
+            if self.__savedChanges.get(key) == changes:
+                continue
+
+            filename = self.__getFilename(*key)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with safer.open(filename, 'wb') as f:
+                f.write(series.toBytes())
+            self.__savedChanges[key] = changes
@@ -0,0 +1,58 @@
+from app.config import config
+
+
+class hostRoutingMiddleware:
+    """
+    ASGI middleware resolving the host of a request once
+
+    The host header is looked up in the routing table of the configuration
+    (normalized hostnames, aliases and wildcard patterns) and replaced by
+    the configured hostname, so all following middlewares and handlers only
+    see configured hosts. Requests for unknown hosts are answered before
+    rate limiting, authentication, validation and rendering.
+    """
+
+    # Default status code for unknown hosts (server.unknownhost)
+    __unknownHostStatusDefault = 421
+
+    def __init__(self, app):
+        self.__app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.__app(scope, receive, send)
+            return
+
+        headers = []
+        host = None
+        for k, v in scope['headers']:
+            if k.lower() == b'host':
+                host = v.decode('latin-1')
+            else:
+                headers.append((k, v))
+
+        configuredHost = config().resolveHost(host) if host else None
+        if configuredHost is None:
+            await self.__respond(send)
+            return
+
+        headers.append((b'host', configuredHost.encode('latin-1')))
+        await self.__app(dict(scope, headers=headers), receive, send)
+
+    async def __respond(self, send):
+        """Send response for unknown hosts"""
+        status = config().getSection('server').get(
+            'unknownhost', self.__unknownHostStatusDefault
+        )
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'text/plain'),
+                (b'cache-control', b'no-store'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'Unknown host'
+        })
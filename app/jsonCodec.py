@@ -0,0 +1,198 @@
+import connexion.datastructures
+import connexion.exceptions
+import connexion.jsonifier
+import connexion.validators
+import flask.json.provider
+import json
+
+from app.config import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class stdlibCodec:
+    """JSON codec of the python standard library"""
+
+    name = 'stdlib'
+
+    @staticmethod
+    def dumps(obj, indent: bool = False, sortKeys: bool = False) -> bytes:
+        """Encode object as json
+
+        Parameters
+        ----------
+        obj
+            Object to encode
+        indent : bool
+            Indent with two spaces (compact if not set)
+        sortKeys : bool
+            Sort keys of dictionaries
+
+        Returns
+        -------
+        bytes
+            UTF-8 encoded json
+        """
+        return json.dumps(
+            obj,
+            indent=2 if indent else None,
+            separators=None if indent else (',', ':'),
+            sort_keys=sortKeys,
+            cls=connexion.jsonifier.JSONEncoder
+        ).encode('utf-8')
+
+    @staticmethod
+    def loads(data):
+        """Decode json
+
+        Parameters
+        ----------
+        data : bytes or str
+            JSON to decode
+
+        Returns
+        -------
+        Decoded object (raises ValueError on invalid json)
+        """
+        return json.loads(data)
+
+
+class orjsonCodec:
+    """JSON codec using orjson"""
+
+    name = 'orjson'
+
+    @staticmethod
+    def __default(obj):
+        """Encode types not supported by orjson like connexion"""
+        return connexion.jsonifier.JSONEncoder().default(obj)
+
+    @staticmethod
+    def dumps(obj, indent: bool = False, sortKeys: bool = False) -> bytes:
+        """Encode object as json (see stdlibCodec.dumps)"""
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sortKeys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(
+            obj, default=orjsonCodec.__default, option=option
+        )
+
+    @staticmethod
+    def loads(data):
+        """Decode json (see stdlibCodec.loads)"""
+        return orjson.loads(data)
+
+
+# Available codecs by name
+codecs = {stdlibCodec.name: stdlibCodec}
+if orjson is not None:
+    codecs[orjsonCodec.name] = orjsonCodec
+
+
+def getCodec():
+    """Get configured json codec (json.codec)
+
+    auto uses orjson if it is installed and the standard library otherwise.
+
+    Returns
+    -------
+    stdlibCodec or orjsonCodec
+        JSON codec
+    """
+    name = config().getSection('json').get('codec', 'auto')
+    if name == 'auto':
+        return orjsonCodec if orjson is not None else stdlibCodec
+    return codecs.get(name, stdlibCodec)
+
+
+def dumps(obj, indent: bool = False, sortKeys: bool = False) -> bytes:
+    """Encode object as json with the configured codec
+
+    Parameters
+    ----------
+    obj
+        Object to encode
+    indent : bool
+        Indent with two spaces (compact if not set)
+    sortKeys : bool
+        Sort keys of dictionaries
+
+    Returns
+    -------
+    bytes
+        UTF-8 encoded json
+    """
+    return getCodec().dumps(obj, indent, sortKeys)
+
+
+def loads(data):
+    """Decode json with the configured codec
+
+    Parameters
+    ----------
+    data : bytes or str
+        JSON to decode
+
+    Returns
+    -------
+    Decoded object (raises ValueError on invalid json)
+    """
+    return getCodec().loads(data)
+
+
+class jsonifier(connexion.jsonifier.Jsonifier):
+    """Connexion jsonifier using the configured codec"""
+
+    def dumps(self, data, **kwargs) -> str:
+        return dumps(data, indent=True).decode('utf-8') + '\n'
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+
+        try:
+            return loads(data)
+        except ValueError:
+            return data
+
+
+class flaskJsonProvider(flask.json.provider.JSONProvider):
+    """Flask json provider using the configured codec"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps(obj, indent=True).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+
+class jsonRequestBodyValidator(
+        connexion.validators.JSONRequestBodyValidator
+        ):
+    """Request body validator parsing json with the configured codec"""
+
+    async def _parse(self, stream, scope):
+        body = b''.join([message async for message in stream])
+        if not body:
+            return None
+
+        try:
+            return loads(body)
+        except ValueError as e:
+            raise connexion.exceptions.BadRequestProblem(detail=str(e))
+
+
+# Validators for connexion with json request bodies parsed by the codec
+validatorMap = {
+    'body': connexion.datastructures.MediaTypeDict({
+        '*/*json': jsonRequestBodyValidator,
+        'application/x-www-form-urlencoded':
+            connexion.validators.FormDataValidator,
+        'multipart/form-data': connexion.validators.MultiPartFormDataValidator,
+    }),
+}
@@ -0,0 +1,310 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import uuid
+
+from app.metrics import metrics
+
+# Hostname, plugin and request id of the running request or hook
+__host = contextvars.ContextVar('host', default=None)
+__plugin = contextvars.ContextVar('plugin', default=None)
+__requestId = contextvars.ContextVar('requestId', default=None)
+
+
+@contextlib.contextmanager
+def context(host: str = None, plugin: str = None, requestId: str = None):
+    """Set fields of all log records within the block
+
+    Works in threads and coroutines (tasks created within the block inherit
+    the fields).
+
+    Parameters
+    ----------
+    host : str
+        Hostname
+    plugin : str
+        Name of the plugin
+    requestId : str
+        Id of the request
+    """
+    tokens = [
+        (variable, variable.set(value))
+        for variable, value in (
+            (__host, host), (__plugin, plugin), (__requestId, requestId)
+        )
+        if value is not None
+    ]
+    try:
+        yield
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+
+def getContext() -> tuple:
+    """Get fields of the calling context
+
+    Returns
+    -------
+    tuple
+        Hostname, plugin and request id (None if not set)
+    """
+    return __host.get(), __plugin.get(), __requestId.get()
+
+
+class contextFilter(logging.Filter):
+    """Add host, plugin and request id of the calling context to records"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in zip(('host', 'plugin', 'requestId'), getContext()):
+            if getattr(record, name, None) is None:
+                setattr(record, name, value)
+        return True
+
+
+class textFormatter(logging.Formatter):
+    """Plain text with level prefix for warnings and errors (journald)"""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        message = record.message
+        if record.levelno >= logging.WARNING:
+            message = '%s: %s' % (record.levelname, message)
+        fields = [
+            '%s=%s' % (name, getattr(record, name))
+            for name in ('host', 'plugin', 'requestId')
+            if getattr(record, name, None) is not None
+        ]
+        if fields:
+            message += ' [%s]' % ' '.join(fields)
+        return message
+
+
+class jsonFormatter(logging.Formatter):
+    """One json object per record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, key in (
+            ('host', 'host'), ('plugin', 'plugin'), ('requestId', 'request_id')
+        ):
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class droppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler dropping records if the queue is full
+
+    The calling thread only merges the message arguments and puts the record
+    into the queue, formatting and writing is left to the listener thread.
+    Records which do not fit into the queue are counted and reported once
+    the queue accepts records again.
+    """
+
+    # Dropped records
+    __dropped = metrics().counter(
+        'spacestatus_log_dropped_total',
+        'Log records dropped because the log queue was full'
+    )
+
+    def __init__(self, logQueue: queue.Queue):
+        super().__init__(logQueue)
+        self.__unreported = 0
+        self.__unreportedLock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge arguments now, they may change before the record is written
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        # Several threads could drop records at the same time
+        with self.__unreportedLock:
+            try:
+                if self.__unreported:
+                    self.queue.put_nowait(logging.LogRecord(
+                        __name__, logging.WARNING, __file__, 0,
+                        'Dropped %d log records, log queue was full.' %
+                        self.__unreported, None, None
+                    ))
+                    self.__unreported = 0
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.__unreported += 1
+                self.__dropped.inc()
+
+
+class queueListener(logging.handlers.QueueListener):
+    """Queue listener which waits for space to stop on a full queue"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class logQueue:
+    """
+    Logging of the app through a bounded queue and a background thread
+
+    Records of all app.* loggers are put into a queue by the logging thread
+    and formatted and written to stderr by a listener thread, so requests
+    do not wait for the log output.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Queue handler attached to the app logger
+    __handler = None
+
+    # Listener thread writing the records
+    __listener = None
+
+    # Output handler of the listener
+    __output = None
+
+    # Loggers with levels set by configuration (logging.levels)
+    __configuredLevels = []
+
+    # Formatters by name (logging.format)
+    __formatters = {
+        'text': textFormatter,
+        'json': jsonFormatter,
+    }
+
+    # Default size of the queue in records (logging.queuesize)
+    __queueSizeDefault = 10000
+
+    # Lock to start and configure
+    __lock = threading.Lock()
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(logQueue, singletonClass).__new__(singletonClass)
+        return singletonClass.__instance
+
+    def start(self):
+        """Start listener thread and attach the queue to the app logger
+
+        Queued records are written on exit.
+        """
+        with self.__lock:
+            if self.__listener is not None:
+                return
+
+            self.__output = logging.StreamHandler(sys.stderr)
+            self.__output.setFormatter(textFormatter())
+            self.__handler = droppingQueueHandler(
+                queue.Queue(self.__queueSizeDefault)
+            )
+            self.__handler.addFilter(contextFilter())
+            self.__listener = queueListener(
+                self.__handler.queue, self.__output
+            )
+            self.__listener.start()
+
+            logger = logging.getLogger('app')
+            logger.addHandler(self.__handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Write all queued records and stop listener thread"""
+        with self.__lock:
+            if self.__listener is None:
+                return
+            logging.getLogger('app').removeHandler(self.__handler)
+            self.__listener.stop()
+            self.__listener = None
+
+    def configure(self, settings: dict):
+        """Set format, levels and queue size
+
+        Parameters
+        ----------
+        settings : dict
+            Section logging of the configuration
+        """
+        with self.__lock:
+            formatter = self.__formatters.get(
+                settings.get('format', 'text'), textFormatter
+            )
+            if self.__output is not None:
+                self.__output.setFormatter(formatter())
+            if self.__handler is not None:
+                self.__handler.queue.maxsize = settings.get(
+                    'queuesize', self.__queueSizeDefault
+                )
+
+            logging.getLogger('app').setLevel(
+                str(settings.get('level', 'INFO')).upper()
+            )
+
+            # Reset levels removed from the configuration
+            for name in self.__configuredLevels:
+                logging.getLogger(name).setLevel(logging.NOTSET)
+            self.__configuredLevels = []
+            for name, level in (settings.get('levels') or {}).items():
+                logging.getLogger(name).setLevel(str(level).upper())
+                self.__configuredLevels.append(name)
+
+
+class requestContextMiddleware:
+    """
+    ASGI middleware setting host and request id of log records
+
+    The request id is taken from the X-Request-ID header (e.g. set by a
+    reverse proxy) or generated, and returned in the response.
+    """
+
+    # Maximum length of request ids taken from the header
+    __maxLength = 64
+
+    def __init__(self, app):
+        self.__app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.__app(scope, receive, send)
+            return
+
+        host = None
+        requestId = None
+        for k, v in scope['headers']:
+            k = k.lower()
+            if k == b'host':
+                host = v.decode('latin-1')
+            elif k == b'x-request-id' and \
+                    0 < len(v) <= self.__maxLength and v.isascii() and \
+                    v.decode('ascii').isprintable():
+                requestId = v.decode('ascii')
+        if requestId is None:
+            requestId = uuid.uuid4().hex
+
+        async def sendWithRequestId(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-request-id', requestId.encode('ascii'))
+                ]
+            await send(message)
+
+        with context(host=host, requestId=requestId):
+            await self.__app(scope, receive, sendWithRequestId)
@@ -0,0 +1,319 @@
+import bisect
+import threading
+import weakref
+
+
+class _shardHolder:
+    """Thread-local reference to a shard (finalized on thread exit)"""
+
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self):
+        self.shard = {}
+
+
+class counter:
+    """
+    Counter by label values
+
+    Every thread counts in its own shard, so recording needs no lock and
+    does not lose increments. The shards are only summed up on collect.
+    When a thread exits, its shard is folded into a shard of exited threads,
+    so the number of shards is bounded by the number of running threads.
+    """
+
+    # Type of the metric in the exposition format
+    metricType = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelNames: tuple):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric
+        documentation : str
+            Help text of the metric
+        labelNames : tuple
+            Names of the labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = labelNames
+        self._local = threading.local()
+        self._shards = []
+        self._shardsLock = threading.Lock()
+        self._exitedShard = {}
+
+    def _getShard(self) -> dict:
+        """Get shard of the current thread"""
+        try:
+            return self._local.holder.shard
+        except AttributeError:
+            holder = self._local.holder = _shardHolder()
+            with self._shardsLock:
+                self._shards.append(holder.shard)
+            weakref.finalize(holder, self._foldShard, holder.shard)
+            return holder.shard
+
+    def _foldShard(self, shard: dict):
+        """Fold shard of an exited thread into the shard of exited threads"""
+        with self._shardsLock:
+            # Shards are compared by identity, equal shards are distinct
+            self._shards = [s for s in self._shards if s is not shard]
+            self._mergeInto(self._exitedShard, shard)
+
+    def _newValue(self) -> list:
+        return [0]
+
+    def inc(self, labels: tuple = (), value: float = 1):
+        """Increase counter
+
+        Parameters
+        ----------
+        labels : tuple
+            Label values in order of the label names
+        value : float
+            Value to add
+        """
+        shard = self._getShard()
+        try:
+            shard[labels][0] += value
+        except KeyError:
+            shard[labels] = [value]
+
+    def _merge(self, total: list, value: list):
+        total[0] += value[0]
+
+    def _mergeInto(self, values: dict, shard: dict):
+        """Add values of a shard to values by label values"""
+        for labels, value in shard.copy().items():
+            try:
+                self._merge(values[labels], value)
+            except KeyError:
+                values[labels] = self._newValue()
+                self._merge(values[labels], value)
+
+    def _collectValues(self) -> dict:
+        """Get values of all shards summed up by label values"""
+        values = {}
+        with self._shardsLock:
+            for shard in [self._exitedShard] + self._shards:
+                self._mergeInto(values, shard)
+        return values
+
+    def _formatLabels(self, labels: tuple, extra: str = '') -> str:
+        pairs = [
+            '%s="%s"' % (
+                name,
+                str(value).replace('\\', '\\\\').replace('"', '\\"')
+                .replace('\n', '\\n')
+            )
+            for name, value in zip(self.labelNames, labels)
+        ]
+        if extra:
+            pairs.append(extra)
+        return '{%s}' % ','.join(pairs) if pairs else ''
+
+    def collect(self) -> list:
+        """Get samples in the prometheus text format
+
+        Returns
+        -------
+        list
+            Lines of samples
+        """
+        return [
+            '%s%s %s' % (self.name, self._formatLabels(labels), value[0])
+            for labels, value in sorted(self._collectValues().items())
+        ]
+
+
+class histogram(counter):
+    """
+    Histogram with fixed buckets by label values
+
+    Like the counter every thread records in its own shard. An observation
+    only increments a preallocated bucket list.
+    """
+
+    metricType = 'histogram'
+
+    # Default buckets for request latencies in seconds
+    defaultBuckets = (
+        0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+        2.5, 5, 10
+    )
+
+    def __init__(
+            self, name: str, documentation: str, labelNames: tuple,
+            buckets: tuple = defaultBuckets
+            ):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric
+        documentation : str
+            Help text of the metric
+        labelNames : tuple
+            Names of the labels
+        buckets : tuple
+            Sorted upper bounds of the buckets
+        """
+        super().__init__(name, documentation, labelNames)
+        self.buckets = tuple(buckets)
+
+    def _newValue(self) -> list:
+        # Counts by bucket (last one is +Inf) followed by sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, labels: tuple, value: float):
+        """Record an observation
+
+        Parameters
+        ----------
+        labels : tuple
+            Label values in order of the label names
+        value : float
+            Observed value (e.g. duration in seconds)
+        """
+        shard = self._getShard()
+        try:
+            counts = shard[labels]
+        except KeyError:
+            counts = shard[labels] = self._newValue()
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, total: list, value: list):
+        for i, v in enumerate(value):
+            total[i] += v
+
+    def collect(self) -> list:
+        lines = []
+        for labels, counts in sorted(self._collectValues().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    self._formatLabels(labels, 'le="%s"' % bound),
+                    cumulative
+                ))
+            lines.append('%s_sum%s %s' % (
+                self.name, self._formatLabels(labels), counts[-1]
+            ))
+            lines.append('%s_count%s %d' % (
+                self.name, self._formatLabels(labels), cumulative
+            ))
+        return lines
+
+
+class gauge(counter):
+    """
+    Gauge read by a callback on collect
+
+    Nothing is recorded on the hot path, the current values (e.g. queue
+    depths) are only read when the metrics are requested.
+    """
+
+    metricType = 'gauge'
+
+    def __init__(
+            self, name: str, documentation: str, labelNames: tuple,
+            callback
+            ):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric
+        documentation : str
+            Help text of the metric
+        labelNames : tuple
+            Names of the labels
+        callback : callable
+            Function without parameters returning values by label values
+        """
+        super().__init__(name, documentation, labelNames)
+        self.__callback = callback
+
+    def collect(self) -> list:
+        return [
+            '%s%s %s' % (self.name, self._formatLabels(labels), value)
+            for labels, value in sorted(self.__callback().items())
+        ]
+
+
+class metrics:
+    """Registry of all metrics of the process"""
+
+    # Singleton instance
+    __instance = None
+
+    # Metrics by name
+    __metrics = {}
+
+    # Lock to register metrics
+    __lock = threading.Lock()
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(metrics, singletonClass).__new__(singletonClass)
+        return singletonClass.__instance
+
+    def __register(self, metricClass, name: str, *args):
+        with self.__lock:
+            if name not in self.__metrics:
+                self.__metrics[name] = metricClass(name, *args)
+            return self.__metrics[name]
+
+    def counter(
+            self, name: str, documentation: str, labelNames: tuple = ()
+            ) -> counter:
+        """Get or create counter (see counter)"""
+        return self.__register(counter, name, documentation, labelNames)
+
+    def histogram(
+            self, name: str, documentation: str, labelNames: tuple = (),
+            buckets: tuple = histogram.defaultBuckets
+            ) -> histogram:
+        """Get or create histogram (see histogram)"""
+        return self.__register(
+            histogram, name, documentation, labelNames, buckets
+        )
+
+    def gauge(
+            self, name: str, documentation: str, labelNames: tuple,
+            callback
+            ) -> gauge:
+        """Get or create gauge (see gauge)"""
+        return self.__register(
+            gauge, name, documentation, labelNames, callback
+        )
+
+    def render(self) -> str:
+        """Get all metrics in the prometheus text exposition format
+
+        Returns
+        -------
+        str
+            Metrics of this process
+        """
+        with self.__lock:
+            registered = sorted(self.__metrics.items())
+
+        lines = []
+        for name, metric in registered:
+            lines.append('# HELP %s %s' % (name, metric.documentation))
+            lines.append('# TYPE %s %s' % (name, metric.metricType))
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
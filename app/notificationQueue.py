@@ -0,0 +1,524 @@
+import asyncio
+import atexit
+import concurrent.futures
+import fcntl
+import json
+import logging
+import os
+import safer
+import threading
+import time
+
+import app.log
+import app.plugin
+from app.config import config
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class notificationQueue:
+    """
+    Persistent outbound queue of state change notifications
+
+    Each host and plugin has its own queue which delivers in order with at
+    most one notification in flight. Pending notifications are coalesced
+    into the latest state, so flapping only results in one notification
+    (or none if the state equals the last delivered one). Failed
+    notifications are retried with exponential backoff. Pending entries
+    are persisted and resumed after restart.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Default settings (section notifications)
+    __settingsDefault = {
+        'filename': 'config/cache/notifications.json',
+        # Time in seconds a state has to be stable before delivery
+        'coalesce': 5,
+        # Initial and maximum delay between retries in seconds
+        'backoff': 5,
+        'backoffmax': 600,
+        # Maximum delivery attempts before a notification is dropped
+        'attempts': 10,
+        # Maximum time in seconds to wait for async plugins
+        'timeout': 60,
+        # Number of threads delivering notifications of sync plugins
+        'workers': 4,
+    }
+
+    # Interval to check readiness of plugins in seconds
+    __setupPollInterval = 1
+
+    # Plugin instances by name
+    __plugins = {}
+
+    # Queue entries by host and plugin name
+    __queues = {}
+
+    # Future, state and queue time of notifications in flight by host and
+    # plugin name
+    __inFlight = {}
+
+    # Queues changed since they were persisted
+    __dirty = False
+
+    # Lock to persist queues in order
+    __persistLock = threading.Lock()
+
+    # Condition to wake up dispatcher thread
+    __condition = threading.Condition()
+
+    # Dispatcher thread
+    __thread = None
+
+    # Executor to run hooks of sync plugins
+    __executor = None
+
+    # Started deliveries by plugin
+    __dispatches = metrics().counter(
+        'spacestatus_plugin_dispatches_total',
+        'Started deliveries of plugin notifications',
+        ('plugin',)
+    )
+
+    # Failed deliveries by plugin
+    __failures = metrics().counter(
+        'spacestatus_plugin_failures_total',
+        'Failed deliveries of plugin notifications',
+        ('plugin',)
+    )
+
+    # Time from queueing to successful delivery by plugin
+    __latency = metrics().histogram(
+        'spacestatus_plugin_notification_seconds',
+        'Time from queueing to successful delivery of notifications',
+        ('plugin',),
+        (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+    )
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(notificationQueue, singletonClass).__new__(
+                    singletonClass
+                )
+            metrics().gauge(
+                'spacestatus_plugin_queue_depth',
+                'Pending and in flight notifications',
+                ('plugin',),
+                lambda: singletonClass.__instance.__getDepths(False)
+            )
+            metrics().gauge(
+                'spacestatus_plugin_inflight',
+                'Notifications in flight',
+                ('plugin',),
+                lambda: singletonClass.__instance.__getDepths(True)
+            )
+        return singletonClass.__instance
+
+    def __getSetting(self, name: str):
+        return config().getSection('notifications').get(
+            name, self.__settingsDefault[name]
+        )
+
+    def start(self, plugins: list):
+        """Start delivery of notifications
+
+        Parameters
+        ----------
+        plugins : list
+            Plugin instances
+        """
+        with self.__condition:
+            self.__plugins = {plugin.getName(): plugin for plugin in plugins}
+
+            if self.__thread is not None:
+                return
+
+            self.__executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.__getSetting('workers'),
+                thread_name_prefix='plugin'
+            )
+            self.__load()
+            atexit.register(self.__persist)
+            self.__thread = threading.Thread(
+                target=self.__dispatch,
+                name='notification-queue',
+                daemon=True
+            )
+            self.__thread.start()
+
+    def enqueue(self, host: str, pluginName: str, stateOpen: bool):
+        """Queue notification about state change
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        pluginName : str
+            Name of the plugin
+        stateOpen : bool
+            New state
+        """
+        now = time.time()
+        with self.__condition:
+            entry = self.__queues.setdefault(
+                (host, pluginName),
+                {'delivered': None, 'pending': None}
+            )
+
+            if entry['pending'] != stateOpen:
+                # New state, age and latency are measured from now on
+                entry['queued'] = now
+            if (host, pluginName) in self.__inFlight:
+                entry['coalesced'] += 1
+            elif entry['pending'] is None:
+                entry['attempts'] = 0
+                entry['coalesced'] = 0
+            else:
+                entry['coalesced'] += 1
+            entry['pending'] = stateOpen
+            entry['next'] = now + self.__getSetting('coalesce')
+
+            self.__coalesce(host, pluginName)
+            # Persisted by the dispatcher thread
+            self.__dirty = True
+            self.__condition.notify()
+
+    def __coalesce(self, host: str, pluginName: str):
+        """Drop pending state if it equals the delivered or in flight one"""
+        entry = self.__queues[(host, pluginName)]
+        try:
+            reference = self.__inFlight[(host, pluginName)][1]
+        except KeyError:
+            reference = entry['delivered']
+
+        if entry['pending'] is not None and entry['pending'] == reference:
+            logger.info(
+                'Notification - %s for %s coalesced, state unchanged.',
+                pluginName, host,
+                extra={'host': host, 'plugin': pluginName}
+            )
+            entry['pending'] = None
+
+    def __dispatch(self):
+        """Deliver due notifications and persist queues (dispatcher thread)"""
+        with self.__condition:
+            while True:
+                if self.__dirty:
+                    self.__condition.release()
+                    try:
+                        self.__persist()
+                    finally:
+                        self.__condition.acquire()
+
+                now = time.time()
+                wait = None
+                for (host, pluginName), entry in self.__queues.items():
+                    if (
+                        entry['pending'] is None or
+                        (host, pluginName) in self.__inFlight
+                       ):
+                        continue
+                    if (
+                        entry['next'] <= now and
+                        self.__deliver(host, pluginName, entry)
+                       ):
+                        # Delivery could already be finished and have
+                        # scheduled a retry, so scan again afterwards
+                        wait = 0
+                    elif wait is None or entry['next'] - now < wait:
+                        wait = entry['next'] - now
+
+                if not self.__dirty:
+                    self.__condition.wait(wait)
+
+    def __deliver(self, host: str, pluginName: str, entry: dict) -> bool:
+        """Start delivery of pending state (lock is held)
+
+        Returns
+        -------
+        bool
+            Delivery was started
+        """
+        try:
+            plugin = self.__plugins[pluginName]
+        except KeyError:
+            # Plugin not available (anymore)
+            entry['pending'] = None
+            return False
+
+        readiness = plugin.getReadiness(host)
+        if readiness == 'pending':
+            # Setup of plugin is still running
+            entry['next'] = time.time() + self.__setupPollInterval
+            return False
+        elif readiness == 'failed':
+            logger.error(
+                'onStateOpenChange - %s for %s dropped, setup failed.',
+                pluginName, host,
+                extra={'host': host, 'plugin': pluginName}
+            )
+            entry['pending'] = None
+            return False
+
+        stateOpen = entry['pending']
+        entry['pending'] = None
+        entry['attempts'] += 1
+
+        if plugin.isAsync():
+            future = app.plugin.eventLoop().submit(
+                self.__awaitAsync(
+                    plugin.onStateOpenChangeForHostAsync(host, stateOpen),
+                    host,
+                    pluginName
+                )
+            )
+        else:
+            future = self.__executor.submit(
+                plugin.onStateOpenChangeForHost,
+                host,
+                stateOpen
+            )
+        self.__inFlight[(host, pluginName)] = \
+            (future, stateOpen, entry['queued'])
+        self.__dispatches.inc((pluginName,))
+        future.add_done_callback(
+            lambda future: self.__delivered(host, pluginName, future)
+        )
+        logger.info(
+            'onStateOpenChange - %s for %s started (attempt %d).',
+            pluginName, host, entry['attempts'],
+            extra={'host': host, 'plugin': pluginName}
+        )
+        return True
+
+    async def __awaitAsync(self, coroutine, host: str, pluginName: str):
+        with app.log.context(host=host, plugin=pluginName):
+            return await asyncio.wait_for(
+                coroutine, self.__getSetting('timeout')
+            )
+
+    def __delivered(
+            self, host: str, pluginName: str,
+            future: concurrent.futures.Future
+            ):
+        """Handle result of a delivery"""
+        try:
+            # Plugins return False on errors worth a retry
+            success = future.result() is not False
+        except Exception as e:
+            logger.error(
+                'onStateOpenChange - %s for %s failed: %s',
+                pluginName, host, repr(e),
+                extra={'host': host, 'plugin': pluginName}
+            )
+            success = False
+
+        if not success:
+            self.__failures.inc((pluginName,))
+
+        with self.__condition:
+            _, stateOpen, queued = self.__inFlight.pop((host, pluginName))
+            entry = self.__queues[(host, pluginName)]
+
+            if success:
+                self.__latency.observe((pluginName,), time.time() - queued)
+                entry['delivered'] = stateOpen
+                entry['attempts'] = 0
+                self.__coalesce(host, pluginName)
+            elif entry['attempts'] >= self.__getSetting('attempts'):
+                logger.error(
+                    'onStateOpenChange - %s for %s dropped after %d '
+                    'attempts.',
+                    pluginName, host, entry['attempts'],
+                    extra={'host': host, 'plugin': pluginName}
+                )
+                entry['attempts'] = 0
+            elif entry['pending'] is None:
+                # Retry with exponential backoff unless a newer state is
+                # already pending
+                entry['pending'] = stateOpen
+                entry['queued'] = queued
+                entry['next'] = time.time() + min(
+                    self.__getSetting('backoff') *
+                    2 ** (entry['attempts'] - 1),
+                    self.__getSetting('backoffmax')
+                )
+
+            self.__dirty = True
+            self.__condition.notify()
+
+    def getStatistics(self, host: str) -> dict:
+        """Get queue depth and age of the oldest notification by plugin
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+
+        Returns
+        -------
+        dict
+            Statistics by plugin name
+        """
+        now = time.time()
+        statistics = {}
+        with self.__condition:
+            for (entryHost, pluginName), entry in self.__queues.items():
+                if entryHost != host:
+                    continue
+                inFlight = (host, pluginName) in self.__inFlight
+                depth = int(entry['pending'] is not None) + int(inFlight)
+                queued = [
+                    entry['queued']
+                ] if entry['pending'] is not None else []
+                if inFlight:
+                    queued.append(self.__inFlight[(host, pluginName)][2])
+                statistics[pluginName] = {
+                    'depth': depth,
+                    'inflight': inFlight,
+                    'oldest': round(now - min(queued), 3) if queued else 0,
+                    'attempts': entry['attempts'],
+                    'coalesced': entry.get('coalesced', 0),
+                }
+        return statistics
+
+    def __getDepths(self, inFlightOnly: bool) -> dict:
+        """Get number of pending and/or in flight notifications by plugin
+
+        Parameters
+        ----------
+        inFlightOnly : bool
+            Count only notifications in flight
+
+        Returns
+        -------
+        dict
+            Number of notifications by plugin name (as label tuple)
+        """
+        depths = {}
+        with self.__condition:
+            for (host, pluginName), entry in self.__queues.items():
+                inFlight = (host, pluginName) in self.__inFlight
+                depth = int(inFlight)
+                if not inFlightOnly:
+                    depth += int(entry['pending'] is not None)
+                depths[(pluginName,)] = depths.get((pluginName,), 0) + depth
+        return depths
+
+    def __persist(self):
+        """Persist queues of this process if changed (lock is not held)
+
+        Worker processes share the file, so it is read and merged with the
+        entries of this process under an exclusive file lock. Runs in the
+        dispatcher thread (and on exit), never on the request path.
+        """
+        with self.__persistLock:
+            with self.__condition:
+                if not self.__dirty:
+                    return
+                self.__dirty = False
+
+                entries = {}
+                for (host, pluginName), entry in self.__queues.items():
+                    try:
+                        _, pending, queued = \
+                            self.__inFlight[(host, pluginName)]
+                    except KeyError:
+                        pending = entry['pending']
+                        queued = entry.get('queued', 0)
+                    entries['%s/%s' % (host, pluginName)] = {
+                        'host': host,
+                        'plugin': pluginName,
+                        'pid': os.getpid(),
+                        'pending': pending,
+                        'delivered': entry['delivered'],
+                        'queued': queued,
+                        'attempts': entry.get('attempts', 0),
+                    }
+
+            filename = self.__getSetting('filename')
+            try:
+                os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+                with open(filename + '.lock', 'a') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    stored = self.__read(filename)
+                    stored.update(entries)
+                    with safer.open(filename, 'w') as f:
+                        json.dump(stored, f, indent=2, sort_keys=True)
+            except OSError as e:
+                logger.error(
+                    'Persist notification queue %s failed: %s',
+                    filename, repr(e)
+                )
+
+    def __read(self, filename: str) -> dict:
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.error('Notification queue %s is corrupt', filename)
+            return {}
+
+    def __isAlive(self, pid: int) -> bool:
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def __load(self):
+        """Resume notifications of stopped processes (lock is held)
+
+        Entries of stopped processes are claimed by writing the pid of this
+        process under the file lock, so they are resumed by only one of
+        several starting worker processes.
+        """
+        filename = self.__getSetting('filename')
+        if not os.path.isfile(filename):
+            return
+
+        claimed = []
+        with open(filename + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stored = self.__read(filename)
+            for storedEntry in stored.values():
+                # Entries of running worker processes are delivered by them
+                if self.__isAlive(storedEntry.get('pid', 0)):
+                    continue
+                storedEntry['pid'] = os.getpid()
+                claimed.append(storedEntry)
+
+            if claimed:
+                with safer.open(filename, 'w') as f:
+                    json.dump(stored, f, indent=2, sort_keys=True)
+
+        now = time.time()
+        for storedEntry in claimed:
+            self.__queues[(storedEntry['host'], storedEntry['plugin'])] = {
+                'pending': storedEntry['pending'],
+                'delivered': storedEntry['delivered'],
+                'queued': storedEntry['queued'],
+                'attempts': storedEntry['attempts'],
+                'coalesced': 0,
+                'next': now,
+            }
+            if storedEntry['pending'] is not None:
+                logger.info(
+                    'Notification - %s for %s resumed.',
+                    storedEntry['plugin'], storedEntry['host'],
+                    extra={
+                        'host': storedEntry['host'],
+                        'plugin': storedEntry['plugin']
+                    }
+                )
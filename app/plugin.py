@@ -1,11 +1,216 @@
-import connexion
+import asyncio
+import concurrent.futures
+import copy
+import http.cookiejar
+import logging
 import pydeepmerge
-import sys
+import requests
+import requests.adapters
+import threading
+import time
+import urllib.parse
 
 from abc import ABC, abstractmethod
 
+import app.log
 from app.config import config
 
+logger = logging.getLogger(__name__)
+
+
+class eventLoop:
+    """
+    Long-lived event loop in a background thread shared by all plugins
+
+    The loop owns all async plugin clients. Coroutines could be submitted
+    from any thread and run concurrently.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Event loop
+    __loop = None
+
+    # Thread running the event loop
+    __thread = None
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(eventLoop, singletonClass).__new__(singletonClass)
+            singletonClass.__instance.__start()
+        return singletonClass.__instance
+
+    def __start(self):
+        """Start event loop thread"""
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(
+            target=self.__loop.run_forever,
+            name='plugin-eventloop',
+            daemon=True
+        )
+        self.__thread.start()
+
+    def submit(self, coroutine) -> concurrent.futures.Future:
+        """Run coroutine on the event loop
+
+        Parameters
+        ----------
+        coroutine : coroutine
+            Coroutine to run
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future with result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop)
+
+    def run(self, coroutine, timeout: float = None):
+        """Run coroutine on the event loop and wait for its result
+
+        Must not be called from the event loop thread itself.
+
+        Parameters
+        ----------
+        coroutine : coroutine
+            Coroutine to run
+        timeout : float
+            Maximum time to wait in seconds
+
+        Returns
+        -------
+            Result of the coroutine
+        """
+        return self.submit(coroutine).result(timeout)
+
+
+class httpSession(requests.Session):
+    """
+    Pooled keep-alive session to one remote server
+
+    Every request uses the timeouts of the session and waits for a free
+    slot if the maximum number of concurrent requests is reached.
+    """
+
+    def __init__(
+            self,
+            connectTimeout: float,
+            readTimeout: float,
+            concurrency: int
+            ):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        connectTimeout : float
+            Timeout to establish a connection in seconds
+        readTimeout : float
+            Timeout to wait for the server in seconds
+        concurrency : int
+            Maximum number of concurrent requests (and pooled connections)
+        """
+        super().__init__()
+        self.__timeout = (connectTimeout, readTimeout)
+        self.__semaphore = threading.BoundedSemaphore(concurrency)
+
+        # Session is shared by different accounts, never keep cookies
+        self.cookies.set_policy(
+            http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+        )
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=concurrency,
+            pool_block=True
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs['timeout'] = self.__timeout
+        with self.__semaphore:
+            return super().request(method, url, **kwargs)
+
+
+class httpTransport:
+    """
+    Shared http sessions of all plugins
+
+    Hosts using the same remote server with the same http settings share
+    one session, so connections (and TLS sessions) are reused.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Sessions by plugin name, remote origin and settings
+    __sessions = {}
+
+    # Lock for session creation
+    __lock = threading.Lock()
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(httpTransport, singletonClass).__new__(singletonClass)
+        return singletonClass.__instance
+
+    def getSession(
+            self,
+            pluginName: str,
+            url: str,
+            connectTimeout: float,
+            readTimeout: float,
+            concurrency: int
+            ) -> httpSession:
+        """Get shared session for a remote server
+
+        Parameters
+        ----------
+        pluginName : str
+            Name of the plugin
+        url : str
+            Url of the remote server (only scheme, host and port are used)
+        connectTimeout : float
+            Timeout to establish a connection in seconds
+        readTimeout : float
+            Timeout to wait for the server in seconds
+        concurrency : int
+            Maximum number of concurrent requests to the server
+
+        Returns
+        -------
+        httpSession
+        """
+        url = urllib.parse.urlsplit(url)
+        key = (
+            pluginName,
+            url.scheme,
+            url.netloc.lower(),
+            connectTimeout,
+            readTimeout,
+            concurrency
+        )
+
+        with self.__lock:
+            if key not in self.__sessions:
+                self.__sessions[key] = httpSession(
+                    connectTimeout, readTimeout, concurrency
+                )
+            return self.__sessions[key]
+
+    def close(self):
+        """Close all sessions"""
+        with self.__lock:
+            for session in self.__sessions.values():
+                session.close()
+            self.__sessions.clear()
+
 
 class plugin(ABC):
     """Abstract base class for each plugin
@@ -19,8 +224,19 @@ class plugin(ABC):
     # Configuration
     _config = {}
 
-    # Hostname of request
-    _hostname = None
+    # Hostname of the running hook (hooks of different hosts run
+    # concurrently in worker threads)
+    __request = threading.local()
+
+    # Plugin implements onStateOpenChangeForHostAsync
+    _async = False
+
+    # Default settings of http sessions (config http)
+    _httpDefault = {
+        'connect': 5,
+        'read': 30,
+        'concurrency': 4,
+    }
 
     def getName(self) -> str:
         return self.__class__.__name__
@@ -32,6 +248,92 @@ class plugin(ABC):
         except LookupError as e:
             raise e
 
+        # Configuration as loaded (before changes by setup) to compare it
+        # on reload
+        self.__loadedConfig = copy.deepcopy(self._config)
+
+        # Readiness by host, set by setup
+        self.__readiness = {host: 'pending' for host in self._config}
+
+    def reloadConfig(self) -> tuple:
+        """Reload configuration and compare it with the previous one
+
+        Hosts with unchanged configuration keep their current configuration.
+
+        Raises
+        ------
+        LookupError
+            New configuration is not valid (previous one is kept)
+
+        Returns
+        -------
+        tuple
+            Lists of hosts with added or changed and of hosts with removed
+            configuration
+        """
+        previousConfig = self._config
+        self._loadConfig()
+        try:
+            self._checkConfig()
+        except LookupError as e:
+            self._config = previousConfig
+            raise e
+
+        loadedConfig = copy.deepcopy(self._config)
+        changedHosts = [
+            host for host in loadedConfig
+            if self.__loadedConfig.get(host) != loadedConfig[host]
+        ]
+        removedHosts = [
+            host for host in self.__loadedConfig if host not in loadedConfig
+        ]
+
+        for host in loadedConfig:
+            if host not in changedHosts:
+                self._config[host] = previousConfig[host]
+        self.__loadedConfig = loadedConfig
+
+        for host in changedHosts:
+            self.__readiness[host] = 'pending'
+        for host in removedHosts:
+            self.__readiness.pop(host, None)
+
+        return changedHosts, removedHosts
+
+    def onConfigChange(self, changedHosts: list, removedHosts: list):
+        """
+        The method will be executed after the configuration was reloaded
+
+        By default all changed and removed hosts are torn down, setup of
+        the changed hosts runs afterwards.
+
+        Parameters
+        ----------
+        changedHosts : list
+            Hosts with added or changed configuration
+        removedHosts : list
+            Hosts with removed configuration (or disabled plugin)
+        """
+        self.__teardownHosts(changedHosts + removedHosts)
+
+    def teardown(self):
+        """Disconnect from remote services of all hosts (on exit)"""
+        self.__teardownHosts(self.getHosts())
+
+    def __teardownHosts(self, hosts: list):
+        """Run teardown of hosts, async plugins on the plugin event loop"""
+        for host in hosts:
+            try:
+                if self.isAsync():
+                    eventLoop().run(self._teardownHostAsync(host), timeout=10)
+                else:
+                    self._teardownHost(host)
+            except Exception as e:
+                logger.error(
+                    'Teardown of plugin %s for %s failed: %s',
+                    self.getName(), host, repr(e)
+                )
+
     def _loadConfig(self) -> dict:
         self._config = config().getPluginConfig(self.getName())
 
@@ -75,10 +377,9 @@ class plugin(ABC):
                     if len(configKey) == 2:
                         x = hostConfig[configKey[0]][configKey[1]]
                 except KeyError:
-                    print(
-                        "Configcheck: [%s / %s] Key %s missing." %
-                        (host, self.getName(), configKey),
-                        file=sys.stderr
+                    logger.error(
+                        "Configcheck: [%s / %s] Key %s missing.",
+                        host, self.getName(), configKey
                     )
                     configErrors = True
 
@@ -91,17 +392,158 @@ class plugin(ABC):
     def _getConfig(self) -> dict:
         return self._config[self._getHost()]
 
+    def getHosts(self) -> list:
+        return list(self._config)
+
+    def getReadiness(self, host: str) -> str:
+        """Get readiness of a host
+
+        Parameters
+        ----------
+        host : str
+            Hostname of spacestatus-server instance
+
+        Returns
+        -------
+        str
+            pending (setup running), ready or failed
+        """
+        return self.__readiness.get(host, 'failed')
+
+    def __setReadiness(self, host: str, ready: bool, started: float):
+        self.__readiness[host] = 'ready' if ready else 'failed'
+        logger.info(
+            'Plugin %s for %s %s after %.2f seconds.',
+            self.getName(),
+            host,
+            self.__readiness[host],
+            time.monotonic() - started
+        )
+
+    def setupHost(self, host: str):
+        """Run setup of a host (in a worker thread) and set readiness
+
+        Parameters
+        ----------
+        host : str
+            Hostname of spacestatus-server instance
+        """
+        started = time.monotonic()
+        with app.log.context(host=host, plugin=self.getName()):
+            try:
+                ready = self._setupHost(host) is not False
+            except Exception as e:
+                logger.error(
+                    'Setup of plugin %s for %s failed: %s',
+                    self.getName(), host, repr(e)
+                )
+                ready = False
+            self.__setReadiness(host, ready, started)
+
+    async def setupHostAsync(self, host: str):
+        """Run setup of a host (on the shared event loop) and set readiness
+
+        Parameters
+        ----------
+        host : str
+            Hostname of spacestatus-server instance
+        """
+        started = time.monotonic()
+        with app.log.context(host=host, plugin=self.getName()):
+            try:
+                ready = await self._setupHostAsync(host) is not False
+            except Exception as e:
+                logger.error(
+                    'Setup of plugin %s for %s failed: %s',
+                    self.getName(), host, repr(e)
+                )
+                ready = False
+            self.__setReadiness(host, ready, started)
+
+    def _setupHost(self, host: str):
+        """
+        Connect to remote services of a host (e.g. verify credentials)
+
+        The constructor only loads the configuration, setup of all plugins
+        and hosts runs concurrently after startup. Return False if the
+        setup failed.
+        """
+        pass
+
+    async def _setupHostAsync(self, host: str):
+        """
+        Coroutine to connect to remote services of a host if the plugin is
+        async
+        """
+        pass
+
+    def _teardownHost(self, host: str):
+        """Disconnect from remote services of a host"""
+        pass
+
+    async def _teardownHostAsync(self, host: str):
+        """
+        Coroutine to disconnect from remote services of a host if the plugin
+        is async
+        """
+        pass
+
+    def _getHttpSession(self, host: str, url: str) -> httpSession:
+        """Get pooled keep-alive session to a remote server
+
+        Parameters
+        ----------
+        host : str
+            Hostname of spacestatus-server instance
+        url : str
+            Url of the remote server
+
+        Returns
+        -------
+        httpSession
+        """
+        httpConfig = {
+            **self._httpDefault,
+            **self._config[host].get('http', {})
+        }
+        return httpTransport().getSession(
+            self.getName(),
+            url,
+            httpConfig['connect'],
+            httpConfig['read'],
+            httpConfig['concurrency']
+        )
+
     def _setHost(self, host: str):
-        self._host = host
+        self.__request.host = host
 
     def _getHost(self) -> str:
-        return self._host
+        return self.__request.host
+
+    def isAsync(self) -> bool:
+        return self._async
+
+    def isEnabledForHost(self, host: str) -> bool:
+        return host in self._config
 
     def onStateOpenChangeForHost(self, host: str, stateOpen: bool):
         self._setHost(host)
-        self.onStateOpenChange(stateOpen)
+        with app.log.context(host=host, plugin=self.getName()):
+            return self.onStateOpenChange(stateOpen)
+
+    async def onStateOpenChangeForHostAsync(self, host: str, stateOpen: bool):
+        """
+        The coroutine will be executed on the shared event loop on state
+        change if the plugin is async
+        """
+        raise NotImplementedError
 
     @abstractmethod
     def onStateOpenChange(self, host: str, stateOpen: bool):
-        """The method will be executed on state change"""
+        """
+        The method will be executed on state change
+
+        Return False (or raise an exception) if the notification should be
+        retried later.
+        """
         raise NotImplementedError
@@ -1,11 +1,15 @@
-import connexion
-import flask
-import flask_executor
+import atexit
+import concurrent.futures
 import inspect
-import pkgutil
+import logging
 import os
+import pkgutil
 
 import app.plugin
+from app.config import config
+from app.notificationQueue import notificationQueue
+
+logger = logging.getLogger(__name__)
 
 
 class pluginCollection:
@@ -28,25 +32,47 @@ class pluginCollection:
     # Scanned paths
     __scannedPaths = []
 
-    # Flask-Executor instance
-    __executor = None
-
     def __new__(singletonClass):
         """Instantiate singleton class"""
         if singletonClass.__instance is None:
-            print('Initialize plugins...')
+            logger.info('Initialize plugins...')
             singletonClass.__instance = \
                 super(pluginCollection, singletonClass).__new__(singletonClass)
             singletonClass.__instance.__reloadPlugins()
+            singletonClass.__instance.__setupPlugins()
+            notificationQueue().start(singletonClass.__instance.__plugins)
+            config().addReloadListener(
+                singletonClass.__instance.__onConfigReload
+            )
+            atexit.register(singletonClass.__instance.__teardownPlugins)
         return singletonClass.__instance
 
+    def __teardownPlugins(self):
+        """Disconnect all plugins from remote services on exit"""
+        for plugin in self.__plugins:
+            plugin.teardown()
+
     def __reloadPlugins(self):
         """Reset the list of all plugins and initiate all available plugins"""
         self.__plugins = []
         self.__scannedPaths = []
-        # print('Looking for plugins under package %s' % self.__pluginsPackage)
+        logger.debug(
+            'Looking for plugins under package %s', self.__pluginsPackage
+        )
         self.__scanPlugins(self.__pluginsPackage)
 
+    def __isLazyDiscovery(self) -> bool:
+        """Import only plugins enabled for any host (server.plugindiscovery)
+
+        Returns
+        -------
+        bool
+            False if all plugin modules are imported (plugindiscovery: all)
+        """
+        return config().getSection('server').get(
+            'plugindiscovery', 'lazy'
+        ) == 'lazy'
+
     def __scanPlugins(self, package):
         """Recursively walk the supplied package to retrieve all plugins"""
 
@@ -60,6 +86,18 @@ class pluginCollection:
                     importedPackage.__name__ + '.'
                 ):
             if not ispkg:
+                # Plugin modules are named like their plugin, so modules of
+                # plugins disabled for all hosts are not imported at all
+                if (
+                    self.__isLazyDiscovery() and
+                    not config().isPluginEnabled(pluginname.split('.')[-1])
+                   ):
+                    logger.info(
+                        '  Skip disabled plugin %s...',
+                        pluginname.split('.')[-1]
+                    )
+                    continue
+
                 plugin_module = __import__(pluginname, fromlist=['test'])
                 classmembers = \
                     inspect.getmembers(plugin_module, inspect.isclass)
@@ -68,9 +106,11 @@ class pluginCollection:
                     # of plugin, but NOT plugin itself
                     if (
                         issubclass(c, app.plugin.plugin) and
-                        c is not app.plugin.plugin
+                        c is not app.plugin.plugin and
+                        c.__name__ not in
+                        [p.getName() for p in self.__plugins]
                             ):
-                        print('  Found plugin %s...' % c.__name__)
+                        logger.info('  Found plugin %s...', c.__name__)
                         self.__plugins.append(c())
 
         # Scan all modules in current package recursively
@@ -94,40 +134,117 @@ class pluginCollection:
                 for childPackage in childPackages:
                     self.__scanPlugins(package + '.' + childPackage)
 
-    def __prepareExecutor(self):
-        if self.__executor is None:
-            self.__executor = flask_executor.Executor(flask.current_app)
+    def __onConfigReload(self, oldConfig, newConfig):
+        """Apply reloaded configuration to plugins
 
-    def onStateOpenChangeForHost(self, host: str, stateOpen: bool):
+        Only hosts with changed plugin configuration are set up again.
+        Plugins enabled by the new configuration are imported.
+
+        Parameters
+        ----------
+        oldConfig : configSnapshot
+            Previous configuration
+        newConfig : configSnapshot
+            Reloaded configuration
         """
-        Run plugin functions on state chage
+        setups = []
+        for plugin in self.__plugins:
+            try:
+                changedHosts, removedHosts = plugin.reloadConfig()
+            except LookupError as e:
+                logger.error('%s, keep previous configuration.', e)
+                continue
+
+            if changedHosts or removedHosts:
+                logger.info(
+                    'Plugin %s: configuration of %s changed, %s removed.',
+                    plugin.getName(),
+                    ', '.join(changedHosts) or '-',
+                    ', '.join(removedHosts) or '-'
+                )
+                plugin.onConfigChange(changedHosts, removedHosts)
+                setups += [(plugin, host) for host in changedHosts]
+
+        # Import plugins enabled by the new configuration
+        knownPlugins = len(self.__plugins)
+        self.__scannedPaths = []
+        try:
+            self.__scanPlugins(self.__pluginsPackage)
+        except LookupError as e:
+            logger.error('%s', e)
+        for plugin in self.__plugins[knownPlugins:]:
+            setups += [(plugin, host) for host in plugin.getHosts()]
+
+        notificationQueue().start(self.__plugins)
+        self.__setupPlugins(setups)
+
+    def __setupPlugins(self, setups: list = None):
         """
-        # Prepare Executor
-        self.__prepareExecutor()
+        Run setup of plugins and hosts concurrently
 
-        # Get requested host
-        host = connexion.request.headers['Host']
+        By default the setup runs in the background while the server is
+        already serving requests. Notifications are delayed until the
+        plugin is ready for the host. With server.pluginsetup = wait, the
+        startup waits until all setups are finished.
 
-        for plugin in self.__plugins:
-            executorName = '%s-%s' % (host, plugin.getName())
-
-            if (
-                self.__executor.futures._state(executorName) is None or
-                self.__executor.futures._state(executorName) == 'FINISHED'
-               ):
-                self.__executor.futures.pop(executorName)
-                self.__executor.submit_stored(
-                    executorName,
-                    plugin.onStateOpenChangeForHost,
-                    host,
-                    stateOpen
-                )
-                print(
-                    'onStateOpenChange - %s for %s started.'
-                    % (plugin.getName(), host)
+        Parameters
+        ----------
+        setups : list
+            Tuples of plugin and host (default all)
+        """
+        if setups is None:
+            setups = [
+                (plugin, host)
+                for plugin in self.__plugins
+                for host in plugin.getHosts()
+            ]
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            thread_name_prefix='plugin-setup'
+        )
+        futures = []
+        for plugin, host in setups:
+            if plugin.isAsync():
+                futures.append(
+                    app.plugin.eventLoop().submit(plugin.setupHostAsync(host))
                 )
             else:
-                print(
-                    'ERROR: onStageChange - %s for %s already running.'
-                    % (plugin.getName(), host)
-                )
+                futures.append(executor.submit(plugin.setupHost, host))
+        executor.shutdown(wait=False)
+
+        if (
+            config().getSection('server').get('pluginsetup', 'background')
+            == 'wait'
+           ):
+            concurrent.futures.wait(futures)
+
+    def getReadiness(self, host: str) -> dict:
+        """Get readiness of all plugins enabled for a host
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+
+        Returns
+        -------
+        dict
+            Readiness (pending, ready or failed) by plugin name
+        """
+        return {
+            plugin.getName(): plugin.getReadiness(host)
+            for plugin in self.__plugins
+            if plugin.isEnabledForHost(host)
+        }
+
+    def onStateOpenChangeForHost(self, host: str, stateOpen: bool):
+        """
+        Queue plugin notifications on state change
+
+        The notifications are delivered in the background by the
+        notification queue, independent of the framework serving the
+        request.
+        """
+        for plugin in self.__plugins:
+            if plugin.isEnabledForHost(host):
+                notificationQueue().enqueue(host, plugin.getName(), stateOpen)
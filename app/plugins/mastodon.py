@@ -1,12 +1,15 @@
+import logging
 import pydeepmerge
 import random
-import sys
+import requests
 import mastodon as mastodonApi
 from mastodon import Mastodon
 
 import app.plugin
 from app.config import config
 
+logger = logging.getLogger(__name__)
+
 
 class mastodon(app.plugin.plugin):
     """
@@ -35,9 +38,6 @@ class mastodon(app.plugin.plugin):
         'access_token',
     ]
 
-    # Maximum retries to post message
-    __maxRetries = 3
-
     # Mastodon API instances
     __mastodonApi = {}
 
@@ -46,38 +46,59 @@ class mastodon(app.plugin.plugin):
         try:
             super().__init__()
         except LookupError as e:
-            print(e)
+            logger.error('%s', e)
             raise e
 
-        # Init required mastodon api instances
-        for host, hostConfig in self._config.items():
+    def _setupHost(self, host: str) -> bool:
+        """Initialize mastodon api instance and verify credentials
+
+        Parameters
+        ----------
+        host : str
+            hostname of spacestatus-server instance
 
-            # Initialize mastodon api instance for host
-            self.__mastodonApi[host] = Mastodon(
-                access_token=hostConfig['access_token'],
-                api_base_url=hostConfig['base_url']
+        Returns
+        -------
+        bool
+        """
+        hostConfig = self._config[host]
+
+        # Initialize mastodon api instance for host, hosts on the same
+        # server share the pooled keep-alive session
+        self.__mastodonApi[host] = Mastodon(
+            access_token=hostConfig['access_token'],
+            api_base_url=hostConfig['base_url'],
+            session=self._getHttpSession(host, hostConfig['base_url'])
+        )
+
+        # Check credentials
+        try:
+            verifyCredentials =\
+                self.__mastodonApi[host].account_verify_credentials()
+            logger.info(
+                'Mastodon: Credentials for %s on server %s '
+                'for %s verified.',
+                verifyCredentials.display_name, hostConfig['base_url'], host
             )
+            return True
+        except mastodonApi.errors.MastodonError as e:
+            # Credentials wrong, remove instance and output error message
+            self.__mastodonApi.pop(host)
+            logger.error(
+                'Mastodon credentials for %s are not valid: %s',
+                host, e
+            )
+            return False
 
-            # Check credentials
-            try:
-                verifyCredentials =\
-                    self.__mastodonApi[host].account_verify_credentials()
-                print(
-                    'Mastodon: Credentials for %s on server %s '
-                    'for %s verified.' % (
-                        verifyCredentials.display_name,
-                        hostConfig['base_url'],
-                        host
-                    )
-                )
-            except mastodonApi.errors.MastodonError as e:
-                # Credentials wrong, remove instance and output error message
-                self.__mastodonApi.pop(host)
-                print(
-                    'ERROR: Mastodon credentials for %s are not valid: %s' %
-                    (host, e),
-                    file=sys.stderr
-                )
+    def _teardownHost(self, host: str):
+        """Remove mastodon api instance of a host
+
+        Parameters
+        ----------
+        host : str
+            hostname of spacestatus-server instance
+        """
+        self.__mastodonApi.pop(host, None)
 
     def __getWordlist(self) -> dict:
         try:
@@ -141,35 +162,31 @@ class mastodon(app.plugin.plugin):
 
         phrase = phrase.rstrip()
 
-        retry = 0
-        while retry < self.__maxRetries:
-            # Push status message to mastodon
-            try:
-                self.__getMastodonApi().status_post(
-                    phrase,
-                    visibility='unlisted'
-                )
-                print(
-                    'Mastodon: Send message "%s" for host %s successfull.' %
-                    (phrase, self._getHost())
-                )
-                retry = self.__maxRetries
-            except mastodonApi.error.MastodonError as e:
-                # Error sending message
-                print(
-                    'ERROR: Send status message to Mastodon for %s failed: '
-                    '%s' % (
-                        self._getHost(),
-                        e
-                    ),
-                    file=sys.stderr
-                )
-                retry = self.__maxRetries
-            except requests.exceptions.ConnectionError as e:
-                # Error sending message
-                print(
-                    'ERROR: Mastodon connection error for %s: %s' %
-                    (self._getHost(), e),
-                    file=sys.stderr
-                )
-                retry += 1
+        # Push status message to Mastodon, connection errors are retried by
+        # the notification queue
+        try:
+            self.__getMastodonApi().status_post(
+                phrase,
+                visibility='unlisted'
+            )
+            logger.info(
+                'Mastodon: Send message "%s" for host %s successfull.',
+                phrase, self._getHost()
+            )
+        except (
+            mastodonApi.errors.MastodonNetworkError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout
+        ) as e:
+            # Error sending message
+            logger.error(
+                'Mastodon connection error for %s: %s',
+                self._getHost(), e
+            )
+            return False
+        except mastodonApi.errors.MastodonError as e:
+            # Error sending message
+            logger.error(
+                'Send status message to Mastodon for %s failed: %s',
+                self._getHost(), e
+            )
@@ -1,14 +1,16 @@
-import asyncio
 import json
+import logging
 import nio
 import os
 import safer
-import sys
 
+import app.jsonCodec
 import app.plugin
 from app.config import config
 from app.data import data
 
+logger = logging.getLogger(__name__)
+
 
 class matrix(app.plugin.plugin):
     """
@@ -26,68 +28,54 @@ class matrix(app.plugin.plugin):
     # Matrix API instances
     __matrixApi = {}
 
-    # Event loop
-    __loop = None
+    # Plugin implements onStateOpenChangeForHostAsync
+    _async = True
 
     def __init__(self):
         """
         Constructor
 
-        Start base class constructor and initiate connection
+        Start base class constructor, connections are initiated by setup
         """
 
         # Start base class constructor
         try:
             super().__init__()
         except LookupError as e:
-            print(e)
+            logger.error('%s', e)
             raise e
 
-        # Init required for matrix api instances
-        for host, hostConfig in self._config.items():
-
-            # Set default session cache file
-            if 'sessioncache' not in hostConfig:
-                hostConfig['sessioncache'] = 'config/cache/matrix-%s' % host
-
-            # Initialize matrix api instance and connect to server
-            self.__loop = asyncio.get_event_loop()
-            self.__loop.run_until_complete(self.__connect(host, hostConfig))
-
-    def __del__(self):
-        """
-        Destructor to cleanup matrix api instances
-        """
-        for host, _ in self._config.items():
-            try:
-                print("MATRIX: Close connection for %s" % host)
-                self.__loop.run_until_complete(self.__matrixApi[host].close())
-            except KeyError:
-                pass
-
-    async def __connect(self, host, hostConfig):
+    async def _setupHostAsync(self, host: str) -> bool:
         """Login to matrix using cached session information or credentials
 
         Parameters
         ----------
         host : string
             hostname of spacestatus-server instance
-        hostConfig : dict
-            configuration for plugin
+
+        Returns
+        -------
+        bool
         """
+        hostConfig = self._config[host]
+
+        # Set default session cache file
+        if 'sessioncache' not in hostConfig:
+            hostConfig['sessioncache'] = 'config/cache/matrix-%s' % host
 
         if os.path.exists(hostConfig['sessioncache']):
 
             # Use previus session tokens
-            with open(hostConfig['sessioncache'], 'r') as f:
-                sessionCache = json.load(f)
+            with open(hostConfig['sessioncache'], 'rb') as f:
+                sessionCache = app.jsonCodec.loads(f.read())
 
             # Reauthenticate if homeserver and username are equal
             if (sessionCache['homeserver'] == hostConfig['homeserver']
                     and sessionCache['user_id'] == hostConfig['username']):
 
-                print(
-                    'MATRIX: Try reauthentication to homeserver for %s' % host
+                logger.info(
+                    'MATRIX: Try reauthentication to homeserver for %s',
+                    host
                 )
 
                 client = nio.AsyncClient(hostConfig['homeserver'])
@@ -100,10 +88,10 @@ class matrix(app.plugin.plugin):
                 self.__matrixApi[host] = client
 
                 # Try to send welcome message to verify cached credentials
-                if await self.__sendWelcomeMessage(host, hostConfig['room']):
-                    return
+                if await self.__sendWelcomeMessage(host):
+                    return True
 
-        print('MATRIX: Authenticate to homeserver for %s' % host)
+        logger.info('MATRIX: Authenticate to homeserver for %s', host)
 
         # Try to login
         client = nio.AsyncClient(
@@ -117,10 +105,10 @@ class matrix(app.plugin.plugin):
 
         # check that we logged in succesfully
         if (isinstance(loginResponse, nio.LoginResponse)):
-            print(
-                'MATRIX: Successfully authenticated to ' +
-                'homeserver for %s with device id %s.' %
-                (host, loginResponse.device_id)
+            logger.info(
+                'MATRIX: Successfully authenticated to '
+                'homeserver for %s with device id %s.',
+                host, loginResponse.device_id
             )
             self.__matrixApi[host] = client
 
@@ -136,28 +124,41 @@ class matrix(app.plugin.plugin):
                         indent=4
                     )
                 )
-            print('MATRIX: Save cached session for %s.' % host)
+            logger.info('MATRIX: Save cached session for %s.', host)
         else:
-            print(
-                'ERROR: Login to homeserver for %s failed: %' %
-                (host, loginResponse),
-                file=sys.stderr
+            logger.error(
+                'Login to homeserver for %s failed: %s',
+                host, loginResponse
             )
             await client.close()
+            return False
 
         # Try to send welcome message to verify login
-        if await self.__sendWelcomeMessage(host, hostConfig['room']):
+        return await self.__sendWelcomeMessage(host)
+
+    async def _teardownHostAsync(self, host: str):
+        """Close matrix api instance of a host
+
+        Parameters
+        ----------
+        host : string
+            hostname of spacestatus-server instance
+        """
+        try:
+            client = self.__matrixApi.pop(host)
+        except KeyError:
             return
 
-    async def __sendWelcomeMessage(self, host, room: str) -> bool:
+        logger.info("MATRIX: Close connection for %s", host)
+        await client.close()
+
+    async def __sendWelcomeMessage(self, host) -> bool:
         """Send welcome message with current status
 
         Parameters
         ----------
         host : string
             hostname of spacestatus-server instance
-        room : string
-            room id
 
         Returns
         -------
@@ -172,67 +173,97 @@ class matrix(app.plugin.plugin):
 
         # Try to join new room and haven't joined as that user, you can use
         # Joining if already joined will also be successfull
+        room = self.__getRoom(host)
         joinResponse = await self.__matrixApi[host].join(room)
         if not isinstance(joinResponse, nio.JoinResponse):
             # Join to channel failed
-            self.__matrixApi.pop(host)
-            print(
-                'ERROR: Matrix join to room %s for %s failed.' %
-                (room, host),
-                file=sys.stderr
+            await self._teardownHostAsync(host)
+            logger.error(
+                'Matrix join to room %s for %s failed.',
+                room, host
             )
             return False
 
         # Push status message to matrix
+        if await self.__sendMessage(host, welcomePhrase):
+            logger.info(
+                'MATRIX: Welcome message for %s send successfully.',
+                host
+            )
+            return True
+        else:
+            # Cached session credetials invalid,
+            # close instance and output error message
+            await self._teardownHostAsync(host)
+            logger.error('Matrix cached session for %s is not valid.', host)
+            return False
+
+    async def __sendMessage(self, host: str, message: str) -> bool:
+        """Send notice to the room of a host
+
+        Parameters
+        ----------
+        host : string
+            hostname of spacestatus-server instance
+        message : string
+            message to send
+
+        Returns
+        -------
+        bool
+            Message was sent
+        """
         messageResponse = await self.__matrixApi[host].room_send(
-            room,
+            self.__getRoom(host),
             message_type="m.room.message",
             content={
                 "msgtype": "m.notice",
-                "body": welcomePhrase
+                "body": message
             }
         )
 
-        if isinstance(messageResponse, nio.RoomSendResponse):
-            print('MATRIX: Welcome message for %s send successfully.' % host)
-            return True
-        else:
-            # Cached session credetials invalid,
-            # remove instance and output error message
-            self.__matrixApi.pop(host)
-            print(
-                'ERROR: Matrix cached session for %s is not valid.' %
-                (host),
-                file=sys.stderr
-            )
-            return False
+        return isinstance(messageResponse, nio.RoomSendResponse)
 
-    def __getMatrixApi(self) -> nio.AsyncClient:
-        """Get Matrix api instance for current host of the request
+    def __getMatrixApi(self, host: str) -> nio.AsyncClient:
+        """Get Matrix api instance for a host
+
+        Parameters
+        ----------
+        host : string
+            hostname of spacestatus-server instance
 
         Returns
         -------
-        bool
+        nio.AsyncClient
         """
         try:
-            return self.__matrixApi[self._getHost()]
+            return self.__matrixApi[host]
         except KeyError:
             return None
 
-    def __getRoom(self) -> str:
-        """Get room id for current host of the request
+    def __getRoom(self, host: str) -> str:
+        """Get room id for a host
+
+        Parameters
+        ----------
+        host : string
+            hostname of spacestatus-server instance
 
         Returns
         -------
         string
         """
-        return self._getConfig()['room']
+        return self._config[host]['room']
 
-    async def __onStateOpenChangeAsync(self, stateOpen: bool) -> bool:
-        """Send status message async
+    async def onStateOpenChangeForHostAsync(
+            self, host: str, stateOpen: bool
+            ) -> bool:
+        """Send status message async (on shared plugin event loop)
 
         Parameters
         ----------
+        host : string
+            hostname of spacestatus-server instance
         stateOpen : bool
             current status
 
@@ -241,36 +272,27 @@ class matrix(app.plugin.plugin):
         bool
         """
 
+        # No matrix API instance available
+        if self.__getMatrixApi(host) is None:
+            return False
+
         # Set phrase to name and state
         phrase = \
             "%s is %s." % (
-                data().getSpace(self._getHost()),
+                data().getSpace(host),
                 "open" if stateOpen else "closed"
             )
 
         # Push status message to matrix
-        messageResponse = await self.__getMatrixApi().room_send(
-            self.__getRoom(),
-            message_type="m.room.message",
-            content={
-                "msgtype": "m.notice",
-                "body": "%s" % phrase
-            }
-        )
-
-        if isinstance(messageResponse, nio.RoomSendResponse):
-            print(
-                'MATRIX: Send message "%s" for host %s successfull.' %
-                (phrase, self._getHost())
+        if await self.__sendMessage(host, phrase):
+            logger.info(
+                'MATRIX: Send message "%s" for host %s successfull.',
+                phrase, host
             )
             return True
         else:
             # Error sending message
-            print(
-                'ERROR: Send status message to Matrix for %s failed: %s' %
-                (self._getHost(), messageResponse),
-                file=sys.stderr
-            )
+            logger.error('Send status message to Matrix for %s failed.', host)
             return False
 
     def onStateOpenChange(self, stateOpen: bool):
@@ -281,12 +303,6 @@ class matrix(app.plugin.plugin):
         stateOpen : bool
             new state after state change
         """
-
-        # No matrix API instance available
-        if self.__getMatrixApi() is None:
-            return
-
-        # Send message async
-        self.__loop.run_until_complete(
-            self.__onStateOpenChangeAsync(stateOpen)
+        return app.plugin.eventLoop().run(
+            self.onStateOpenChangeForHostAsync(self._getHost(), stateOpen)
         )
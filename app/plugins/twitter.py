@@ -1,11 +1,14 @@
+import logging
 import pydeepmerge
 import random
-import sys
+import requests
 import twitter as twitterApi
 
 import app.plugin
 from app.config import config
 
+logger = logging.getLogger(__name__)
+
 
 class twitter(app.plugin.plugin):
     """
@@ -27,6 +30,7 @@ class twitter(app.plugin.plugin):
             }
         },
         'timeout': 30,
+        'base_url': 'https://api.twitter.com/1.1',
     }
 
     # Required configuration values
@@ -37,9 +41,6 @@ class twitter(app.plugin.plugin):
         'consumer.secret'
     ]
 
-    # Maximum retries to post message
-    __maxRetries = 3
-
     # Twitter API instances
     __twitterApi = {}
 
@@ -48,41 +49,73 @@ class twitter(app.plugin.plugin):
         try:
             super().__init__()
         except LookupError as e:
-            print(e)
+            logger.error('%s', e)
             raise e
 
-        # Init required twitter api instances
-        for host, hostConfig in self._config.items():
+    def _setupHost(self, host: str) -> bool:
+        """Initialize twitter api instance and verify credentials
 
-            # Initialize twitter api instance for host
-            self.__twitterApi[host] = twitterApi.Api(
-                consumer_key=hostConfig['consumer']['key'],
-                consumer_secret=hostConfig['consumer']['secret'],
-                access_token_key=hostConfig['access']['token'],
-                access_token_secret=hostConfig['access']['secret'],
-                timeout=hostConfig['timeout']
-            )
+        Parameters
+        ----------
+        host : str
+            hostname of spacestatus-server instance
 
-            # Check credentials
-            try:
-                verifyCredentials =\
-                    self.__twitterApi[host].VerifyCredentials(
-                        include_entities=False,
-                        skip_status=True,
-                        include_email=False
-                    )
-                print(
-                    'Twitter: Credentials for %s on host %s verified.' %
-                    (verifyCredentials.screen_name, host)
-                )
-            except twitterApi.error.TwitterError as e:
-                # Credentials wrong, remove instance and output error message
-                self.__twitterApi.pop(host)
-                print(
-                    'ERROR: Twitter credentials for %s are not valid: %s' %
-                    (host, e),
-                    file=sys.stderr
+        Returns
+        -------
+        bool
+        """
+        hostConfig = self._config[host]
+
+        # Initialize twitter api instance for host
+        self.__twitterApi[host] = twitterApi.Api(
+            consumer_key=hostConfig['consumer']['key'],
+            consumer_secret=hostConfig['consumer']['secret'],
+            access_token_key=hostConfig['access']['token'],
+            access_token_secret=hostConfig['access']['secret'],
+            timeout=hostConfig['timeout'],
+            base_url=hostConfig['base_url']
+        )
+
+        # Use pooled keep-alive session shared by all hosts, the timeout
+        # is used as read timeout of the session
+        hostConfig.setdefault('http', {}).setdefault(
+            'read', hostConfig['timeout']
+        )
+        self.__twitterApi[host]._session = self._getHttpSession(
+            host, hostConfig['base_url']
+        )
+
+        # Check credentials
+        try:
+            verifyCredentials =\
+                self.__twitterApi[host].VerifyCredentials(
+                    include_entities=False,
+                    skip_status=True,
+                    include_email=False
                 )
+            logger.info(
+                'Twitter: Credentials for %s on host %s verified.',
+                verifyCredentials.screen_name, host
+            )
+            return True
+        except twitterApi.error.TwitterError as e:
+            # Credentials wrong, remove instance and output error message
+            self.__twitterApi.pop(host)
+            logger.error(
+                'Twitter credentials for %s are not valid: %s',
+                host, e
+            )
+            return False
+
+    def _teardownHost(self, host: str):
+        """Remove twitter api instance of a host
+
+        Parameters
+        ----------
+        host : str
+            hostname of spacestatus-server instance
+        """
+        self.__twitterApi.pop(host, None)
 
     def __getWordlist(self) -> dict:
         try:
@@ -146,29 +179,27 @@ class twitter(app.plugin.plugin):
 
         phrase = phrase.rstrip()
 
-        retry = 0
-        while retry < self.__maxRetries:
-            # Push status message to twitter
-            try:
-                self.__getTwitterApi().PostUpdate(phrase)
-                print(
-                    'Twitter: Send message "%s" for host %s successfull.' %
-                    (phrase, self._getHost())
-                )
-                retry = self.__maxRetries
-            except twitterApi.error.TwitterError as e:
-                # Error sending message
-                print(
-                    'ERROR: Send status message to Twitter for %s failed: %s' %
-                    (self._getHost(), e),
-                    file=sys.stderr
-                )
-                retry = self.__maxRetries
-            except requests.exceptions.ConnectionError as e:
-                # Error sending message
-                print(
-                    'ERROR: Twitter connection error for %s: %s' %
-                    (self._getHost(), e),
-                    file=sys.stderr
-                )
-                retry += 1
+        # Push status message to Twitter, connection errors are retried by
+        # the notification queue
+        try:
+            self.__getTwitterApi().PostUpdate(phrase)
+            logger.info(
+                'Twitter: Send message "%s" for host %s successfull.',
+                phrase, self._getHost()
+            )
+        except twitterApi.error.TwitterError as e:
+            # Error sending message
+            logger.error(
+                'Send status message to Twitter for %s failed: %s',
+                self._getHost(), e
+            )
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout
+        ) as e:
+            # Error sending message
+            logger.error(
+                'Twitter connection error for %s: %s',
+                self._getHost(), e
+            )
+            return False
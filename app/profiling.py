@@ -0,0 +1,259 @@
+import asyncio
+import cProfile
+import contextvars
+import functools
+import glob
+import hmac
+import inspect
+import itertools
+import logging
+import os
+import pstats
+import re
+import time
+import types
+import urllib.parse
+
+import app.log
+from app.config import config, keyDigest
+
+logger = logging.getLogger(__name__)
+
+# Profiles of the running request (None if the request is not profiled)
+__profiles = contextvars.ContextVar('profiles', default=None)
+
+
+@types.coroutine
+def __stepProfiled(coroutine, profile: cProfile.Profile):
+    """Run coroutine with the profiler enabled only while it is running
+
+    Other tasks running on the event loop while the coroutine waits are not
+    part of the profile.
+    """
+    value, error = None, None
+    while True:
+        profile.enable()
+        try:
+            if error is None:
+                future = coroutine.send(value)
+            else:
+                future = coroutine.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            profile.disable()
+
+        try:
+            value, error = (yield future), None
+        except GeneratorExit:
+            coroutine.close()
+            raise
+        except BaseException as e:
+            value, error = None, e
+
+
+async def runProfiled(coroutine) -> list:
+    """Run coroutine of a request with profiler
+
+    Handlers running in worker threads (Flask mode) are profiled by
+    profiledFunctionResolver into own profiles of the request.
+
+    Parameters
+    ----------
+    coroutine : coroutine
+        Coroutine of the request (e.g. call of the next ASGI app)
+
+    Returns
+    -------
+    list
+        Profiles (cProfile.Profile) of the request
+    """
+    profiles = [cProfile.Profile()]
+    token = __profiles.set(profiles)
+    try:
+        await __stepProfiled(coroutine, profiles[0])
+    finally:
+        __profiles.reset(token)
+    return profiles
+
+
+def profiledFunctionResolver(functionResolver):
+    """
+    Wrap function resolver to profile handlers running in worker threads
+
+    Coroutine functions run on the event loop and are already profiled by
+    runProfiled.
+
+    Parameters
+    ----------
+    functionResolver : callable
+        Function resolver returning the handler of an operation id
+
+    Returns
+    -------
+    callable
+        Function resolver returning handlers profiled if requested
+    """
+    def resolve(operationId: str):
+        function = functionResolver(operationId)
+        if inspect.iscoroutinefunction(function):
+            return function
+
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            profiles = __profiles.get()
+            if profiles is None:
+                return function(*args, **kwargs)
+
+            profile = cProfile.Profile()
+            profiles.append(profile)
+            return profile.runcall(function, *args, **kwargs)
+
+        return profiled
+
+    return resolve
+
+
+class profilingMiddleware:
+    """
+    ASGI middleware profiling requests on demand or by sampling
+
+    A request is profiled if the X-Profile header or the profile query
+    parameter contains a profiling key (profiling.key) or if it is one in
+    profiling.sample requests. The profile is written as pstats file (e.g.
+    for snakeviz or python -m pstats) to profiling.directory, only the
+    newest profiling.keep files are retained.
+
+    The middleware is only added if profiling is enabled on startup.
+    """
+
+    # Default settings (config profiling)
+    __settingsDefault = {
+        'enabled': False,
+        'key': [],
+        'sample': 0,
+        'directory': 'config/cache/profiles',
+        'keep': 20,
+    }
+
+    def __init__(self, app):
+        self.__app = app
+        self.__requests = itertools.count(1)
+
+    def __getSetting(self, setting: str):
+        return config().getSection('profiling').get(
+            setting, self.__settingsDefault[setting]
+        )
+
+    def __isAuthorized(self, key: str) -> bool:
+        """Compare key with all profiling keys in constant time"""
+        keys = self.__getSetting('key')
+        if isinstance(keys, str):
+            keys = [keys]
+
+        digest = keyDigest(key)
+        valid = False
+        for profilingKey in keys:
+            valid |= hmac.compare_digest(digest, keyDigest(profilingKey))
+        return valid
+
+    def __sanitize(self, value: str) -> str:
+        """Replace all but letters and digits for use in filenames"""
+        return re.sub(r'[^A-Za-z0-9]+', '_', value or '').strip('_')
+
+    def __popQueryKey(self, scope) -> tuple:
+        """Remove profile query parameter
+
+        Returns
+        -------
+        tuple
+            Scope without the parameter and its value (None if not set)
+        """
+        if b'profile=' not in scope['query_string']:
+            return scope, None
+
+        key = None
+        query = []
+        for name, value in urllib.parse.parse_qsl(
+            scope['query_string'].decode('latin-1'), keep_blank_values=True
+        ):
+            if name == 'profile':
+                key = value
+            else:
+                query.append((name, value))
+        return dict(
+            scope,
+            query_string=urllib.parse.urlencode(query).encode('latin-1')
+        ), key
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope['type'] != 'http' or
+            not self.__getSetting('enabled')
+           ):
+            await self.__app(scope, receive, send)
+            return
+
+        scope, key = self.__popQueryKey(scope)
+        for k, v in scope['headers']:
+            if k.lower() == b'x-profile':
+                key = v.decode('latin-1')
+        onDemand = key is not None and self.__isAuthorized(key)
+
+        sample = self.__getSetting('sample')
+        if not onDemand and (
+            sample <= 0 or next(self.__requests) % sample != 0
+           ):
+            await self.__app(scope, receive, send)
+            return
+
+        # Host and request id are taken from request headers
+        host, _, requestId = app.log.getContext()
+        filename = '%s-%s-%s-%s.prof' % (
+            time.strftime('%Y%m%d-%H%M%S'),
+            self.__sanitize(host) or 'unknown',
+            self.__sanitize(scope['path']) or 'home',
+            self.__sanitize(requestId) or next(self.__requests)
+        )
+
+        async def sendWithProfile(message):
+            if onDemand and message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-profile-file', filename.encode('latin-1'))
+                ]
+            await send(message)
+
+        started = time.perf_counter()
+        profiles = await runProfiled(
+            self.__app(scope, receive, sendWithProfile)
+        )
+        duration = time.perf_counter() - started
+
+        # Write profile without blocking the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.__save, profiles, filename
+        )
+        logger.info(
+            'Profile of %s %s (%.1f ms) written to %s',
+            scope['method'], scope['path'], duration * 1000, filename
+        )
+
+    def __save(self, profiles: list, filename: str):
+        """Write merged profiles and remove the oldest profile files"""
+        directory = self.__getSetting('directory')
+        os.makedirs(directory, exist_ok=True)
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(os.path.join(directory, filename))
+
+        files = sorted(
+            glob.glob(os.path.join(directory, '*.prof')),
+            key=os.path.getmtime
+        )
+        for oldFile in files[:max(0, len(files) - self.__getSetting('keep'))]:
+            try:
+                os.remove(oldFile)
+            except OSError:
+                pass
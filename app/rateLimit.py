@@ -0,0 +1,186 @@
+import collections
+import math
+import time
+
+from app.config import config, keyDigest
+
+
+class tokenBuckets:
+    """
+    Token buckets by client with bounded memory
+
+    Every bucket holds up to burst tokens and is refilled with rate tokens
+    per second. The least recently used buckets are dropped if more than
+    the maximum number of buckets exist, a dropped bucket starts full
+    again.
+    """
+
+    def __init__(self, maxEntries: int):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        maxEntries : int
+            Maximum number of buckets
+        """
+        self.__maxEntries = maxEntries
+        self.__buckets = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__buckets)
+
+    def take(self, key: tuple, rate: float, burst: float) -> float:
+        """Take a token from a bucket
+
+        Parameters
+        ----------
+        key : tuple
+            Identifier of the bucket
+        rate : float
+            Refill rate in tokens per second
+        burst : float
+            Capacity of the bucket
+
+        Returns
+        -------
+        float
+            0 if a token was available, otherwise seconds until the next
+            token is available
+        """
+        now = time.monotonic()
+        try:
+            tokens, updated = self.__buckets[key]
+            self.__buckets.move_to_end(key)
+            tokens = min(burst, tokens + (now - updated) * rate)
+        except KeyError:
+            tokens = burst
+            if len(self.__buckets) >= self.__maxEntries:
+                self.__buckets.popitem(last=False)
+
+        if tokens >= 1:
+            self.__buckets[key] = (tokens - 1, now)
+            return 0
+
+        self.__buckets[key] = (tokens, now)
+        return (1 - tokens) / rate
+
+
+class rateLimitMiddleware:
+    """
+    ASGI middleware limiting requests by client with token buckets
+
+    Writing requests with a valid api key are limited by key and host,
+    other writing requests and reading requests by client address and host.
+    Buckets of valid keys are kept apart, so requests with invalid keys can
+    not use them up or evict them. Limits are configured globally
+    (ratelimit.write and ratelimit.read) and could be overwritten by url rule
+    per host like the api key. Requests over the limit are answered with 429
+    and Retry-After before authentication and routing.
+    """
+
+    # Methods limited as reading requests
+    __readMethods = ('GET', 'HEAD', 'OPTIONS')
+
+    # Default limits (rate in requests per second, 0 = unlimited)
+    __limitsDefault = {
+        'write': {'rate': 2, 'burst': 20},
+        'read': {'rate': 0, 'burst': 100},
+    }
+
+    # Default maximum number of tracked clients
+    __maxEntriesDefault = 10000
+
+    def __init__(self, app):
+        self.__app = app
+        maxEntries = config().getSection('ratelimit').get(
+            'maxentries', self.__maxEntriesDefault
+        )
+        self.__buckets = tokenBuckets(maxEntries)
+        self.__keyBuckets = tokenBuckets(maxEntries)
+
+    def __getLimit(self, host: str, path: str, kind: str) -> tuple:
+        """Get rate and burst for a request
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        path : str
+            Url rule (path) of the request
+        kind : str
+            write or read
+
+        Returns
+        -------
+        tuple
+            Rate (0 = unlimited) and burst
+        """
+        limit = config().getSection('ratelimit').get(
+            kind, self.__limitsDefault[kind]
+        )
+
+        try:
+            hostLimits = config().getConfig()['hosts'][host]['ratelimit']
+            limit = hostLimits.get(path, hostLimits.get(kind, limit))
+        except (KeyError, TypeError, AttributeError):
+            pass
+
+        return (
+            limit.get('rate', self.__limitsDefault[kind]['rate']),
+            limit.get('burst', self.__limitsDefault[kind]['burst'])
+        )
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope['type'] != 'http' or
+            not config().getSection('ratelimit').get('enabled', False)
+           ):
+            await self.__app(scope, receive, send)
+            return
+
+        headers = {
+            k.decode('latin-1').lower(): v.decode('latin-1')
+            for k, v in scope['headers']
+        }
+        host = headers.get('host', '')
+        path = scope['path']
+        buckets = self.__buckets
+        client = (scope.get('client') or ('', 0))[0]
+        if scope['method'] in self.__readMethods:
+            kind = 'read'
+        else:
+            kind = 'write'
+            # Only valid keys get own buckets (hostname is already resolved
+            # to the configured host by hostRoutingMiddleware)
+            digest = keyDigest(headers.get('x-hackspace-api-key', ''))
+            if digest in (config().getKeyDigests(host, path) or ()):
+                buckets = self.__keyBuckets
+                client = digest
+
+        rate, burst = self.__getLimit(host, path, kind)
+        if rate > 0:
+            retryAfter = buckets.take(
+                (kind, host, path, client), rate, burst
+            )
+            if retryAfter > 0:
+                await self.__respond(send, math.ceil(retryAfter))
+                return
+
+        await self.__app(scope, receive, send)
+
+    async def __respond(self, send, retryAfter: int):
+        """Send response for requests over the limit"""
+        await send({
+            'type': 'http.response.start',
+            'status': 429,
+            'headers': [
+                (b'content-type', b'text/plain'),
+                (b'retry-after', str(retryAfter).encode('latin-1')),
+                (b'cache-control', b'no-store'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'Too many requests'
+        })
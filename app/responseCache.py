@@ -0,0 +1,232 @@
+import asyncio
+import time
+
+import app.compression
+import app.jsonCodec
+from app.config import config
+from app.data import data
+
+
+class responseCache:
+    """Cache for finished responses by host, invalidated by data version"""
+
+    # Singleton instance
+    __instance = None
+
+    # Cached responses by host and name as tuple of version, expiry, content
+    # and compressed contents by encoding
+    __cache = {}
+
+    # Default settings (section compression)
+    __compressionDefault = {
+        'enabled': True,
+        # Minimum size in bytes of compressed responses
+        'minsize': 1024,
+    }
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(responseCache, singletonClass).__new__(singletonClass)
+        return singletonClass.__instance
+
+    def get(self, host: str, name: str, builder, ttl: int = 0):
+        """Get cached response or build it for current data version
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        name : str
+            Name of the cached response (e.g. endpoint)
+        builder : callable
+            Function without parameters returning the response content
+        ttl : int
+            Maximum age of the cached response in seconds (0 = unlimited)
+
+        Returns
+        -------
+        bytes or str
+            Response content
+        """
+        return self.__getEntry(host, name, builder, ttl)[2]
+
+    def getEncoded(
+            self, host: str, name: str, builder, acceptEncoding: str,
+            ttl: int = 0
+            ) -> tuple:
+        """Get cached response compressed with encoding accepted by client
+
+        Every encoding is compressed once per data version and cached with
+        the uncompressed response. Responses smaller than compression.minsize
+        are not compressed.
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        name : str
+            Name of the cached response (e.g. endpoint)
+        builder : callable
+            Function without parameters returning the response content
+        acceptEncoding : str
+            Value of the Accept-Encoding header
+        ttl : int
+            Maximum age of the cached response in seconds (0 = unlimited)
+
+        Returns
+        -------
+        tuple
+            Response content (bytes) and content encoding (None if not
+            compressed)
+        """
+        content, encoding, encoded = self.__negotiate(
+            host, name, builder, acceptEncoding, ttl
+        )
+        if encoding is None:
+            return content, None
+
+        try:
+            return encoded[encoding], encoding
+        except KeyError:
+            # Concurrent requests could compress twice, all get the same
+            # content
+            return \
+                encoded.setdefault(
+                    encoding, app.compression.compress(content, encoding)
+                ), encoding
+
+    async def getEncodedAsync(
+            self, host: str, name: str, builder, acceptEncoding: str,
+            ttl: int = 0
+            ) -> tuple:
+        """Get cached compressed response (async mode, see getEncoded)
+
+        Responses are compressed in a worker thread to not block the event
+        loop.
+        """
+        content, encoding, encoded = self.__negotiate(
+            host, name, builder, acceptEncoding, ttl
+        )
+        if encoding is None:
+            return content, None
+
+        try:
+            return encoded[encoding], encoding
+        except KeyError:
+            compressed = await asyncio.to_thread(
+                app.compression.compress, content, encoding
+            )
+            return encoded.setdefault(encoding, compressed), encoding
+
+    def __negotiate(
+            self, host: str, name: str, builder, acceptEncoding: str,
+            ttl: int
+            ) -> tuple:
+        """Get cached response and encoding to compress it with
+
+        Returns
+        -------
+        tuple
+            Uncompressed content (bytes), content encoding (None if not
+            compressed) and compressed contents by encoding
+        """
+        _, _, content, encoded = self.__getEntry(host, name, builder, ttl)
+        if isinstance(content, str):
+            content = encoded.setdefault(None, content.encode('utf-8'))
+
+        settings = config().getSection('compression')
+        if (
+            not settings.get('enabled', self.__compressionDefault['enabled'])
+            or len(content) < settings.get(
+                'minsize', self.__compressionDefault['minsize']
+            )
+           ):
+            return content, None, encoded
+
+        return content, app.compression.negotiate(acceptEncoding), encoded
+
+    def __getEntry(self, host: str, name: str, builder, ttl: int) -> tuple:
+        """Get cache entry for current data version (see get)"""
+        # Get version before building to never cache new content as old one
+        version = data().getVersion(host)
+
+        try:
+            entry = self.__cache[(host, name)]
+            if (
+                entry[0] == version and
+                (entry[1] is None or entry[1] > time.monotonic())
+               ):
+                return entry
+        except KeyError:
+            pass
+
+        entry = (
+            version,
+            time.monotonic() + ttl if ttl > 0 else None,
+            builder(),
+            {}
+        )
+        self.__cache[(host, name)] = entry
+        return entry
+
+    def getJson(
+            self, host: str, name: str, builder, acceptEncoding: str = ''
+            ) -> tuple:
+        """Get cached json response or build it for current data version
+
+        Parameters
+        ----------
+        host : str
+            Hostname
+        name : str
+            Name of the cached response (e.g. endpoint)
+        builder : callable
+            Function without parameters returning the response dictionary
+        acceptEncoding : str
+            Value of the Accept-Encoding header
+
+        Returns
+        -------
+        tuple
+            JSON encoded response content (bytes) and content encoding (see
+            getEncoded)
+        """
+        return self.getEncoded(
+            host,
+            name,
+            self.__jsonBuilder(builder),
+            acceptEncoding
+        )
+
+    def __jsonBuilder(self, builder):
+        """Wrap builder of a response dictionary to serialize it"""
+        return lambda: app.jsonCodec.dumps(
+            builder(), indent=True, sortKeys=True
+        ) + b"\n"
+
+    async def getJsonAsync(
+            self, host: str, name: str, builder, acceptEncoding: str = ''
+            ) -> tuple:
+        """Get cached json response (async mode, see getJson)"""
+        return await self.getEncodedAsync(
+            host,
+            name,
+            self.__jsonBuilder(builder),
+            acceptEncoding
+        )
+
+    def invalidate(self, host: str = None):
+        """Remove cached responses
+
+        Parameters
+        ----------
+        host : str
+            Hostname (all hosts if not set)
+        """
+        if host is None:
+            self.__cache.clear()
+        else:
+            for key in [k for k in self.__cache if k[0] == host]:
+                self.__cache.pop(key, None)
@@ -0,0 +1,217 @@
+import contextlib
+import fcntl
+import mmap
+import os
+import struct
+import threading
+
+
+class sharedState:
+    """
+    Memory mapped state file shared between worker processes
+
+    The file starts with a header of the sequence counter and the payload
+    length followed by the payload. Writers serialize via an exclusive file
+    lock and set an odd sequence while writing (seqlock), so readers never
+    need a lock and only have to compare the sequence to detect changes.
+    The sequence is the same in all processes, so it could be used as
+    version of the payload.
+    """
+
+    # Header with sequence counter and payload length
+    __header = struct.Struct('<QQ')
+
+    # Initial payload capacity of a new file
+    __initialCapacity = 64 * 1024
+
+    def __init__(self, filename: str):
+        """
+        Constructor
+
+        Open or create the state file and map it into memory
+
+        Parameters
+        ----------
+        filename : str
+            Filename of the shared state file
+        """
+        self.__filename = filename
+        self.__fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o600)
+
+        # File locks are bound to the open file, so threads of the same
+        # process have to be serialized separately
+        self.__writeLock = threading.RLock()
+
+        # Nesting depth and thread holding the exclusive lock
+        self.__lockDepth = 0
+        self.__lockOwner = None
+
+        # Readers do not lock, but remapping has to be serialized
+        self.__mapLock = threading.Lock()
+        self.__mmap = None
+
+        fcntl.flock(self.__fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.__fd).st_size < self.__header.size:
+                os.ftruncate(
+                    self.__fd,
+                    self.__header.size + self.__initialCapacity
+                )
+        finally:
+            fcntl.flock(self.__fd, fcntl.LOCK_UN)
+
+        self.__map()
+
+    def __map(self):
+        """(Re)map the complete file into memory and close the old mapping
+
+        Readers of other threads could still use the old mapping, so they
+        retry with the new one if it was closed (ValueError).
+        """
+        with self.__mapLock:
+            size = os.fstat(self.__fd).st_size
+            old = self.__mmap
+            if old is not None and len(old) >= size:
+                # Already remapped by another thread
+                return
+
+            self.__mmap = mmap.mmap(self.__fd, size)
+            if old is not None:
+                try:
+                    old.close()
+                except BufferError:
+                    # Still exported by a reader, unmapped as soon as it
+                    # is released
+                    pass
+
+    def getFilename(self) -> str:
+        return self.__filename
+
+    def getSequence(self) -> int:
+        """Get current sequence counter
+
+        Returns
+        -------
+        int
+            Sequence counter (0 if nothing was written yet)
+        """
+        while True:
+            try:
+                return self.__header.unpack_from(self.__mmap, 0)[0]
+            except ValueError:
+                # Mapping was closed by a remap of another thread
+                continue
+
+    def read(self) -> tuple:
+        """Read consistent payload
+
+        Returns
+        -------
+        tuple
+            Sequence counter and payload (bytes, None if the last writer
+            died while writing)
+        """
+        while True:
+            try:
+                return self.__read()
+            except ValueError:
+                # Mapping was closed by a remap of another thread
+                continue
+
+    def __read(self) -> tuple:
+        """Read consistent payload from the current mapping
+
+        Returns
+        -------
+        tuple
+            Sequence counter and payload (see read)
+        """
+        while True:
+            sequence, length = self.__header.unpack_from(self.__mmap, 0)
+
+            # Writer is active, wait until its lock is released
+            if sequence % 2 == 1:
+                if self.__lockOwner == threading.get_ident():
+                    # Lock is held by the caller, so the writer died
+                    return sequence, None
+                fd = os.open(self.__filename, os.O_RDONLY)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_SH)
+                finally:
+                    os.close(fd)
+                if self.getSequence() == sequence:
+                    return sequence, None
+                continue
+
+            # File was enlarged by another process
+            if self.__header.size + length > len(self.__mmap):
+                self.__map()
+                continue
+
+            payload = bytes(
+                self.__mmap[self.__header.size:self.__header.size + length]
+            )
+
+            # Payload was not changed while reading
+            if self.getSequence() == sequence:
+                return sequence, payload
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Hold exclusive lock of the state across processes
+
+        Other processes can not write while the lock is held, so the state
+        could be read, changed and written atomically. The lock could be
+        nested by the same thread (e.g. write within lock).
+        """
+        with self.__writeLock:
+            if self.__lockDepth == 0:
+                fcntl.flock(self.__fd, fcntl.LOCK_EX)
+                self.__lockOwner = threading.get_ident()
+            self.__lockDepth += 1
+            try:
+                yield
+            finally:
+                self.__lockDepth -= 1
+                if self.__lockDepth == 0:
+                    self.__lockOwner = None
+                    fcntl.flock(self.__fd, fcntl.LOCK_UN)
+
+    def write(self, payload: bytes) -> int:
+        """Write payload and increase sequence counter
+
+        Parameters
+        ----------
+        payload : bytes
+            Payload to share
+
+        Returns
+        -------
+        int
+            New sequence counter
+        """
+        with self.lock():
+            # Enlarge file if payload does not fit
+            size = self.__header.size + len(payload)
+            if size > os.fstat(self.__fd).st_size:
+                os.ftruncate(self.__fd, size * 2)
+            if size > len(self.__mmap):
+                self.__map()
+
+            # Readers must not close the mapping while it is written
+            with self.__mapLock:
+                sequence = self.__header.unpack_from(self.__mmap, 0)[0]
+                if sequence % 2 == 1:
+                    # Previous writer died while writing
+                    sequence += 1
+
+                self.__header.pack_into(self.__mmap, 0, sequence + 1, 0)
+                self.__mmap[self.__header.size:size] = payload
+                self.__header.pack_into(
+                    self.__mmap, 0, sequence + 2, len(payload)
+                )
+
+            # Modification time tells if the state is newer than the api file
+            os.utime(self.__fd)
+
+        return sequence + 2
@@ -0,0 +1,242 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import urllib.parse
+
+import connexion
+
+import app.compression
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+
+class staticAssets:
+    """
+    Static files kept in memory with precompressed variants
+
+    All files below static/ are loaded once. Text files get compressed
+    variants (see app.compression), every variant has a strong ETag. Files
+    are also served under a fingerprinted name containing a hash of the content
+    (e.g. base.0123456789ab.css) which never changes and could be cached
+    forever by clients.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Directory with static files by type
+    __directory = 'static'
+
+    # Types of static files (directories)
+    __types = ('css', 'images', 'js')
+
+    # Length of the content hash in fingerprinted filenames
+    __hashLength = 12
+
+    # Content types of text files which are precompressed
+    __compressibleTypes = (
+        'text/', 'application/javascript', 'application/json',
+        'image/svg+xml'
+    )
+
+    # Cache-Control for fingerprinted and plain filenames
+    __cacheControlImmutable = 'public, max-age=31536000, immutable'
+    __cacheControlDefault = 'no-cache'
+
+    # Assets by type and filename (also by fingerprinted filename)
+    __assets = {}
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            logger.info('Load static files...')
+            singletonClass.__instance = \
+                super(staticAssets, singletonClass).__new__(singletonClass)
+            singletonClass.__load(singletonClass.__instance)
+        return singletonClass.__instance
+
+    def __load(self):
+        """Load all static files with compressed variants"""
+        for filetype in self.__types:
+            directory = os.path.join(self.__directory, filetype)
+            if not os.path.isdir(directory):
+                continue
+
+            for filename in sorted(os.listdir(directory)):
+                path = os.path.join(directory, filename)
+                if not os.path.isfile(path):
+                    continue
+
+                with open(path, 'rb') as f:
+                    asset = self.__buildAsset(filename, f.read())
+
+                self.__assets[(filetype, filename)] = asset
+                self.__assets[(filetype, asset['fingerprinted'])] = asset
+
+    def __buildAsset(self, filename: str, content: bytes) -> dict:
+        """Build asset with hashes and compressed variants
+
+        Parameters
+        ----------
+        filename : str
+            Name of the file
+        content : bytes
+            Content of the file
+
+        Returns
+        -------
+        dict
+            Asset with content type, fingerprinted filename and variants
+            (content and ETag) by content encoding (None = identity)
+        """
+        digest = hashlib.sha256(content).hexdigest()[:self.__hashLength]
+        name, extension = os.path.splitext(filename)
+        contentType = \
+            mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        variants = {None: (content, '"%s"' % digest)}
+        if contentType.startswith(self.__compressibleTypes):
+            for encoding in app.compression.encoders:
+                compressed = app.compression.compress(
+                    content, encoding, static=True
+                )
+                # Keep variant only if it is smaller
+                if len(compressed) < len(content):
+                    variants[encoding] = (
+                        compressed, '"%s-%s"' % (digest, encoding)
+                    )
+
+        return {
+            'contentType': contentType,
+            'fingerprinted': '%s.%s%s' % (name, digest, extension),
+            'variants': variants,
+        }
+
+    def getUrl(self, filetype: str, filename: str) -> str:
+        """Get relative url of the fingerprinted file
+
+        Parameters
+        ----------
+        filetype : str
+            Type of the file (css, images, js)
+        filename : str
+            Name of the file
+
+        Returns
+        -------
+        str
+            Url of the fingerprinted file (plain url if file is unknown)
+        """
+        try:
+            filename = self.__assets[(filetype, filename)]['fingerprinted']
+        except KeyError:
+            pass
+        return '%s/%s/%s' % (self.__directory, filetype, filename)
+
+    def getResponse(
+            self, filetype: str, filename: str, headers
+            ) -> connexion.lifecycle.ConnexionResponse:
+        """Build response for a static file
+
+        Parameters
+        ----------
+        filetype : str
+            Type of the file (css, images, js)
+        filename : str
+            Name of the file (plain or fingerprinted)
+        headers : Mapping
+            Request headers
+
+        Returns
+        -------
+        connexion.lifecycle.ConnexionResponse
+            File content, 304 if not modified or 404 if file is unknown
+        """
+        try:
+            asset = self.__assets[(filetype, filename)]
+        except KeyError:
+            return \
+                connexion.lifecycle.ConnexionResponse(
+                    status_code=404,
+                    body='The resource requested could not be found.',
+                    content_type='text/plain'
+                )
+
+        encoding = None
+        if len(asset['variants']) > 1:
+            encoding = app.compression.negotiate(
+                headers.get('Accept-Encoding', ''), asset['variants']
+            )
+        content, etag = asset['variants'][encoding]
+
+        responseHeaders = {
+            'ETag': etag,
+            'Cache-Control':
+                self.__cacheControlImmutable
+                if filename == asset['fingerprinted'] else
+                self.__cacheControlDefault,
+        }
+        if len(asset['variants']) > 1:
+            responseHeaders['Vary'] = 'Accept-Encoding'
+        if encoding is not None:
+            responseHeaders['Content-Encoding'] = encoding
+
+        ifNoneMatch = [
+            t.strip().removeprefix('W/')
+            for t in headers.get('If-None-Match', '').split(',')
+        ]
+        if etag in ifNoneMatch or '*' in ifNoneMatch:
+            return \
+                connexion.lifecycle.ConnexionResponse(
+                    status_code=304,
+                    headers=responseHeaders
+                )
+
+        return \
+            connexion.lifecycle.ConnexionResponse(
+                status_code=200,
+                body=content,
+                content_type=asset['contentType'],
+                headers=responseHeaders
+            )
+
+
+def staticUrl(url: str) -> str:
+    """
+    Jinja2 helper to get the fingerprinted url of a static file
+
+    Parameters
+    ----------
+    url : str
+        Type and name of the file (e.g. css/base.css) or absolute url of a
+        static file of this host (e.g. from the api data)
+
+    Returns
+    -------
+    str
+        Fingerprinted url (url unchanged if it is not a known static file of
+        this host)
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if not parsed.scheme and not parsed.netloc and \
+            not parsed.path.startswith('/'):
+        filetype, _, filename = url.partition('/')
+        return staticAssets().getUrl(filetype, filename)
+
+    # Rewrite only urls of this host, other servers could serve other files
+    if parsed.netloc and config().resolveHost(parsed.netloc) != \
+            connexion.request.headers.get('Host'):
+        return url
+
+    try:
+        _, directory, filetype, filename = parsed.path.split('/')
+    except ValueError:
+        return url
+    if directory != 'static':
+        return url
+
+    return urllib.parse.urlunsplit(
+        parsed._replace(path='/' + staticAssets().getUrl(filetype, filename))
+    )
@@ -1,25 +1,121 @@
+import asyncio
 import connexion
 import flask
-import os
+import time
 
+import app.metrics
+import app.templateFilters
+from app.config import config
 from app.data import data
+from app.history import sensorHistory
+from app.notificationQueue import notificationQueue
 from app.pluginCollection import pluginCollection
+from app.responseCache import responseCache
+from app.staticAssets import staticAssets
 
 
-def home() -> str:
+# Time spent rendering templates by template
+__renderSeconds = app.metrics.metrics().histogram(
+    'spacestatus_render_seconds',
+    'Time spent rendering templates',
+    ('template',)
+)
+
+
+def __renderTemplate(render, template: str, **context) -> str:
+    """Render template and record the duration
+
+    Parameters
+    ----------
+    render : callable
+        Function rendering a template with name and context
+    template : str
+        Name of the template
+
+    Returns
+    -------
+    str
+        Rendered template
+    """
+    started = time.perf_counter()
+    try:
+        return render(template, **context)
+    finally:
+        __renderSeconds.observe((template,), time.perf_counter() - started)
+
+
+def __getHomeTtl() -> int:
+    """Get time to live of the rendered home page (cache.home.ttl)
+
+    Returns
+    -------
+    int
+        Time to live in seconds (0 = until data changes)
+    """
+    try:
+        return config().getSection('cache')['home']['ttl']
+    except (KeyError, TypeError):
+        return 0
+
+
+def home() -> connexion.lifecycle.ConnexionResponse:
     """
     Response the request for / with a rendered html page
 
+    The rendered page is cached until the data of the host changes or the
+    optional time to live (cache.home.ttl) expired.
+
     Returns
     -------
-    string
-        Rendered output of home.html
+    connexion.lifecycle.ConnexionResponse
+        Rendered output of home.html (compressed if accepted)
     """
-    return \
-        flask.render_template(
-            'home.html',
-            data=data().get(connexion.request.headers['Host'], True)
-        )
+    host = connexion.request.headers['Host']
+
+    return __encodedResponse(
+        *responseCache().getEncoded(
+            host,
+            'home',
+            lambda: __renderTemplate(
+                flask.render_template,
+                'home.html',
+                data=data().get(host, True)
+            ),
+            connexion.request.headers.get('Accept-Encoding', ''),
+            __getHomeTtl()
+        ),
+        'text/html; charset=utf-8'
+    )
+
+
+async def homeAsync() -> connexion.lifecycle.ConnexionResponse:
+    """
+    Response the request for / with a rendered html page (async mode)
+
+    Returns
+    -------
+    connexion.lifecycle.ConnexionResponse
+        Rendered output of home.html (compressed if accepted)
+    """
+    host = connexion.request.headers['Host']
+
+    return __encodedResponse(
+        *await responseCache().getEncodedAsync(
+            host,
+            'home',
+            lambda: __renderTemplate(
+                lambda template, **context:
+                    app.templateFilters.getEnvironment().get_template(
+                        template
+                    ).render(**context),
+                'home.html',
+                data=data().get(host, True)
+            ),
+            connexion.request.headers.get('Accept-Encoding', ''),
+            __getHomeTtl()
+        ),
+        'text/html; charset=utf-8'
+    )
 
 
 def static(filetype, filename):
@@ -27,44 +123,79 @@ def static(filetype, filename):
     Response the request for /static to serve static files
     Filetype and Filename are filtered by openapi3 definition.
 
+    Files are served from memory (see staticAssets), fingerprinted filenames
+    as immutable.
+
     Returns
     -------
-    binary
+    connexion.lifecycle.ConnexionResponse
         File content
     """
-    response = \
-        flask.send_from_directory(
-            'static/%s' % filetype,
-            filename,
-            etag=True,
-            conditional=True
-        )
-    response.direct_passthrough = False
-    return response
+    return staticAssets().getResponse(
+        filetype, filename, connexion.request.headers
+    )
 
 
-def status() -> dict:
-    """Response the request for /status.json with the complete api output.
+async def staticAsync(filetype, filename):
+    """
+    Response the request for /static to serve static files (async mode)
+    Filetype and Filename are filtered by openapi3 definition.
 
     Returns
     -------
-    dict
-        Dictionary with all api data for the requested host
+    connexion.lifecycle.ConnexionResponse
+        File content
     """
-    return data().get(connexion.request.headers['Host'])
+    return static(filetype, filename)
+
 
+def __encodedResponse(
+        content: bytes, encoding: str, contentType: str = 'application/json'
+        ) -> connexion.lifecycle.ConnexionResponse:
+    """Build response for pre-serialized (and compressed) content
+
+    Parameters
+    ----------
+    content : bytes
+        Encoded response content
+    encoding : str
+        Content encoding (None if not compressed)
+    contentType : str
+        Content type
 
-def statusMinimal() -> dict:
+    Returns
+    -------
+    connexion.lifecycle.ConnexionResponse
+        Response with content
     """
-    Response the request for /status-minimal.json with
-    a minimal status output.
+    # Content type as header, Flask would add a second charset to the
+    # content type parameter
+    headers = {'Content-Type': contentType, 'Vary': 'Accept-Encoding'}
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+
+    return \
+        connexion.lifecycle.ConnexionResponse(
+            status_code=200,
+            body=content,
+            headers=headers
+        )
+
+
+def __getStatusMinimal(host: str) -> dict:
+    """Build minimal status output
+
+    Parameters
+    ----------
+    host : str
+        Hostname
 
     Returns
     -------
     dict
-        Dictionary with minimal status data for the requested host
+        Dictionary with minimal status data for the host
     """
-    json = data().get(connexion.request.headers['Host'])
+    json = data().get(host)
     minimal = {
         'open': json['state']['open'],
         'icon':
@@ -75,6 +206,165 @@ def statusMinimal() -> dict:
     return minimal
 
 
+def status() -> connexion.lifecycle.ConnexionResponse:
+    """Response the request for /status.json with the complete api output.
+
+    Returns
+    -------
+    connexion.lifecycle.ConnexionResponse
+        Pre-serialized json with all api data for the requested host
+        (compressed if accepted)
+    """
+    host = connexion.request.headers['Host']
+    return __encodedResponse(
+        *responseCache().getJson(
+            host,
+            'status',
+            lambda: data().get(host),
+            connexion.request.headers.get('Accept-Encoding', '')
+        )
+    )
+
+
+async def statusAsync() -> connexion.lifecycle.ConnexionResponse:
+    """Response the request for /status.json (async mode)
+
+    Returns
+    -------
+    connexion.lifecycle.ConnexionResponse
+        Pre-serialized json with all api data for the requested host
+        (compressed if accepted)
+    """
+    host = connexion.request.headers['Host']
+    return __encodedResponse(
+        *await responseCache().getJsonAsync(
+            host,
+            'status',
+            lambda: data().get(host),
+            connexion.request.headers.get('Accept-Encoding', '')
+        )
+    )
+
+
+def statusMinimal() -> connexion.lifecycle.ConnexionResponse:
+    """
+    Response the request for /status-minimal.json with
+    a minimal status output.
+
+    Returns
+    -------
+    connexion.lifecycle.ConnexionResponse
+        Pre-serialized json with minimal status data for the requested host
+    """
+    host = connexion.request.headers['Host']
+    return __encodedResponse(
+        *responseCache().getJson(
+            host,
+            'statusMinimal',
+            lambda: __getStatusMinimal(host),
+            connexion.request.headers.get('Accept-Encoding', '')
+        )
+    )
+
+
+async def statusMinimalAsync() -> connexion.lifecycle.ConnexionResponse:
+    """Response the request for /status-minimal.json (async mode)
+
+    Returns
+    -------
+    connexion.lifecycle.ConnexionResponse
+        Pre-serialized json with minimal status data for the requested host
+    """
+    host = connexion.request.headers['Host']
+    return __encodedResponse(
+        *await responseCache().getJsonAsync(
+            host,
+            'statusMinimal',
+            lambda: __getStatusMinimal(host),
+            connexion.request.headers.get('Accept-Encoding', '')
+        )
+    )
+
+
+def events():
+    """
+    Fallback for /status/events, which is served by app.events.eventMiddleware
+
+    Returns
+    -------
+    tuple
+        Error response
+    """
+    return 'Event stream not available', 404
+
+
+def __history(sensor: str, location: str, step: int, parameters: dict):
+    """Build response with history of a sensor
+
+    Parameters
+    ----------
+    sensor : str
+        Sensor type
+    location : str
+        Location of the sensor
+    step : int
+        Resolution in seconds
+    parameters : dict
+        Further query parameters (from, to)
+
+    Returns
+    -------
+    dict or tuple
+        History of the sensor or error response
+    """
+    if not sensorHistory().isEnabled():
+        return 'Sensor history not enabled', 404
+
+    end = parameters.get('to') or int(time.time())
+    start = parameters.get('from') or end - 86400
+
+    return {
+        'location': location,
+        'from': start,
+        'to': end,
+        'step': step,
+        'values': sensorHistory().query(
+            connexion.request.headers['Host'],
+            sensor,
+            location,
+            start,
+            end,
+            step
+        )
+    }
+
+
+def temperatureHistory(location: str, step: int = 0, **parameters):
+    """
+    Response the request for /sensors/temperature/history with
+    aggregated temperature values of a location.
+
+    Returns
+    -------
+    dict
+        Timestamp, average, minimum and maximum by step
+    """
+    return __history('temperature', location, step, parameters)
+
+
+def peopleNowPresentHistory(location: str = '', step: int = 0, **parameters):
+    """
+    Response the request for /sensors/people_now_present/history with
+    aggregated number of present people.
+
+    Returns
+    -------
+    dict
+        Timestamp, average, minimum and maximum by step
+    """
+    return __history('people_now_present', location, step, parameters)
+
+
 def __updateTemperature(host: str, body: dict):
     """Update sensor temperature data
 
@@ -95,6 +385,81 @@ def __updateTemperature(host: str, body: dict):
         pass
 
 
+def __updateStatus(host: str, body: dict) -> bool:
+    """Update all status fields atomically
+
+    Parameters
+    ----------
+    host : str
+        Hostname
+    body : dict
+        Received api data
+
+    Returns
+    -------
+    bool
+        Open state changed
+    """
+    with data().transaction(host):
+        # Update current sensor people data
+        data().setSensorsPeople(host, body['sensors']['people_now_present'])
+
+        # Update current sensor temperature data
+        __updateTemperature(host, body)
+
+        # Update open state if changes
+        stateChanged = data().getStateOpen(host) != body['state']['open']
+        if stateChanged:
+            data().setStateOpen(host, body['state']['open'])
+
+        # Update or remove state message
+        try:
+            data().setStateMessage(host, body['state']['message'])
+        except KeyError:
+            data().setStateMessage(host, None)
+
+        data().setStateLastchange(host, body['state']['lastchange'])
+
+    return stateChanged
+
+
+def __setStatus(host: str, body: dict) -> bool:
+    """Update all status fields and persist them
+
+    Blocks on the data lock (and the shared state file lock), so it runs
+    in a worker thread in async mode.
+
+    Parameters
+    ----------
+    host : str
+        Hostname
+    body : dict
+        Received api data
+
+    Returns
+    -------
+    bool
+        Open state changed
+    """
+    stateChanged = __updateStatus(host, body)
+    data().commit(host, critical=stateChanged)
+    return stateChanged
+
+
+def __setTemperature(host: str, body: dict):
+    """Update temperature sensors and persist them (see __setStatus)
+
+    Parameters
+    ----------
+    host : str
+        Hostname
+    body : dict
+        Received api data
+    """
+    __updateTemperature(host, body)
+    data().commit(host)
+
+
 def set(body: dict):
     """Set data received by api
 
@@ -106,28 +471,40 @@ def set(body: dict):
     # Get requested host
     host = connexion.request.headers['Host']
 
-    # Update current sensor people data
-    data().setSensorsPeople(host, body['sensors']['people_now_present'])
-
-    # Update current sensor temperature data
-    __updateTemperature(host, body)
+    stateChanged = __setStatus(host, body)
 
-    # Update open state if changes
-    if (data().getStateOpen(host) != body['state']['open']):
-        data().setStateOpen(host, body['state']['open'])
-        # Run plugin hook
+    # Run plugin hook
+    if stateChanged:
         pluginCollection().onStateOpenChangeForHost(
             host, body['state']['open']
         )
 
-    # Update or remove state message
-    try:
-        data().setStateMessage(host, body['state']['message'])
-    except KeyError:
-        data().setStateMessage(host, None)
+    return connexion.NoContent, 200
 
-    data().setStateLastchange(host, body['state']['lastchange'])
-    data().commit(host)
+
+async def setAsync(body: dict):
+    """Set data received by api (async mode)
+
+    Updating and writing the data and running the plugin hook is done by
+    worker threads, so the event loop never waits for the data lock.
+
+    Parameters
+    ----------
+    body : dict
+        Received api data
+    """
+    # Get requested host
+    host = connexion.request.headers['Host']
+
+    stateChanged = await asyncio.to_thread(__setStatus, host, body)
+
+    # Run plugin hook
+    if stateChanged:
+        await asyncio.to_thread(
+            pluginCollection().onStateOpenChangeForHost,
+            host,
+            body['state']['open']
+        )
 
     return connexion.NoContent, 200
 
@@ -144,8 +521,70 @@ def setTemperature(body: dict):
     host = connexion.request.headers['Host']
 
     # Update current sensor temperature data
-    __updateTemperature(host, body)
+    __setTemperature(host, body)
 
-    data().commit(host)
+    return connexion.NoContent, 200
+
+
+async def setTemperatureAsync(body: dict):
+    """Set data received by api (async mode)
+
+    Parameters
+    ----------
+    body : dict
+        Received api data
+    """
+    # Get requested host
+    host = connexion.request.headers['Host']
+
+    # Update current sensor temperature data in a worker thread
+    await asyncio.to_thread(__setTemperature, host, body)
 
     return connexion.NoContent, 200
+
+
+def notifications() -> dict:
+    """Get pending plugin notifications of the requested host
+
+    Returns
+    -------
+    dict
+        Queue depth and age of the oldest notification by plugin
+    """
+    # Get requested host
+    host = connexion.request.headers['Host']
+
+    return notificationQueue().getStatistics(host)
+
+
+def plugins() -> dict:
+    """Get readiness of the plugins enabled for the requested host
+
+    Returns
+    -------
+    dict
+        Readiness (pending, ready or failed) by plugin name
+    """
+    # Get requested host
+    host = connexion.request.headers['Host']
+
+    return pluginCollection().getReadiness(host)
+
+
+def metrics() -> connexion.lifecycle.ConnexionResponse:
+    """Response the request for /metrics with all metrics of the process
+
+    Returns
+    -------
+    connexion.lifecycle.ConnexionResponse
+        Metrics in the prometheus text exposition format (404 if disabled)
+    """
+    if not config().getSection('metrics').get('enabled', True):
+        return 'Metrics not enabled', 404
+
+    return \
+        connexion.lifecycle.ConnexionResponse(
+            status_code=200,
+            body=app.metrics.metrics().render(),
+            content_type='text/plain; version=0.0.4'
+        )
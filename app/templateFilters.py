@@ -1,4 +1,11 @@
+import connexion
 import datetime
+import jinja2
+
+from app.staticAssets import staticUrl
+
+# Jinja2 environment if not provided by flask (async mode)
+__environment = None
 
 
 def templateStrftime(value: int, formatString: str) -> str:
@@ -20,13 +27,39 @@ def templateStrftime(value: int, formatString: str) -> str:
     return datetime.datetime.fromtimestamp(value).strftime(formatString)
 
 
+def getEnvironment() -> jinja2.Environment:
+    """
+    Get jinja2 environment for applications without flask
+
+    Returns
+    -------
+    jinja2.Environment
+        Environment with own filters
+    """
+    global __environment
+
+    if __environment is None:
+        __environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader('templates'),
+            autoescape=jinja2.select_autoescape()
+        )
+        __environment.filters['strftime'] = templateStrftime
+        __environment.globals['staticUrl'] = staticUrl
+
+    return __environment
+
+
 def initialize(app):
     """
-    Initialize jinja2 filters
+    Initialize jinja2 filters and globals
 
     Parameters
     ----------
     app : connexion / flask
         Connexion/Flask app
     """
-    app.app.jinja_env.filters['strftime'] = templateStrftime
+    if isinstance(app, connexion.FlaskApp):
+        app.app.jinja_env.filters['strftime'] = templateStrftime
+        app.app.jinja_env.globals['staticUrl'] = staticUrl
+    else:
+        getEnvironment()
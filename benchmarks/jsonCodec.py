@@ -0,0 +1,125 @@
+"""
+JSON codec benchmark of spacestatus-server
+
+Compares the json codecs (app.jsonCodec) encoding and decoding the example
+api file and a large generated SpaceAPI document with many sensors,
+contacts, feeds and projects.
+
+Usage: python benchmarks/jsonCodec.py [--number N] [--sensors N]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+__root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, __root)
+
+import app.jsonCodec  # noqa: E402
+
+
+def __largeDocument(template: dict, sensors: int) -> dict:
+    """Build large SpaceAPI document based on the example api file"""
+    document = json.loads(json.dumps(template))
+    document['contact'].update({
+        'keymasters': [
+            {
+                'name': 'Keymaster %d' % i,
+                'irc_nick': 'keymaster%d' % i,
+                'email': 'keymaster%d@example.org' % i,
+            }
+            for i in range(20)
+        ],
+    })
+    document['feeds'] = {
+        name: {'type': 'rss', 'url': 'https://example.org/%s.xml' % name}
+        for name in ('blog', 'wiki', 'calendar', 'flickr')
+    }
+    document['projects'] = [
+        'https://example.org/projects/%d' % i for i in range(50)
+    ]
+    document['sensors'] = {
+        'temperature': [
+            {
+                'value': 20.5 + i / 10,
+                'unit': '°C',
+                'location': 'Room %d' % i,
+                'name': 'Sensor %d' % i,
+                'description': 'Temperature in room %d' % i,
+                'lastchange': 1700000000 + i,
+            }
+            for i in range(sensors)
+        ],
+        'humidity': [
+            {'value': 40 + i % 20, 'unit': '%', 'location': 'Room %d' % i}
+            for i in range(sensors)
+        ],
+        'people_now_present': [
+            {
+                'value': 3,
+                'location': 'Room %d' % i,
+                'names': ['Member %d' % n for n in range(3)],
+            }
+            for i in range(sensors // 4)
+        ],
+        'network_connections': [
+            {'value': i, 'type': 'wifi', 'location': 'Room %d' % i}
+            for i in range(sensors // 4)
+        ],
+    }
+    return document
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--number', type=int, default=0,
+                        help='Iterations per measurement (default: auto)')
+    parser.add_argument('--sensors', type=int, default=200)
+    arguments = parser.parse_args()
+
+    with open(os.path.join(
+        __root, 'config', 'apidata', 'status.example.org.json'
+    ), 'rb') as f:
+        example = json.loads(f.read())
+
+    documents = {
+        'example': example,
+        'large': __largeDocument(example, arguments.sensors),
+    }
+    operations = {
+        'dumps indent': lambda c, d, e: c.dumps(d, indent=True),
+        'dumps sorted': lambda c, d, e: c.dumps(
+            d, indent=True, sortKeys=True
+        ),
+        'dumps compact': lambda c, d, e: c.dumps(d),
+        'loads': lambda c, d, e: c.loads(e),
+    }
+
+    print('%-8s %-14s %9s  %s' % (
+        'document', 'operation', 'size (B)',
+        '  '.join('%12s' % ('%s (us)' % n) for n in app.jsonCodec.codecs)
+    ))
+    for documentName, document in documents.items():
+        encoded = app.jsonCodec.stdlibCodec.dumps(document, indent=True)
+        for operationName, operation in operations.items():
+            times = []
+            for codec in app.jsonCodec.codecs.values():
+                timer = timeit.Timer(
+                    lambda: operation(codec, document, encoded)
+                )
+                number = arguments.number or timer.autorange()[0]
+                times.append(
+                    min(timer.repeat(5, number)) / number * 1000000
+                )
+            print('%-8s %-14s %9d  %s' % (
+                documentName, operationName, len(encoded),
+                '  '.join('%12.1f' % t for t in times)
+            ))
+
+    if len(app.jsonCodec.codecs) == 1:
+        print('orjson is not installed, only stdlib was measured')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,493 @@
+"""
+Load and latency benchmark of spacestatus-server
+
+Runs a mixed workload against a copy of the repository with a generated
+configuration (many hosts, plugins talking to local fake Mastodon, Matrix
+and Twitter servers), either in-process through the ASGI interface of
+initApp() or under uvicorn with N worker processes. Reports throughput and
+latency percentiles per endpoint and writes the results as json, which
+could be compared with the results of another commit (--compare).
+
+Runs offline, only local servers are contacted.
+
+Usage: python benchmarks/load.py [--mode inprocess|uvicorn] [--workers N]
+           [--async] [--hosts N] [--requests N] [--concurrency N]
+           [--verbose] [--output FILE] [--compare FILE]
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import http.server
+import importlib.metadata
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import yaml
+
+# Root of the repository
+__root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Share of requests by endpoint
+__mix = {
+    'home': 20,
+    'status': 30,
+    'statusMinimal': 25,
+    'static': 15,
+    'put': 10,
+}
+
+# Packages reported with the results
+__packages = ('connexion', 'flask', 'starlette', 'uvicorn', 'werkzeug')
+
+
+class __fakeServer(http.server.BaseHTTPRequestHandler):
+    """
+    Fake Mastodon, Matrix and Twitter api
+
+    Every request is answered with one object containing the fields the
+    clients read from credential checks, logins, joins and posts.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # Response for all requests
+    __response = json.dumps({
+        'id': '1',
+        'id_str': '1',
+        'acct': 'spacestatus',
+        'username': 'spacestatus',
+        'display_name': 'spacestatus',
+        'screen_name': 'spacestatus',
+        'content': 'status',
+        'text': 'status',
+        'version': '4.2.0',
+        'user_id': '@spacestatus:localhost',
+        'access_token': 'TOKEN',
+        'device_id': 'BENCHMARK',
+        'room_id': '!room:localhost',
+        'event_id': '$event',
+    }).encode('utf-8')
+
+    def log_message(self, *args):
+        pass
+
+    def __reply(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.__response)))
+        self.end_headers()
+        self.wfile.write(self.__response)
+
+    do_GET = do_POST = do_PUT = __reply
+
+
+class __threadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def __startFakeServer() -> str:
+    """Start fake api server in a thread and return its url"""
+    server = __threadingServer(('127.0.0.1', 0), __fakeServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+def __createTree(directory: str, arguments) -> str:
+    """Copy repository and create configuration for the benchmark"""
+    tree = os.path.join(directory, 'tree')
+    shutil.copytree(
+        __root, tree,
+        ignore=shutil.ignore_patterns('.git', 'benchmarks', 'cache')
+    )
+    os.makedirs(os.path.join(tree, 'config', 'cache'), exist_ok=True)
+
+    apidata = os.path.join(tree, 'config', 'apidata')
+    template = os.path.join(apidata, 'status.example.org.json')
+    configuration = {
+        'server': {
+            'async': arguments.async_,
+            'configreload': 0,
+        },
+        'ratelimit': {'enabled': False},
+        # Deliver plugin notifications during the benchmark
+        'notifications': {'coalesce': 0},
+        'sharedstate': {'enabled': arguments.workers > 1},
+        # Show log records of the app only with --verbose
+        'logging': {'level': 'INFO' if arguments.verbose else 'WARNING'},
+        'hosts': {},
+    }
+
+    plugins = {}
+    if not arguments.no_plugins:
+        plugins = {
+            'mastodon': {
+                'enabled': True,
+                'base_url': __startFakeServer(),
+                'access_token': 'TOKEN',
+            },
+            'matrix': {
+                'enabled': True,
+                'homeserver': __startFakeServer(),
+                'username': '@spacestatus:localhost',
+                'password': 'PASSWORD',
+                'room': '!room:localhost',
+            },
+            'twitter': {
+                'enabled': True,
+                'base_url': __startFakeServer(),
+                'access': {'token': 'TOKEN', 'secret': 'SECRET'},
+                'consumer': {'key': 'KEY', 'secret': 'SECRET'},
+            },
+        }
+
+    for host in __getHosts(arguments.hosts):
+        shutil.copy(template, os.path.join(apidata, host + '.json'))
+        configuration['hosts'][host] = {
+            'file': host + '.json',
+            'key': 'KEY-' + host,
+            'plugins': {
+                name: dict(
+                    pluginConfig,
+                    sessioncache='config/cache/matrix-%s' % host
+                ) if name == 'matrix' else pluginConfig
+                for name, pluginConfig in plugins.items()
+            },
+        }
+
+    with open(os.path.join(tree, 'config', 'config.yaml'), 'w') as f:
+        yaml.dump(configuration, f)
+
+    return tree
+
+
+def __getHosts(hosts: int) -> list:
+    return ['host%d.example.org' % i for i in range(hosts)]
+
+
+def __getRequests(arguments, staticUrls: list) -> list:
+    """Build reproducible list of requests (endpoint, method, url, host,
+    headers, body)"""
+    generator = random.Random(arguments.seed)
+    hosts = __getHosts(arguments.hosts)
+    endpoints = list(__mix)
+    weights = [__mix[e] for e in endpoints]
+    states = {}
+
+    requests = []
+    for endpoint in generator.choices(
+        endpoints, weights, k=arguments.requests + arguments.warmup
+    ):
+        host = generator.choice(hosts)
+        headers = {'Host': host, 'Accept-Encoding': 'gzip, br'}
+        body = None
+        method = 'GET'
+        if endpoint == 'home':
+            url = '/'
+        elif endpoint == 'status':
+            url = '/status.json'
+        elif endpoint == 'statusMinimal':
+            url = '/status-minimal.json'
+        elif endpoint == 'static':
+            url = generator.choice(staticUrls)
+        else:
+            method = 'PUT'
+            url = '/api/v1/status'
+            headers['X-Hackspace-API-Key'] = 'KEY-' + host
+            # Change state now and then to trigger plugin notifications
+            states[host] = states.get(host, False) ^ \
+                (generator.random() < 0.2)
+            body = {
+                'state': {
+                    'open': states[host],
+                    'lastchange': 1700000000 + len(requests),
+                },
+                'sensors': {
+                    'people_now_present': [
+                        {'value': generator.randint(0, 10)}
+                    ],
+                },
+            }
+        requests.append((endpoint, method, url, host, headers, body))
+
+    return requests
+
+
+async def __run(client: httpx.AsyncClient, requests: list, arguments):
+    """Send requests with a fixed number of concurrent clients"""
+    latencies = {endpoint: [] for endpoint in __mix}
+    errors = {endpoint: 0 for endpoint in __mix}
+    position = 0
+
+    async def worker(measure: bool, end: int):
+        nonlocal position
+        while position < end:
+            endpoint, method, url, _, headers, body = requests[position]
+            position += 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(
+                    method, url, headers=headers, json=body
+                )
+                await response.aread()
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            if measure:
+                latencies[endpoint].append(time.perf_counter() - started)
+                errors[endpoint] += failed
+
+    # Warm up caches, connections and plugin setup
+    await asyncio.gather(*[
+        worker(False, arguments.warmup)
+        for _ in range(arguments.concurrency)
+    ])
+
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        worker(True, len(requests)) for _ in range(arguments.concurrency)
+    ])
+    return time.perf_counter() - started, latencies, errors
+
+
+def __summarize(latencies: list, errors: int, duration: float) -> dict:
+    """Get throughput and latency percentiles in milliseconds"""
+    if len(latencies) < 2:
+        latencies = latencies * 2 or [0, 0]
+    quantiles = statistics.quantiles(
+        latencies, n=100, method='inclusive'
+    )
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / duration, 1),
+        'mean': round(statistics.mean(latencies) * 1000, 3),
+        'p50': round(quantiles[49] * 1000, 3),
+        'p95': round(quantiles[94] * 1000, 3),
+        'p99': round(quantiles[98] * 1000, 3),
+        'max': round(max(latencies) * 1000, 3),
+    }
+
+
+def __getStaticUrls(tree: str) -> list:
+    """Get fingerprinted urls of static files like linked by home page"""
+    sys.path.insert(0, tree)
+    from app.staticAssets import staticAssets
+
+    cwd = os.getcwd()
+    os.chdir(tree)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            assets = staticAssets()
+        return [
+            '/' + assets.getUrl(filetype, filename)
+            for filetype, filename in (
+                ('css', 'base.css'), ('css', 'amazium.css'),
+                ('css', 'layout.css'), ('images', 'favicon.png'),
+                ('images', 'status_open.png'),
+                ('images', 'status_closed.png'), ('images', 'logo.png'),
+            )
+        ]
+    finally:
+        os.chdir(cwd)
+
+
+def __loadApp(tree: str, verbose: bool):
+    """Initialize the app in this process (module __init__ of the tree)"""
+    os.chdir(tree)
+    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        spec = importlib.util.spec_from_file_location(
+            'main', os.path.join(tree, '__init__.py')
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module.app
+
+
+def __waitForNotifications(hosts: list, timeout: float = 30):
+    """Wait until the in-process app delivered all plugin notifications"""
+    from app.notificationQueue import notificationQueue
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and any(
+        statistics['depth']
+        for host in hosts
+        for statistics in notificationQueue().getStatistics(host).values()
+    ):
+        time.sleep(0.1)
+
+
+def __startUvicorn(tree: str, workers: int) -> tuple:
+    """Start uvicorn with workers and wait until it accepts requests"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'uvicorn', '__init__:app',
+            '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(workers), '--no-access-log',
+            '--log-level', 'warning',
+        ],
+        cwd=tree,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    url = 'http://127.0.0.1:%d' % port
+    for _ in range(300):
+        try:
+            httpx.get(url + '/status.json', timeout=1)
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('uvicorn did not start')
+
+
+def __getVersions() -> dict:
+    versions = {'python': platform.python_version()}
+    for package in __packages:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            pass
+    try:
+        versions['commit'] = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=__root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return versions
+
+
+def __print(results: dict, compare: dict = None):
+    print('%-14s %8s %6s %10s %9s %9s %9s %9s' % (
+        'endpoint', 'requests', 'errors', 'req/s',
+        'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'max (ms)'
+    ))
+    for endpoint, summary in results['endpoints'].items():
+        print('%-14s %8d %6d %10.1f %9.2f %9.2f %9.2f %9.2f' % (
+            endpoint, summary['requests'], summary['errors'],
+            summary['throughput'], summary['p50'], summary['p95'],
+            summary['p99'], summary['max']
+        ))
+        if compare and endpoint in compare['endpoints']:
+            old = compare['endpoints'][endpoint]
+            print('%-14s %8s %6s %9.0f%% %8.0f%% %8.0f%% %8.0f%% %8.0f%%' % (
+                '  vs %s' % compare['versions'].get('commit', 'compare'),
+                '', '',
+                *[
+                    (summary[k] / old[k] - 1) * 100 if old[k] else 0
+                    for k in ('throughput', 'p50', 'p95', 'p99', 'max')
+                ]
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mode', choices=['inprocess', 'uvicorn'],
+                        default='inprocess')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes of uvicorn')
+    parser.add_argument('--async', dest='async_', action='store_true',
+                        help='Use async mode (server.async)')
+    parser.add_argument('--hosts', type=int, default=20)
+    parser.add_argument('--no-plugins', action='store_true')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show output of the app (in-process)')
+    parser.add_argument('--output', help='Write results as json')
+    parser.add_argument('--compare', help='Results json to compare with')
+    arguments = parser.parse_args()
+
+    if arguments.mode == 'inprocess' and arguments.workers > 1:
+        parser.error('--workers requires --mode uvicorn')
+
+    with tempfile.TemporaryDirectory() as directory:
+        tree = __createTree(directory, arguments)
+        requests = __getRequests(arguments, __getStaticUrls(tree))
+
+        process = None
+        if arguments.mode == 'inprocess':
+            transport = httpx.ASGITransport(
+                app=__loadApp(tree, arguments.verbose)
+            )
+            url = 'http://benchmark'
+        else:
+            process, url = __startUvicorn(tree, arguments.workers)
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=arguments.concurrency
+                )
+            )
+
+        async def run():
+            async with httpx.AsyncClient(
+                transport=transport, base_url=url, timeout=30
+            ) as client:
+                return await __run(client, requests, arguments)
+
+        try:
+            with contextlib.redirect_stdout(
+                sys.stdout if arguments.verbose else io.StringIO()
+            ):
+                duration, latencies, errors = asyncio.run(run())
+            if process is None:
+                # Notifications must not be written after the tree is removed
+                __waitForNotifications(__getHosts(arguments.hosts))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    allLatencies = [t for values in latencies.values() for t in values]
+    results = {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'versions': __getVersions(),
+        'settings': {
+            k.rstrip('_'): v for k, v in vars(arguments).items()
+            if k not in ('output', 'compare')
+        },
+        'duration': round(duration, 3),
+        'endpoints': {
+            endpoint: __summarize(values, errors[endpoint], duration)
+            for endpoint, values in latencies.items()
+        },
+    }
+    results['endpoints']['total'] = __summarize(
+        allLatencies, sum(errors.values()), duration
+    )
+
+    compare = None
+    if arguments.compare:
+        with open(arguments.compare, 'r') as f:
+            compare = json.load(f)
+    __print(results, compare)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
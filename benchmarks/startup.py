@@ -0,0 +1,118 @@
+"""
+Startup benchmark of spacestatus-server
+
+Measures the cold start (import and initApp) and the memory of a worker
+process with lazy and full plugin discovery. All plugins are configured
+but disabled, so only the discovery differs.
+
+Usage: python benchmarks/startup.py [--runs N] [--hosts N]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import yaml
+
+# Code run in a fresh interpreter to measure one cold start
+__child = '''
+import contextlib, io, importlib.util, json, resource, sys, time
+sys.path.insert(0, '.')
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    spec = importlib.util.spec_from_file_location('main', '__init__.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+startup = time.perf_counter() - started
+print(json.dumps({
+    'startup': startup,
+    'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+    'plugins': sorted(
+        m.split('.')[-1] for m in sys.modules if m.startswith('app.plugins.')
+    ),
+}))
+'''
+
+
+def __createTree(directory: str, hosts: int, discovery: str) -> str:
+    """Copy repository and create configuration for the benchmark"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tree = os.path.join(directory, discovery)
+    shutil.copytree(
+        root, tree,
+        ignore=shutil.ignore_patterns('.git', 'benchmarks', 'cache')
+    )
+    os.makedirs(os.path.join(tree, 'config', 'cache'), exist_ok=True)
+
+    apidata = os.path.join(tree, 'config', 'apidata')
+    template = os.path.join(apidata, 'status.example.org.json')
+    configuration = {
+        'server': {'plugindiscovery': discovery},
+        'hosts': {},
+    }
+    for i in range(hosts):
+        host = 'host%d.example.org' % i
+        shutil.copy(template, os.path.join(apidata, host + '.json'))
+        configuration['hosts'][host] = {
+            'file': host + '.json',
+            'key': 'KEY%d' % i,
+            'plugins': {
+                'mastodon': {'enabled': False},
+                'matrix': {'enabled': False},
+                'twitter': {'enabled': False},
+            },
+        }
+
+    with open(os.path.join(tree, 'config', 'config.yaml'), 'w') as f:
+        yaml.dump(configuration, f)
+
+    return tree
+
+
+def __run(tree: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, '-c', __child],
+        cwd=tree,
+        capture_output=True,
+        check=True,
+        text=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--hosts', type=int, default=10)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(
+            '%-6s %12s %12s %12s %8s  %s' % (
+                'mode', 'median (ms)', 'min (ms)', 'maxrss (MB)',
+                'modules', 'plugin modules'
+            )
+        )
+        for discovery in ('all', 'lazy'):
+            tree = __createTree(directory, arguments.hosts, discovery)
+            results = [__run(tree) for _ in range(arguments.runs)]
+            startups = [r['startup'] * 1000 for r in results]
+            print(
+                '%-6s %12.1f %12.1f %12.1f %8d  %s' % (
+                    discovery,
+                    statistics.median(startups),
+                    min(startups),
+                    statistics.median(r['maxrss'] for r in results) / 1024,
+                    results[-1]['modules'],
+                    ', '.join(results[-1]['plugins']) or '-'
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()